@@ -4,7 +4,12 @@
 import sys
 import argparse
 from moodle import synchronize
-from moodle.settings import BASE_DIR, DESCRIPTION
+from moodle.settings import (BASE_DIR, DESCRIPTION, MOODLE_CONCURRENCY,
+                             MOODLE_POOL_SIZE, MOODLE_TIMEOUT)
+
+
+# exit code telling sync.sh that the hub has to be restarted
+RESTART_REQUIRED: int = 3
 
 
 def path_type(json_path: typing.Union[str, Path]) -> Path:
@@ -42,9 +47,61 @@ def path_type(json_path: typing.Union[str, Path]) -> Path:
 If not specified, all data will be processed in-memory.
 ''')
 
+parser.add_argument('--pool_size', type=int, help='''
+Number of keep-alive connections to Moodle.
+''', default=MOODLE_POOL_SIZE)
+
+parser.add_argument('--timeout', type=float, help='''
+Timeout of every Moodle API call in seconds.
+''', default=MOODLE_TIMEOUT)
+
+parser.add_argument('--concurrency', type=int, help='''
+Number of courses which enrolments are fetched from Moodle at once.
+''', default=MOODLE_CONCURRENCY)
+
+parser.add_argument('--incremental', action='store_true', help='''
+Apply only changes since the previous synchronization.
+The first incremental run processes everything and stores a snapshot.
+''')
+
+parser.add_argument('--deep_verify', action='store_true', help='''
+Verify ownership of every file in users' home directories.
+By default, only homes with a wrong owner of the top directory are fixed.
+''')
+
+parser.add_argument('--rotate_tokens', nargs='+', default=(), metavar='COURSE_ID', help='''
+Issue new API tokens for services of the listed courses.
+Other services keep their tokens across synchronizations.
+''')
+
+parser.add_argument('--hub_api', action='store_true', help=f'''
+Apply users, admins and groups to the running hub through its REST API.
+The hub has to be restarted only if services have changed.
+Exits with code {RESTART_REQUIRED} when the hub has to be restarted.
+''')
+
+parser.add_argument('--pipeline', action='store_true', help='''
+Process every course as soon as its enrolments are fetched from Moodle,
+while enrolments of the next courses are still being fetched.
+Users and permissions are provisioned in batches of courses meanwhile.
+''')
+
 args = parser.parse_args()
 
 if args.path_out:
     args.path_out = BASE_DIR / args.path_out
 
-synchronize(json_in=args.path_in, json_out=args.path_out)
+restart = synchronize(
+    json_in=args.path_in,
+    json_out=args.path_out,
+    pool_size=args.pool_size,
+    timeout=args.timeout,
+    concurrency=args.concurrency,
+    incremental=args.incremental,
+    deep_verify=args.deep_verify,
+    rotate_tokens=args.rotate_tokens,
+    hub_api=args.hub_api,
+    pipeline=args.pipeline,
+)
+
+sys.exit(RESTART_REQUIRED if restart else 0)
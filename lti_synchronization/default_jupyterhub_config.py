@@ -1,5 +1,4 @@
 import os
-from typing import List
 from unittest.mock import MagicMock
 
 from jupyterhub.spawner import LocalProcessSpawner
@@ -88,33 +87,28 @@
 
 c.LocalProcessSpawner.shell_cmd = ['bash', '-l', '-c']
 
-LOCAL_UNIX_USERS: List[str] = []
-
 
 def pre_spawn_hook(spawner: LocalProcessSpawner) -> None:
     '''Creates UNIX user if one is not presented on the system.
-    Updates global variable LOCAL_UNIX_USERS after the call.
+    Users are looked up in the in-process passwd index,
+    which is reloaded only when /etc/passwd changes.
 
     Args:
         spawner: .
 
     '''
 
-    global LOCAL_UNIX_USERS
-
     username: str = spawner.user.name
 
     spawner.log.warning(f'Spawning server for {username!r}')
 
-    if username not in LOCAL_UNIX_USERS and 'grader' not in username:
+    if username not in system.passwd and 'grader' not in username:
 
         spawner.log.info(f'Creating UNIX user for {username!r}')
 
         system.create_user(username)
         system.chown(username, f'/home/{username}')
 
-    LOCAL_UNIX_USERS = system.get_unix_usernames()
-
 
 def bind_auth_state(spawner: LocalProcessSpawner, auth_state: dict) -> None:
     '''Short summary.
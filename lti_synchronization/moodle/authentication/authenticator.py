@@ -9,7 +9,7 @@
 from moodle.typehints import JsonType
 from oauthenticator.oauth2 import OAuthenticator
 from tornado.web import HTTPError
-from traitlets import Unicode
+from traitlets import Bool, Unicode
 
 from moodle.utils import dump_json
 
@@ -55,6 +55,15 @@ class LTI13Authenticator(OAuthenticator):
         initial login request.''',
     ).tag(config=True)
 
+    verify_jwt = Bool(
+        True,
+        help='''
+        Verify signature of the id token with the platform's public key.
+        The platform's JWKS is cached by the validator, so verification
+        does not add a request to the platform on every launch.
+        ''',
+    ).tag(config=True)
+
     async def authenticate(
                     self,
                     handler: LTI13LoginHandler,
@@ -93,7 +102,7 @@ async def authenticate(
         jwt_decoded = await self.validator.jwt_verify_and_decode(
             id_token,
             self.endpoint,
-            verify=False,
+            verify=self.verify_jwt,
             audience=self.client_id,
         )
         self.log.debug(f'Decoded JWT is {dump_json(jwt_decoded)}')
@@ -103,14 +112,14 @@ async def authenticate(
             jwt_course_id = jwt_decoded[f'{purl}/context']['label']
             course_id = self.helper.format_string(jwt_course_id)
 
-            self.log.debug('Normalized course label is %s' % course_id)
+            self.log.debug('Normalized course label is %s', course_id)
             self.log.debug(json.dumps(jwt_decoded, indent=2))
 
             raw_username = jwt_decoded[purl + '/ext']['user_username']
             username = self.helper.email_to_username(raw_username)
 
             # ensure the username is normalized
-            self.log.debug('username is %s' % username)
+            self.log.debug('username is %s', username)
 
             if username == '':
                 raise HTTPError('Unable to set the username')
@@ -5,8 +5,10 @@
 import typing as t
 from urllib.parse import quote, unquote, urlparse
 
+import jwt
 from loguru import logger
 from moodle.authentication.helper import LTIHelper
+from moodle.authentication.nonce import get_nonce_store
 from moodle.authentication.validator import LTI13LaunchValidator
 from moodle.utils import dump_json
 from oauthenticator.oauth2 import (STATE_COOKIE_NAME, OAuthCallbackHandler,
@@ -16,6 +18,15 @@
 from tornado.web import HTTPError, RequestHandler
 
 
+def get_nonce(state: str) -> str:
+    '''
+    Nonce sent to the platform is derived from the login state,
+    so the callback can recompute it from the returned state.
+    '''
+
+    return hashlib.sha256(state.encode()).hexdigest()
+
+
 class LTI13LoginHandler(OAuthLoginHandler):
     '''
     Handles JupyterHub authentication requests according to the
@@ -185,12 +196,10 @@ def post(self) -> None:
 
             self.set_state_cookie(state)
 
-            # TODO: validate that received nonces haven't been received before
-            # and that they are within the time-based tolerance window
+            nonce = get_nonce(state)
 
-            nonce_raw = hashlib.sha256(state.encode())
-
-            nonce = nonce_raw.hexdigest()
+            # the callback accepts the nonce once within the tolerance window
+            get_nonce_store().issue(nonce)
 
             self.authorize_redirect(
                 client_id=client_id,
@@ -214,6 +223,24 @@ async def post(self):
 
         self.check_state()
 
+        # the signature is verified by the authenticator afterwards,
+        # so a forged nonce claim fails the login anyway
+        try:
+            claims = jwt.decode(self.get_argument('id_token'), verify=False)
+        except jwt.InvalidTokenError:
+            raise HTTPError(400, 'Invalid id_token')
+
+        nonce: t.Optional[str] = claims.get('nonce')
+
+        # the id_token must be issued for this login request,
+        # a token replayed under a new state carries a nonce of another one
+        if nonce != get_nonce(self.get_argument('state')):
+            raise HTTPError(403, 'Nonce does not match the login request')
+
+        # reject replayed and outdated launches
+        if not get_nonce_store().consume(nonce):
+            raise HTTPError(403, 'Login request has expired or was already used')
+
         user = await self.login_user()
 
         self.log.debug(f'user logged in: {user}')
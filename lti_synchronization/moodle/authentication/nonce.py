@@ -0,0 +1,233 @@
+'''
+Replay protection for the LTI 1.3 login flow.
+
+Every login request issues a nonce which is sent to the platform and
+expected back in the callback. A nonce is accepted by the callback only
+once, and only within the tolerance window after it was issued.
+
+Nonces are issued with the same lifetime, so the insertion order is also
+the expiry order. Both backends rely on it: expired nonces are evicted
+from the oldest end, a few at a time, instead of scanning the whole store.
+'''
+
+import sqlite3
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+
+from custom_inherit import DocInheritMeta
+from loguru import logger
+
+from moodle.settings import LTI13_NONCE_DB, LTI13_NONCE_MAX_SIZE, LTI13_NONCE_WINDOW
+from moodle.typehints import PathLike
+
+
+class NonceStore(metaclass=DocInheritMeta(style='google_with_merge', include_special_methods=True)):
+    '''
+    Bounded store of issued nonces.
+
+    Args:
+        window (float): Seconds a nonce is valid after it was issued.
+            Defaults to LTI13_NONCE_WINDOW.
+        max_size (int): Maximum number of stored nonces. The oldest
+            ones are evicted first. Defaults to LTI13_NONCE_MAX_SIZE.
+    '''
+
+    def __init__(
+                self,
+                window: float = LTI13_NONCE_WINDOW,
+                max_size: int = LTI13_NONCE_MAX_SIZE,
+            ) -> None:
+
+        if window <= 0 or max_size < 1:
+            raise ValueError('Window and maximum size must be positive.')
+
+        self.window = window
+        self.max_size = max_size
+
+    def issue(self, nonce: str) -> None:
+        '''
+        Store a new nonce.
+
+        Args:
+            nonce (str): Nonce sent to the platform.
+        '''
+        raise NotImplementedError
+
+    def consume(self, nonce: str) -> bool:
+        '''
+        Accept the nonce received from the platform and forget it.
+
+        Args:
+            nonce (str): Nonce received in the callback.
+
+        Returns:
+            bool: False if the nonce was never issued,
+                has expired, or has already been consumed.
+        '''
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryNonceStore(NonceStore):
+    '''
+    Nonces kept in the hub process, lost on restart.
+    '''
+
+    _nonces: 'OrderedDict[str, float]'
+
+    def __init__(self, *args: t.Any, **kwargs: t.Any) -> None:
+
+        super().__init__(*args, **kwargs)
+
+        self._nonces = OrderedDict()
+
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float) -> None:
+        '''
+        Drop expired nonces from the oldest end.
+        '''
+
+        while self._nonces:
+
+            nonce, expires_at = next(iter(self._nonces.items()))
+
+            if expires_at > now:
+                break
+
+            del self._nonces[nonce]
+
+    def issue(self, nonce: str) -> None:
+
+        now = time.monotonic()
+
+        with self._lock:
+
+            self._expire(now)
+
+            self._nonces.pop(nonce, None)
+
+            self._nonces[nonce] = now + self.window
+
+            while len(self._nonces) > self.max_size:
+                self._nonces.popitem(last=False)
+
+    def consume(self, nonce: str) -> bool:
+
+        now = time.monotonic()
+
+        with self._lock:
+
+            self._expire(now)
+
+            return self._nonces.pop(nonce, None) is not None
+
+    def __len__(self) -> int:
+        return len(self._nonces)
+
+
+class SQLiteNonceStore(NonceStore):
+    '''
+    Nonces kept in a SQLite database, shared across hub restarts.
+
+    Expired rows are deleted together with every issued nonce,
+    using the index on the expiration time, so the cost of eviction
+    is spread over inserts. Rowids grow with every insert, so the rows
+    exceeding the maximum size are a range of the oldest rowids.
+
+    Args:
+        path (PathLike): Path to the database file.
+    '''
+
+    def __init__(self, path: PathLike, *args: t.Any, **kwargs: t.Any) -> None:
+
+        super().__init__(*args, **kwargs)
+
+        self.path = str(path)
+
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+
+        self._db.execute('PRAGMA journal_mode=WAL')
+
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS nonces '
+            '(nonce TEXT PRIMARY KEY, expires_at REAL NOT NULL)'
+        )
+
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS nonces_expires_at ON nonces (expires_at)'
+        )
+
+        self._db.commit()
+
+    def issue(self, nonce: str) -> None:
+
+        # wall clock time, the database outlives the process
+        now = time.time()
+
+        with self._lock, self._db:
+
+            self._db.execute(
+                'DELETE FROM nonces WHERE expires_at <= ?', (now,)
+            )
+
+            cursor = self._db.execute(
+                'INSERT OR REPLACE INTO nonces VALUES (?, ?)', (nonce, now + self.window)
+            )
+
+            self._db.execute(
+                'DELETE FROM nonces WHERE rowid <= ?', (cursor.lastrowid - self.max_size,)
+            )
+
+    def consume(self, nonce: str) -> bool:
+
+        with self._lock, self._db:
+
+            cursor = self._db.execute(
+                'DELETE FROM nonces WHERE nonce = ? AND expires_at > ?', (nonce, time.time())
+            )
+
+            return cursor.rowcount > 0
+
+    def __len__(self) -> int:
+
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM nonces').fetchone()[0]
+
+    def close(self) -> None:
+        self._db.close()
+
+
+_store: t.Optional[NonceStore] = None
+
+
+def get_nonce_store() -> NonceStore:
+    '''
+    Get the nonce store shared by login and callback handlers.
+    SQLite backend is used if LTI13_NONCE_DB is set.
+
+    Returns:
+        NonceStore: Process-wide nonce store.
+    '''
+
+    global _store
+
+    if _store is None:
+
+        if LTI13_NONCE_DB:
+
+            logger.info(f'Storing LTI 1.3 nonces in {LTI13_NONCE_DB!r}')
+
+            _store = SQLiteNonceStore(LTI13_NONCE_DB)
+
+        else:
+
+            _store = MemoryNonceStore()
+
+    return _store
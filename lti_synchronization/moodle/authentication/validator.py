@@ -1,4 +1,7 @@
+import asyncio
 import json
+import re
+import time
 import typing as t
 
 import jwt
@@ -9,6 +12,7 @@
 from oauthlib.oauth1.rfc5849 import signature
 from tornado.httpclient import AsyncHTTPClient
 from tornado.web import HTTPError
+from traitlets import Integer
 from traitlets.config import LoggingConfigurable
 from moodle.utils import dump_json
 
@@ -16,27 +20,93 @@
 purl: str = 'https://purl.imsglobal.org/spec/lti/claim/'
 
 
+class PlatformKeys:
+    '''
+    Parsed public keys of the platform indexed by kid.
+
+    Args:
+        keys (t.Dict[str, t.Any]): Key objects by kid.
+        ttl (float): Seconds the keys are considered fresh.
+    '''
+
+    def __init__(self, keys: t.Dict[str, t.Any], ttl: float) -> None:
+
+        self.keys = keys
+
+        self.fetched_at = time.monotonic()
+
+        self.expires_at = self.fetched_at + ttl
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+
 class LTI13LaunchValidator(LoggingConfigurable):
     '''
     Allows JupyterHub to verify LTI 1.3 compatible requests as a tool
     (known as a tool provider with LTI 1.1).
+
+    The platform's JWKS is cached per endpoint, so verifying a launch
+    does not make a request to the platform. Keys are kept for
+    ``max-age`` of the Cache-Control header or ``jwks_ttl`` seconds.
+    A token signed with an unknown kid (the platform rotated its keys)
+    refreshes the cache, but not more often than ``jwks_refresh_interval``.
     '''
 
-    async def _retrieve_matching_jwk(
-        self, endpoint: str, header_kid: str, /, verify: bool = True
-    ) -> t.Any:
+    jwks_ttl = Integer(
+        300,
+        help='''
+        Seconds the platform's JWKS is cached
+        if the response has no Cache-Control max-age.
+        ''',
+    ).tag(config=True)
+
+    jwks_refresh_interval = Integer(
+        30,
+        help='''
+        Minimum seconds between two fetches of the platform's JWKS
+        caused by an unknown kid.
+        ''',
+    ).tag(config=True)
+
+    def __init__(self, **kwargs: t.Any) -> None:
+
+        super().__init__(**kwargs)
+
+        self._platform_keys: t.Dict[str, PlatformKeys] = {}
+
+        self._jwks_locks: t.Dict[str, asyncio.Lock] = {}
+
+    def clear_jwks_cache(self) -> None:
+        '''
+        Drop all cached platform keys.
         '''
-        Retrieves the matching cryptographic key from the platform as a
-        JSON Web Key (JWK).
 
-        Args:
-            endpoint (str): platform jwks endpoint
-            header_kid (str):
-            verify (bool): whether or not to verify certificate. Defaults to True.
+        self._platform_keys.clear()
+        self._jwks_locks.clear()
 
-        Returns:
-            def: .
+    def _get_ttl(self, cache_control: t.Optional[str]) -> float:
+        '''
+        Get freshness lifetime from the Cache-Control header value.
+        '''
+
+        if not cache_control:
+            return self.jwks_ttl
+
+        if re.search(r'no-cache|no-store', cache_control):
+            return 0
+
+        max_age = re.search(r'max-age=(\d+)', cache_control)
+
+        return int(max_age.group(1)) if max_age else self.jwks_ttl
 
+    async def _fetch_platform_keys(self, endpoint: str, verify: bool) -> PlatformKeys:
+        '''
+        Fetch the platform's JWKS and parse every key.
+
+        Raises:
+            ValueError: The platform returned an empty JWKS.
         '''
 
         client = AsyncHTTPClient()
@@ -50,18 +120,74 @@ async def _retrieve_matching_jwk(
         if not platform_jwks or 'keys' not in platform_jwks:
             raise ValueError('Platform endpoint returned an empty jwks')
 
-        key = None
+        keys = {
+            jwk['kid']: jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
+            for jwk in platform_jwks['keys']
+            if 'kid' in jwk
+        }
+
+        return PlatformKeys(keys, self._get_ttl(resp.headers.get('Cache-Control')))
+
+    async def _get_platform_keys(
+        self, endpoint: str, /, header_kid: t.Optional[str] = None, verify: bool = True
+    ) -> PlatformKeys:
+        '''
+        Get cached keys of the platform, fetching them if they are expired,
+        or if ``header_kid`` is unknown and the refresh is not rate limited.
+        Concurrent launches wait for a single fetch.
+        '''
+
+        def is_stale(cached: t.Optional[PlatformKeys]) -> bool:
+
+            if cached is None or cached.expired:
+                return True
+
+            return (
+                header_kid not in cached.keys
+                and time.monotonic() - cached.fetched_at >= self.jwks_refresh_interval
+            )
+
+        cached = self._platform_keys.get(endpoint)
+
+        if not is_stale(cached):
+            return cached
+
+        async with self._jwks_locks.setdefault(endpoint, asyncio.Lock()):
+
+            # keys could be fetched by another launch while waiting
+            cached = self._platform_keys.get(endpoint)
+
+            if is_stale(cached):
+
+                cached = await self._fetch_platform_keys(endpoint, verify)
 
-        for jwk in platform_jwks['keys']:
+                self._platform_keys[endpoint] = cached
 
-            if jwk['kid'] != header_kid:
-                continue
+        return cached
 
-            key = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
+    async def _retrieve_matching_jwk(
+        self, endpoint: str, header_kid: str, /, verify: bool = True
+    ) -> t.Any:
+        '''
+        Retrieves the matching cryptographic key from the platform as a
+        JSON Web Key (JWK).
 
-            self.log.debug('Get keys from jwks dict  %s' % key)
+        Args:
+            endpoint (str): platform jwks endpoint
+            header_kid (str): key id from the JWT header
+            verify (bool): whether or not to verify certificate. Defaults to True.
 
-        print(key, '!' * 100)
+        Returns:
+            def: Public key object.
+
+        Raises:
+            ValueError: The platform has no key with such kid.
+
+        '''
+
+        platform_keys = await self._get_platform_keys(endpoint, header_kid, verify=verify)
+
+        key = platform_keys.keys.get(header_kid)
 
         if not key:
 
@@ -71,6 +197,8 @@ async def _retrieve_matching_jwk(
 
             raise ValueError(error_msg)
 
+        self.log.debug('Get keys from jwks dict  %s' % key)
+
         return key
 
     async def jwt_verify_and_decode(
@@ -132,7 +260,7 @@ async def jwt_verify_and_decode(
             % (id_token, key_from_jwks, verify)
         )
 
-        return jwt.decode(id_token, key=str(key_from_jwks), verify=False, audience=audience, algorithms=['HS256'])
+        return jwt.decode(id_token, key=key_from_jwks, audience=audience, algorithms=['RS256'])
 
     def is_deep_link_launch(self, jwt_decoded: t.Dict[str, t.Any]) -> bool:
         '''
@@ -1,17 +1,38 @@
+import json
 import os
+import queue
+import threading
 import typing as t
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import suppress
+from itertools import islice
 
 from loguru import logger
+from moodle import models
 from moodle.client.base import BaseAPIClient
 from moodle.client.helper import MoodleDataHelper
+from moodle.errors import MoodleAPIException, MoodlePermissionError
+from moodle.integration import system
 from moodle.utils import save_moodle_courses
-from moodle.response import FluidResponse
-from moodle.settings import ROLES
+from moodle.response import FluidResponse, StreamingResponse
+from moodle.helper import USER_FIELDS
+from moodle.settings import (COURSE_IDS_FILE, MOODLE_CONCURRENCY, MOODLE_ONLY_ACTIVE,
+                             MOODLE_PAGE_SIZE, MOODLE_POOL_SIZE, PIPELINE_QUEUE_SIZE, ROLES)
 from moodle.typehints import Course, PathLike, User, Filters
 from moodle.utils import log_load_data
 
 
+# Courses requested by Moodle ids at once.
+IDS_BATCH_SIZE: int = 100
+
+
+class _Cancelled(Exception):
+    '''
+    The consumer of streamed courses has stopped.
+    '''
+
+
 class MoodleClient(BaseAPIClient):
     '''Client for fetch the data from the Moodle LMS.
 
@@ -23,6 +44,19 @@ class MoodleClient(BaseAPIClient):
     in the production enviroment is highly encouraged, because of its flexible
     mechanism to determine which course should use Jupyterhub and / or nbgrader.
 
+    Args:
+        concurrency (:obj:`int`, optional):
+            Number of courses which enrolments are fetched at once.
+            Defaults to settings.MOODLE_CONCURRENCY.
+        page_size (:obj:`int`, optional):
+            Number of enrolments fetched per request, 0 fetches a course
+            at once. Defaults to settings.MOODLE_PAGE_SIZE.
+        only_active (:obj:`bool`, optional):
+            Skip suspended enrolments. Defaults to settings.MOODLE_ONLY_ACTIVE.
+        ids_path (:obj:`PathLike`, optional):
+            File with Moodle ids of synchronized courses, rewritten by every
+            ``load_courses`` call. Defaults to settings.COURSE_IDS_FILE.
+
     Attributes:
         functions:
             Tuple of functions need to be enabled in
@@ -31,6 +65,7 @@ class MoodleClient(BaseAPIClient):
 
     functions: t.Tuple[str, ...] = (
         'core_course_get_courses',
+        'core_course_get_courses_by_field',
         'core_enrol_get_enrolled_users',
     )
 
@@ -40,10 +75,44 @@ class MoodleClient(BaseAPIClient):
 
     users: t.Dict[str, User]
 
-    def __init__(self, *args: t.Any, **kwargs: t.Any):
+    concurrency: int
+
+    page_size: int
+
+    only_active: bool
+
+    ids_path: PathLike
+
+    def __init__(
+                self,
+                *args: t.Any,
+                concurrency: int = MOODLE_CONCURRENCY,
+                page_size: int = MOODLE_PAGE_SIZE,
+                only_active: bool = MOODLE_ONLY_ACTIVE,
+                ids_path: t.Optional[PathLike] = None,
+                **kwargs: t.Any,
+            ):
+
+        if concurrency < 1:
+            raise ValueError('concurrency must be a positive integer.')
+
+        if page_size < 0:
+            raise ValueError('page_size must not be negative.')
+
+        # every worker should have its own keep-alive connection
+        kwargs['pool_size'] = max(
+            concurrency, kwargs.get('pool_size', MOODLE_POOL_SIZE))
 
         super().__init__(*args, **kwargs)
 
+        self.concurrency = concurrency
+
+        self.page_size = page_size
+
+        self.only_active = only_active
+
+        self.ids_path = ids_path or COURSE_IDS_FILE
+
         self.helper = MoodleDataHelper()
         self.courses = []
         self.users = {}
@@ -53,6 +122,10 @@ def __init__(self, *args: t.Any, **kwargs: t.Any):
     def _get_users(self, course: Course) -> t.Generator[User, None, None]:
         '''Fetches users from a course and creates generator with them.
 
+        Only the fields consumed by the helper are requested. Enrolments
+        are fetched in pages of ``page_size`` users, and every page is
+        decoded one user at a time while it is received.
+
         Args:
             course: Object with 'title' and 'id' attributes.
 
@@ -61,30 +134,197 @@ def _get_users(self, course: Course) -> t.Generator[User, None, None]:
 
         '''
 
-        resp: FluidResponse = self.call('core_enrol_get_enrolled_users',
-                                        courseid=course.id)
+        options: t.List[t.Dict[str, t.Any]] = [
+            {'name': 'userfields', 'value': ','.join(USER_FIELDS)},
+        ]
 
-        logger.debug(
-            f'course {course.title!r} has {len(resp)} enrolled participants.')
+        if self.only_active:
+            options.append({'name': 'onlyactive', 'value': 1})
+
+        offset: int = 0
+
+        while True:
+
+            page = options
 
-        for raw_user in resp:
+            if self.page_size:
+                page = options + [
+                    {'name': 'limitfrom', 'value': offset},
+                    {'name': 'limitnumber', 'value': self.page_size},
+                ]
 
-            yield self.helper.format_user(raw_user)
+            resp: StreamingResponse = self.call('core_enrol_get_enrolled_users',
+                                                stream=True, courseid=course.id, options=page)
+
+            received: int = 0
+
+            for user in self.helper.format_users(resp):
+
+                received += 1
+
+                yield user
+
+            offset += received
+
+            if not self.page_size or received < self.page_size:
+                break
+
+        logger.debug(
+            f'course {course.title!r} has {offset} enrolled participants.')
 
     def _get_courses(self) -> t.Generator[Course, None, None]:
         '''Fetches all courses from Moodle and creates generator with them.
 
+        Courses are decoded one at a time while the response is received.
+
         Returns:
             Generator with formatted courses.
 
         '''
 
-        resp: FluidResponse = self.call('core_course_get_courses')
+        resp: StreamingResponse = self.call('core_course_get_courses', stream=True)
 
         for raw_course in resp:
 
             yield self.helper.format_course(raw_course)
 
+    def _get_courses_by_field(self, field: str, value: t.Any) -> t.List[Course]:
+        '''Fetches courses matching the field from Moodle.
+
+        Args:
+            field (str): One of id, ids, shortname, idnumber or category.
+            value (t.Any): Value of the field.
+
+        Returns:
+            t.List[Course]: Formatted courses.
+        '''
+
+        resp: FluidResponse = self.call('core_course_get_courses_by_field',
+                                        field=field, value=value)
+
+        return [self.helper.format_course(raw_course) for raw_course in resp['courses']]
+
+    def _find_courses(
+                self,
+                course_ids: t.Iterable[str],
+                categories: t.Iterable[int] = (),
+                known_ids: t.Optional[t.Dict[str, int]] = None,
+            ) -> t.Generator[Course, None, None]:
+        '''Fetches only the listed courses and courses of the categories.
+
+        The listed ids are normalized short names, Moodle can't match them
+        itself. Courses synchronized before are requested by their Moodle
+        ids instead, IDS_BATCH_SIZE courses per request, and every category
+        with one request. Courses not found this way, like the ones added
+        since the previous synchronization, or every course if the function
+        is not enabled, are looked up in the list of all courses.
+
+        Args:
+            course_ids (t.Iterable[str]): Normalized short names.
+            categories (t.Iterable[int]): Category ids. Defaults to empty tuple.
+            known_ids (t.Optional[t.Dict[str, int]]):
+                Moodle ids of normalized short names (see ``read_course_ids``).
+                Defaults to None.
+
+        Yields:
+            Course: Every found course once.
+        '''
+
+        missing: t.Set[str] = set(course_ids)
+
+        categories = set(categories)
+
+        known_ids = known_ids or {}
+
+        seen: t.Set[str] = set()
+
+        ids: t.List[int] = sorted({known_ids[course_id] for course_id in missing if course_id in known_ids})
+
+        lookups = [
+            ('ids', ','.join(map(str, ids[offset:offset + IDS_BATCH_SIZE])))
+            for offset in range(0, len(ids), IDS_BATCH_SIZE)
+        ]
+        lookups += [('category', category) for category in sorted(categories)]
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+
+                for (field, _), courses in zip(
+                    lookups,
+                    executor.map(lambda lookup: self._get_courses_by_field(*lookup), lookups),
+                ):
+
+                    for course in courses:
+
+                        # renamed since the previous synchronization
+                        if field == 'ids' and course.course_id not in missing:
+                            continue
+
+                        missing.discard(course.course_id)
+
+                        if course.course_id not in seen:
+                            seen.add(course.course_id)
+                            yield course
+
+            categories = set()
+
+        except (MoodleAPIException, MoodlePermissionError) as exc:
+            logger.warning(f'Cannot fetch courses by field: {exc}')
+
+        if not missing and not categories:
+            return
+
+        logger.info(f'Fetching all courses to find {len(missing)} courses by normalized short name.')
+
+        for course in self._get_courses():
+
+            if course.course_id in seen:
+                continue
+
+            if course.course_id in missing or course.category in categories:
+                seen.add(course.course_id)
+                yield course
+
+    def read_course_ids(self) -> t.Dict[str, int]:
+        '''Reads Moodle ids of courses found by the previous synchronization.
+
+        Returns:
+            t.Dict[str, int]: Moodle id of every normalized short name,
+                empty if the file does not exist or can't be read.
+        '''
+
+        if not os.path.exists(self.ids_path):
+            return {}
+
+        try:
+            with open(self.ids_path, 'r') as f:
+                return {str(course_id): int(id) for course_id, id in json.loads(f.read()).items()}
+
+        except (OSError, ValueError, TypeError, AttributeError) as exc:
+
+            logger.warning(f'Cannot read ids of synchronized courses: {exc}')
+
+            return {}
+
+    def save_course_ids(self) -> None:
+        '''Saves Moodle ids of the loaded courses for the next synchronization.
+
+        The file is replaced atomically and only if the ids have changed.
+        A failed save is logged, the next synchronization looks the courses
+        up in the list of all courses then.
+        '''
+
+        try:
+            system.write_file(self.ids_path, json.dumps(
+                {course.course_id: course.id for course in self.courses},
+                sort_keys=True,
+                separators=(',', ':'),
+            ))
+
+        except OSError as exc:
+
+            logger.warning(f'Cannot save ids of synchronized courses: {exc}')
+
     def get_categories(self) -> t.List[t.Tuple[str, str, str]]:
         '''Gets course title, short name, and category id for every course.
 
@@ -150,7 +390,7 @@ def use_categories(self) -> None:
                              'get_categories method.')
 
     @log_load_data('courses')
-    def load_courses(self, json_in: dict) -> None:
+    def load_courses(self, json_in: dict, known_ids: t.Optional[t.Dict[str, int]] = None) -> None:
         '''Store courses from Moodle to self.courses
 
         There is two ways to select only courses that needs Jupyterhub
@@ -185,7 +425,14 @@ def load_courses(self, json_in: dict) -> None:
             Note that you can mix filters keywords and categories to filter
             the courses that already were filtered by categories.
 
+        Only the listed courses and courses of the categories are requested
+        from Moodle, not every course of the site (see ``_find_courses``).
+
         Args:
+            json_in (dict): Short names of courses using jupyterhub and nbgrader.
+            known_ids (t.Optional[t.Dict[str, int]]):
+                Moodle ids of courses synchronized before. Defaults to None,
+                which reads them from ``ids_path``.
             **filters:
                 key-value pairs where value can be both single value or list
                 of valid items.
@@ -193,19 +440,156 @@ def load_courses(self, json_in: dict) -> None:
 
         course_ids = set(json_in['jupyterhub']) | set(json_in['nbgrader'])
 
-        for course in self._get_courses():
+        categories: t.Tuple[int, ...] = self._cats if self._use_categories else ()
 
-            if course.course_id not in course_ids:
-                continue
+        if known_ids is None:
+            known_ids = self.read_course_ids()
+
+        for course in self._find_courses(course_ids, categories, known_ids):
 
-            course.need_nbgrader = course.course_id in json_in['nbgrader']
+            course.need_nbgrader = (
+                course.course_id in json_in['nbgrader']
+                or (bool(categories) and course.category == categories[1])
+            )
 
             self.courses.append(course)
 
-    @log_load_data('users')
-    def load_users(self) -> None:
+        self.save_course_ids()
+
+    def _merge_users(self, course: Course, users: t.Iterable[User]) -> None:
+        '''Stores course's users to self.users and the course's groups.
+
+        A user enrolled in several courses is stored once, every course
+        refers to the same user with its own role. Roles of all the users
+        are resolved at once, and unknown roles are reported once per course.
+
+        Args:
+            course (Course): Course the users are enrolled in.
+            users (t.Iterable[User]): Users returned by ``_get_users``.
+        '''
+
+        users = [
+            user if isinstance(user, models.User) else models.User.from_dict(user)
+            for user in users
+        ]
+
+        resolved, unknown = self.helper.resolve_roles(user.roles or () for user in users)
+
+        if unknown:
+            logger.warning(f'Unknown roles in course {course.course_id!r} are ignored: {unknown}')
+
+        for user, role in zip(users, resolved):
+
+            user.roles = None
+
+            stored = self.users.setdefault(user.username, user)
+
+            if stored.email != user.email:
+                logger.warning(
+                    f'Users {sorted((stored.email, user.email))} share the username {user.username!r}')
+
+            if role is not None:
+
+                rank, group = role
+
+                course[group].append(models.Enrolment(stored, rank))
+
+    def _release(self, course: Course) -> None:
+        '''Drops enrolments of a course that is already saved or processed.
+
+        Users of the course are forgotten as well, a user enrolled in one
+        of the next courses is stored again by ``_merge_users``.
+
+        Args:
+            course (Course): Course to be released.
+        '''
+
+        for group in models.GROUPS:
+
+            for user in course[group]:
+                self.users.pop(user.username, None)
+
+            course[group] = []
+
+    def iter_courses(self, release: bool = False) -> t.Generator[Course, None, None]:
         '''Iterates through self.courses and fetches users from that courses.
 
+        Every course is yielded as soon as its users are merged, so it can be
+        saved or processed before enrolments of the next courses are received.
+
+        If ``release`` is set, enrolments of a course are dropped as soon as
+        the next one is requested, so memory does not grow with the number
+        of courses. Users shared between courses are not detected then.
+
+        If the client's concurrency is greater than one, enrolments are
+        fetched by a pool of ``concurrency`` threads. Courses are yielded
+        in the order of self.courses anyway, so the result does not depend
+        on which request finished first.
+
+        At most ``concurrency`` courses are fetched ahead of the consumer,
+        the next course is submitted only when a fetched one is taken,
+        so a slow consumer pauses the fetching as well.
+
+        Args:
+            release (bool): Drop enrolments of consumed courses. Defaults to False.
+
+        Yields:
+            Course: Course with users stored into its groups.
+        '''
+
+        if self.concurrency == 1 or len(self.courses) < 2:
+
+            for course in self.courses:
+
+                self._merge_users(course, self._get_users(course))
+
+                yield course
+
+                if release:
+                    self._release(course)
+
+            return
+
+        def _fetch(course: Course) -> t.List[User]:
+            return list(self._get_users(course))
+
+        courses: t.Iterator[Course] = iter(self.courses)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+
+            # futures are taken in order of submission
+            pending: t.Deque[t.Tuple[Course, Future]] = deque(
+                (course, executor.submit(_fetch, course))
+                for course in islice(courses, self.concurrency)
+            )
+
+            try:
+                while pending:
+
+                    course, future = pending.popleft()
+
+                    users = future.result()
+
+                    for following in islice(courses, 1):
+                        pending.append((following, executor.submit(_fetch, following)))
+
+                    self._merge_users(course, users)
+
+                    yield course
+
+                    if release:
+                        self._release(course)
+
+            finally:
+
+                # the consumer has stopped or fetching failed,
+                # skip courses that are not started yet
+                for _, future in pending:
+                    future.cancel()
+
+    def load_users(self, json_out: t.Optional[PathLike] = None) -> None:
+        '''Fetches users of every course in self.courses.
+
         We've got a lot of information about users from Moodle, but we don't
         need so much in Jupyterhub. To make it compact and helpful, we
         fetch users iteratively and find the role with the highest rank for
@@ -214,25 +598,142 @@ def load_users(self) -> None:
         After the method called, users stores into courses' groups respectively
         to users' roles.
 
+        If ``json_out`` is set, every course is written to the file as soon
+        as its users are fetched, and its enrolments are dropped afterwards,
+        so courses should be read back from the file.
+
+        Args:
+            json_out (t.Optional[PathLike]):
+                If set, every course is written to the file
+                as soon as its users are fetched. Defaults to None.
+        '''
+
+        logger.info('Loading users ...')
+
+        if json_out:
+
+            count: int = save_moodle_courses(self.iter_courses(release=True), json_out)
+
+            logger.info(f'Saved users of {count} courses.')
+
+            return
+
+        for _ in self.iter_courses():
+            pass
+
+        logger.info(f'Loaded {len(self.users)} users.')
+
+    def stream_courses(
+                self,
+                json_in: dict,
+                json_out: t.Optional[PathLike] = None,
+                maxsize: int = PIPELINE_QUEUE_SIZE,
+            ) -> t.Generator[Course, None, None]:
+        '''Fetches courses in a background thread and yields every course
+        as soon as its users are fetched.
+
+        The consumer, usually SyncManager, processes a course while
+        enrolments of the next ones are being fetched. At most ``maxsize``
+        courses wait in the queue, so a slow consumer pauses the fetching
+        instead of accumulating courses in memory.
+
+        Errors of the fetching thread are raised in the consumer. If the
+        consumer stops early, the fetching thread is stopped as well.
+
+        Enrolments of a course are dropped when the consumer requests the
+        next one, so a processed course should not be read again. Courses
+        are handed over only after they are written to ``json_out``.
+
+        Args:
+            json_in (dict): Courses to be fetched (see ``load_courses``).
+            json_out (t.Optional[PathLike]):
+                If set, courses are saved to the file as well. Defaults to None.
+            maxsize (int):
+                Number of courses fetched ahead of the consumer.
+                Defaults to settings.PIPELINE_QUEUE_SIZE.
+
+        Yields:
+            Course: Course with users stored into its groups.
         '''
 
-        for course in self.courses:
+        if maxsize < 1:
+            raise ValueError('maxsize must be a positive integer.')
+
+        self.load_courses(json_in)
+
+        courses: queue.Queue = queue.Queue(maxsize=maxsize)
+
+        stop = threading.Event()
+
+        done = object()
 
-            for user in self._get_users(course):
+        def _put(item: t.Any) -> None:
 
-                user_roles = user.pop('roles', None)
+            while not stop.is_set():
+                try:
+                    courses.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
 
-                if user.username not in self.users:
-                    self.users[user.username] = user
+            raise _Cancelled
 
-                if user_roles:
+        def _hand_over(iterable: t.Iterable[Course]) -> t.Generator[Course, None, None]:
 
-                    # Find the most crucial role in a list
-                    user.role: str = self.helper.find_highest_role(user_roles)
+            for course in iterable:
 
-                    group: str = self.helper.get_user_group(user)
+                # saved before the consumer may release it
+                yield course
 
-                    course[group].append(user)
+                _put(course)
+
+        def _produce() -> None:
+
+            try:
+                handed: t.Iterator[Course] = _hand_over(self.iter_courses())
+
+                if json_out:
+                    save_moodle_courses(handed, json_out)
+                else:
+                    for _ in handed:
+                        pass
+
+                logger.info(f'Loaded users of {len(self.courses)} courses.')
+
+                _put(done)
+
+            except _Cancelled:
+                logger.debug('Fetching courses is cancelled.')
+
+            except BaseException as exc:
+
+                with suppress(_Cancelled):
+                    _put(exc)
+
+        producer = threading.Thread(target=_produce, name='moodle-courses', daemon=True)
+
+        producer.start()
+
+        try:
+            while True:
+
+                item = courses.get()
+
+                if item is done:
+                    return
+
+                if isinstance(item, BaseException):
+                    raise item
+
+                yield item
+
+                self._release(item)
+
+        finally:
+
+            stop.set()
+
+            producer.join()
 
     def fetch_courses(
                 self,
@@ -266,17 +767,17 @@ def fetch_courses(
 
             self.load_courses(json_in)
 
-            self.load_users()
+            if not json_out:
 
-            logger.info('Processing data is completed.')
+                self.load_users()
 
-            if not json_out:
+                logger.info('Processing data is completed.')
 
                 return
 
             try:
 
-                save_moodle_courses(self.courses, json_out)
+                self.load_users(json_out)
 
                 logger.info('Successfully update json with data from Moodle.')
 
@@ -2,15 +2,74 @@
 import typing as t
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.models import Response
 from custom_inherit import DocInheritMeta
 from loguru import logger
+from urllib3.util.retry import Retry
 
-from moodle.response import FluidResponse
+from moodle.response import FluidResponse, StreamingResponse
+from moodle.settings import (MOODLE_BACKOFF_FACTOR, MOODLE_MAX_RETRIES,
+                             MOODLE_POOL_SIZE, MOODLE_TIMEOUT)
 from moodle.typehints import JsonType
 from moodle.utils import dump_json
 
 
+def make_session(
+            pool_size: int = MOODLE_POOL_SIZE,
+            max_retries: int = MOODLE_MAX_RETRIES,
+            backoff_factor: float = MOODLE_BACKOFF_FACTOR,
+            allowed_methods: t.Optional[t.FrozenSet[str]] = None,
+        ) -> requests.Session:
+    '''Creates HTTP session with a keep-alive connection pool.
+
+    Every connection in the pool is reused between calls, so we pay TCP and
+    TLS handshake once per connection rather than once per request. Failed
+    connections, resets, and 5xx responses are retried with exponential
+    backoff. Moodle web service functions we call are read-only, so it's
+    safe to retry POST requests as well.
+
+    Clients of APIs that change state should pass ``allowed_methods``,
+    so that only requests of these methods are resent after they reached
+    the server. Failed connections are retried for every method anyway.
+
+    Args:
+        pool_size (int): Maximum number of connections kept alive per host.
+        max_retries (int): Number of retries before giving up.
+        backoff_factor (float): Backoff factor between retries in seconds.
+        allowed_methods (t.Optional[t.FrozenSet[str]]):
+            Methods retried on read errors and 5xx responses.
+            Defaults to None, which retries every method.
+
+    Returns:
+        requests.Session: Session with mounted adapters.
+    '''
+
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=allowed_methods,
+        raise_on_status=False,
+    )
+
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
 class BaseAPIClient(metaclass=DocInheritMeta(style='google_with_merge', include_special_methods=True)):
     '''Moodle webservice interface.
     Based on gist of https://gist.github.com/kaqfa
@@ -31,12 +90,20 @@ class BaseAPIClient(metaclass=DocInheritMeta(style='google_with_merge', include_
     neccesary in your case. With classic setup it defaults to
     /webservice/rest/server.php
 
+    All calls are made through a single pooled session (see ``make_session``),
+    so connections to Moodle are kept alive between calls. Call ``close``
+    or use the client as a context manager to release them.
+
     Args:
         url (:obj:`str`, optional): Moodle domain name. Defaults to None.
         key (:obj:`str`, optional): Moodle web service token. Defaults to None.
         endpoint (:obj:`str`, optional): Custom endpoint. Defaults to None.
         url_env_name (:obj:`str`, optional): Custom environment variable name. Defaults to None.
         key_env_name (:obj:`str`, optional): Custom environment variable name. Defaults to None.
+        pool_size (:obj:`int`, optional): Connections kept alive. Defaults to settings.MOODLE_POOL_SIZE.
+        max_retries (:obj:`int`, optional): Retries on resets and 5xx. Defaults to settings.MOODLE_MAX_RETRIES.
+        backoff_factor (:obj:`float`, optional): Retry backoff factor. Defaults to settings.MOODLE_BACKOFF_FACTOR.
+        timeout (:obj:`float`, optional): Default per-call timeout in seconds. Defaults to settings.MOODLE_TIMEOUT.
 
     '''
 
@@ -47,6 +114,8 @@ class BaseAPIClient(metaclass=DocInheritMeta(style='google_with_merge', include_
     key: str
     url: str
     endpoint: str
+    timeout: float
+    session: requests.Session
 
     def __init__(
                 self,
@@ -55,6 +124,11 @@ def __init__(
                 endpoint: t.Optional[str] = None,
                 url_env_name: t.Optional[str] = None,
                 key_env_name: t.Optional[str] = None,
+                *,
+                pool_size: int = MOODLE_POOL_SIZE,
+                max_retries: int = MOODLE_MAX_RETRIES,
+                backoff_factor: float = MOODLE_BACKOFF_FACTOR,
+                timeout: float = MOODLE_TIMEOUT,
             ):
 
         # If url or key is not provided,
@@ -81,6 +155,23 @@ def __init__(
 
         self.endpoint: str = endpoint or self.DEFAULT_ENDPOINT
 
+        self.timeout = timeout
+
+        self.session = make_session(pool_size, max_retries, backoff_factor)
+
+    def close(self) -> None:
+        '''
+        Close all pooled connections to Moodle.
+        '''
+
+        self.session.close()
+
+    def __enter__(self) -> 'BaseAPIClient':
+        return self
+
+    def __exit__(self, *_: t.Any) -> None:
+        self.close()
+
     def rest_api_parameters(
                 self,
                 in_args: t.Union[t.Sequence, t.Mapping],
@@ -116,12 +207,23 @@ def rest_api_parameters(
 
         return out_dict
 
-    def call(self, api_func: str, **kwargs: t.Any) -> FluidResponse:
+    def call(
+                self,
+                api_func: str,
+                /,
+                timeout: t.Optional[float] = None,
+                stream: bool = False,
+                **kwargs: t.Any,
+            ) -> t.Union[FluidResponse, StreamingResponse]:
         '''
         Calls Moodle API <api_func> with keyword arguments.
 
         Args:
             api_func (:obj:`str`): name of function in Moodle web client.
+            timeout (:obj:`float`, optional): Seconds to wait for the server
+                to respond. Defaults to the client's timeout.
+            stream (bool): Decode a json array one element at a time
+                while it is received. Defaults to False.
             **kwargs: any parameters to send with the request.
 
         Examples:
@@ -134,7 +236,8 @@ def call(self, api_func: str, **kwargs: t.Any) -> FluidResponse:
                 )
 
         Returns:
-            FluidResponse: Convinient wrapper for received data.
+            t.Union[FluidResponse, StreamingResponse]: Convinient wrapper
+                for received data, StreamingResponse if ``stream`` is set.
 
 
         Raises:
@@ -158,9 +261,17 @@ def call(self, api_func: str, **kwargs: t.Any) -> FluidResponse:
                         'wsfunction': api_func,
                        })
 
-        resp: Response = requests.post(self.url + self.endpoint, parameters)
+        resp: Response = self.session.post(
+            self.url + self.endpoint,
+            parameters,
+            timeout=timeout or self.timeout,
+            stream=stream,
+        )
 
         resp.raise_for_status()
 
         # can raise MoodleHTTPException and MoodleAPIException
+        if stream:
+            return StreamingResponse(resp, api_func)
+
         return FluidResponse(resp, api_func)
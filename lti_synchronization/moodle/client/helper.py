@@ -1,7 +1,6 @@
 import typing as t
 
-from moodle.helper import MoodleBasicHelper
-from moodle.settings import ROLES
+from moodle.helper import ROLE_TABLE, MoodleBasicHelper
 from moodle.typehints import Course, JsonType, User, Role
 
 
@@ -20,15 +19,17 @@ class MoodleDataHelper(MoodleBasicHelper):
 
     def __init__(self) -> None:
         '''
-        We transform settings.ROLES tuple into dictionary to
-        map every role to its index (position). By doing so, we're allowing
-        to easialy (and fast!) find role's position and role name by its
-        position reversevely.
+        Roles are ranked by moodle.helper.ROLE_TABLE only. Mappings of
+        every role to its index (position) in settings.ROLES and back are
+        views of the table, so role's position and role name by its position
+        are found easialy (and fast!) and can't disagree with the table.
         '''
 
-        self._roles = dict(list(zip(ROLES, range(len(ROLES)))))
+        self._table = ROLE_TABLE
 
-        self._roles_reversed = {v: k for k, v in self._roles.items()}
+        self._roles = {role: rank for role, (rank, _) in self._table.items()}
+
+        self._roles_reversed = {rank: role for role, rank in self._roles.items()}
 
     def get_priority(self, role: Role) -> int:
         '''Gets the index of role from settings.ROLES tuple.
@@ -78,7 +79,49 @@ def find_highest_role(self, roles: t.Sequence[Role]) -> Role:
             Role: name of the highest rank role
         '''
 
-        max_index: int = max(self.get_priority(role) for role in roles)
-
         # user's highest role name
-        return self.get_role_name(max_index)
+        return max(roles, key=lambda role: self._table[role][0])
+
+    def resolve_roles(
+                self,
+                users_roles: t.Iterable[t.Sequence[Role]],
+            ) -> t.Tuple[t.List[t.Optional[t.Tuple[int, str]]], t.Dict[str, int]]:
+        '''Resolves the highest role and the group of every user of a course at once.
+
+        Unknown roles are skipped and counted instead of failing
+        the whole course, so they can be reported once.
+
+        Args:
+            users_roles (t.Iterable[t.Sequence[Role]]):
+                Raw Moodle roles of every user.
+
+        Returns:
+            t.Tuple[t.List[t.Optional[t.Tuple[int, str]]], t.Dict[str, int]]:
+                Rank of the highest role and its group for every user, None
+                if the user has no known role. Number of users of every
+                unknown role.
+        '''
+
+        table = self._table
+
+        resolved: t.List[t.Optional[t.Tuple[int, str]]] = []
+
+        unknown: t.Dict[str, int] = {}
+
+        for roles in users_roles:
+
+            best: t.Optional[t.Tuple[int, t.Optional[str]]] = None
+
+            for role in roles:
+
+                found = table.get(role)
+
+                if found is None or found[1] is None:
+                    unknown[role] = unknown.get(role, 0) + 1
+
+                elif best is None or found[0] > best[0]:
+                    best = found
+
+            resolved.append(best)
+
+        return resolved, unknown
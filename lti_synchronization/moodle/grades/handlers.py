@@ -29,6 +29,9 @@ async def post(self, course_id: str, assignment_name: str) -> None:
             or sending grades to the tool consumer / platform.
           AssignmentWithoutGradesError if the assignment does not have any grades associated to it.
           GradesSenderMissingInfoError if ther is missing information when attempting to send grades.
+
+        Writes the report of the submission: which students' grades were sent,
+        failed to be sent, or skipped. "success" is false if any grade failed.
         '''
 
         self.log.debug(
@@ -38,7 +41,7 @@ async def post(self, course_id: str, assignment_name: str) -> None:
         lti_grade_sender = LTI13GradeSender(course_id, assignment_name)
 
         try:
-            await lti_grade_sender.send_grades()
+            report = await lti_grade_sender.send_grades()
 
         except errors.GradesSenderCriticalError as exc:
             raise web.HTTPError(
@@ -60,4 +63,4 @@ async def post(self, course_id: str, assignment_name: str) -> None:
         except Exception as exc:
             raise web.HTTPError(400, str(exc)) from exc
 
-        self.write(json.dumps({'success': True}))
+        self.write(json.dumps({'success': not report['failed'], **report}))
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 import re
@@ -6,7 +7,8 @@
 
 from loguru import logger
 from custom_inherit import DocInheritMeta
-from tornado.httpclient import AsyncHTTPClient
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.iostream import StreamClosedError
 from nbgrader.api import Course, Gradebook, MissingEntry
 
 from moodle.helper import NBGraderHelper
@@ -14,6 +16,8 @@
                            GradesSenderCriticalError,
                            GradesSenderMissingInfoError)
 from moodle.lti13.auth import get_lms_access_token
+from moodle.settings import (GRADES_BACKOFF_FACTOR, GRADES_CONCURRENCY,
+                             GRADES_MAX_RETRIES, GRADES_MAX_RETRY_DELAY)
 
 from moodle.utils import dump_json
 
@@ -67,7 +71,15 @@ def __init__(self, course_id: str, assignment_name: str):
         self.all_lineitems = []
         self.headers = {}
 
-    async def send_grades(self):
+    async def send_grades(self) -> t.Dict[str, list]:
+        '''
+        Send grades to LMS.
+
+        Returns:
+            t.Dict[str, list]: Students whose grades were sent,
+                failed to be sent, and skipped. Every student is reported
+                with ``student_id``, ``lms_user_id`` and ``reason``.
+        '''
         raise NotImplementedError
 
     @property
@@ -112,7 +124,8 @@ def _retrieve_grades_from_db(self) -> t.Tuple[int, t.List[dict]]:
 
                 out.append({
                     'score': submission.score,
-                    'lms_user_id': student.lms_user_id
+                    'lms_user_id': student.lms_user_id,
+                    'student_id': student.id,
                 })
 
         logger.info(f'Grades found: {out}')
@@ -286,9 +299,90 @@ async def _set_access_token_header(self):
           'accept': 'application/vnd.ims.lis.v2.lineitemcontainer+json'
         }
 
-    async def send_grades(self) -> None:
+    @staticmethod
+    def _is_retriable(exc: Exception) -> bool:
+        '''
+        Too many requests, server errors, timeouts (code 599),
+        and refused or reset connections are worth retrying.
+        '''
+
+        if isinstance(exc, (OSError, StreamClosedError)):
+            return True
+
+        return isinstance(exc, HTTPClientError) and (exc.code == 429 or exc.code >= 500)
+
+    @staticmethod
+    def _retry_delay(exc: Exception, attempt: int) -> float:
+        '''
+        Respect Retry-After header of the LMS if it was sent,
+        otherwise back off exponentially. The delay never exceeds
+        GRADES_MAX_RETRY_DELAY.
+        '''
+
+        delay: float = GRADES_BACKOFF_FACTOR * 2 ** attempt
+
+        response = getattr(exc, 'response', None)
+
+        if response is not None:
+
+            retry_after = response.headers.get('Retry-After', '')
+
+            if retry_after.isdigit():
+                delay = float(retry_after)
+
+        return min(delay, GRADES_MAX_RETRY_DELAY)
+
+    async def _post_score(
+                self,
+                client: AsyncHTTPClient,
+                url: str,
+                data: t.Dict[str, t.Any],
+            ) -> None:
+        '''Post a single score, retrying on 429 and 5xx responses,
+        and on connection errors.
+
+        Args:
+            client (AsyncHTTPClient): Shared http client.
+            url (str): Scores endpoint of the lineitem.
+            data (t.Dict[str, t.Any]): Score to submit.
+
+        Raises:
+            HTTPClientError: Score was rejected or retries were exhausted.
+            OSError: Connection failed and retries were exhausted.
+            StreamClosedError: Connection was closed and retries were exhausted.
+        '''
+
+        for attempt in range(GRADES_MAX_RETRIES + 1):
+
+            try:
+                await client.fetch(
+                    url, body=json.dumps(data), method='POST', headers=self.headers
+                )
+                return
+
+            except (HTTPClientError, OSError, StreamClosedError) as exc:
+
+                if attempt == GRADES_MAX_RETRIES or not self._is_retriable(exc):
+                    raise
+
+                delay = self._retry_delay(exc, attempt)
+
+                logger.warning(
+                    f'Score of {data["userId"]} was not accepted ({exc}), '
+                    f'retrying in {delay}s.'
+                )
+
+                await asyncio.sleep(delay)
+
+    async def send_grades(self) -> t.Dict[str, list]:
         '''
-        Send grades to LMS iteratively.
+        Send grades to LMS concurrently,
+        at most GRADES_CONCURRENCY requests at once.
+
+        Returns:
+            t.Dict[str, list]: Report with students whose grades were sent,
+                failed to be sent, or were skipped. Failed and skipped
+                students have the reason, sent ones have None.
         '''
 
         _, nbgrader_grades = self._retrieve_grades_from_db()
@@ -306,13 +400,32 @@ async def send_grades(self) -> None:
 
         self.headers['Content-Type'] = 'application/vnd.ims.lis.v1.score+json'
 
-        for grade in nbgrader_grades:
+        url = lineitem_info['id'].replace('?type_id=1', '') + '/scores'
+
+        logger.debug(f'URL for grades submission {url}')
+
+        report: t.Dict[str, list] = {'sent': [], 'failed': [], 'skipped': []}
+
+        semaphore = asyncio.Semaphore(GRADES_CONCURRENCY)
+
+        async def submit(grade: t.Dict[str, t.Any]) -> None:
+
+            lms_user_id = grade.get('lms_user_id')
+
+            if not lms_user_id or grade.get('score') is None:
+
+                report['skipped'].append({
+                    'student_id': grade.get('student_id'),
+                    'lms_user_id': lms_user_id,
+                    'reason': 'no LMS user id' if not lms_user_id else 'not graded',
+                })
+
+                return
 
-            score = float(grade['score'])
             data = {
                 'timestamp': datetime.now().isoformat(),
-                'userId': grade['lms_user_id'],
-                'scoreGiven': score,
+                'userId': lms_user_id,
+                'scoreGiven': float(grade['score']),
                 'scoreMaximum': score_maximum,
                 'gradingProgress': 'FullyGraded',
                 'activityProgress': 'Completed',
@@ -321,10 +434,34 @@ async def send_grades(self) -> None:
 
             logger.info(f'data used to sent scores: {dump_json(data)}')
 
-            url = lineitem_info['id'].replace('?type_id=1', '') + '/scores'
+            async with semaphore:
 
-            logger.debug(f'URL for grades submission {url}')
+                try:
+                    await self._post_score(client, url, data)
 
-            await client.fetch(
-                url, body=json.dumps(data), method='POST', headers=self.headers
-            )
+                except Exception as exc:
+
+                    logger.error(f'Cannot send score of {lms_user_id}: {exc}')
+
+                    report['failed'].append({
+                        'student_id': grade.get('student_id'),
+                        'lms_user_id': lms_user_id,
+                        'reason': str(exc),
+                    })
+
+                    return
+
+            report['sent'].append({
+                'student_id': grade.get('student_id'),
+                'lms_user_id': lms_user_id,
+                'reason': None,
+            })
+
+        await asyncio.gather(*(submit(grade) for grade in nbgrader_grades))
+
+        logger.info(
+            f'Grades of {self.assignment_name!r} submitted: '
+            + ', '.join(f'{len(v)} {k}' for k, v in report.items())
+        )
+
+        return report
@@ -1,13 +1,37 @@
 import os
-import re
 import typing as t
 
 from loguru import logger
+from moodle import models, normalization
+from moodle.settings import ROLES
 from moodle.typehints import Course, JsonType, User
-from moodle.utils import JsonDict, grader
-from nbgrader.api import Assignment, Gradebook, InvalidEntry
+from moodle.utils import grader
+from nbgrader.api import Assignment, Gradebook, InvalidEntry, Student
 from nbgrader.api import Course as NBCourse
 from custom_inherit import DocInheritMeta
+from sqlalchemy.exc import IntegrityError, StatementError
+from sqlalchemy.orm.exc import FlushError
+
+
+# Fields of core_enrol_get_enrolled_users consumed by format_user.
+USER_FIELDS: t.Tuple[str, ...] = ('id', 'username', 'fullname', 'email', 'roles')
+
+# Jupyterhub group of every LMS role.
+ROLE_GROUPS: t.Dict[str, str] = {
+    'student': 'students',
+    'teaching_assistant': 'graders',
+    'teacher': 'graders',
+    'instructional_support': 'instructors',
+    'editingteacher': 'instructors',
+    'manager': 'instructors',
+    'coursecreator': 'instructors',
+}
+
+# Rank and group of every role from settings.ROLES, the higher rank wins.
+# Roles without a group can be ranked, but not put into a group.
+ROLE_TABLE: t.Dict[str, t.Tuple[int, t.Optional[str]]] = {
+    role: (models.ROLE_INDEX[role], ROLE_GROUPS.get(role)) for role in ROLES
+}
 
 
 class MoodleBasicHelper(metaclass=DocInheritMeta(style='google_with_merge', include_special_methods=True)):
@@ -25,15 +49,7 @@ def format_string(cls, string: str) -> str:
 
         '''
 
-        if not string:
-            raise ValueError('string is empty')
-
-        string = re.sub(r'[^\w-]+', '_', string)
-
-        if string[0].isdigit():
-            string = f'a_{string}'
-
-        return string.lstrip('_.-').lower()[:50]
+        return normalization.format_string(string)
 
     @classmethod
     def email_to_username(cls, email: str) -> str:
@@ -54,22 +70,7 @@ def email_to_username(cls, email: str) -> str:
           ValueError: if email is empty
         '''
 
-        if not email:
-            raise ValueError('email is missing')
-
-        username = email.split('@')[0]
-
-        username = username.split('+')[0]
-
-        username = re.sub(r'\([^)]*\)', '', username)
-
-        username = re.sub(r'[^\w-]+', '', username)
-
-        username = username.lower()
-
-        logger.debug(f'Normalized email {email!r} to {username!r}')
-
-        return cls.format_string(username)
+        return normalization.email_to_username(email)
 
     @classmethod
     def get_user_group(cls, user: User) -> str:
@@ -86,13 +87,9 @@ def get_user_group(cls, user: User) -> str:
 
         '''
 
-        if user['role'] == 'student':
-            group = 'students'
-        elif user['role'] in ('editingteacher', 'manager', 'coursecreator', 'instructional_support'):
-            group = 'instructors'
-        elif user['role'] in ('teaching_assistant', 'teacher'):
-            group = 'graders'
-        else:
+        group: t.Optional[str] = ROLE_TABLE.get(user['role'], (None, None))[1]
+
+        if group is None:
             raise KeyError(user['role'])
 
         return group
@@ -105,20 +102,17 @@ def format_course(cls, course: JsonType) -> Course:
             course (JsonType): Raw Json from LMS containing course data.
 
         Returns:
-            Course: JsonDict with course information
+            Course: Course without enrolled users
 
         '''
 
-        return JsonDict({
-                'id': course['id'],
-                'course_id': cls.format_string(course['shortname']),
-                'title': course['displayname'],
-                'category': course['categoryid'],
-                'instructors': [],
-                'students': [],
-                'graders': [],
-                'lms_lineitems_endpoint': f'{os.environ["MOODLE_BASE_URL"]}/mod/lti/services.php/{course["id"]}/lineitems'
-        })
+        return models.Course(
+            course['id'],
+            cls.format_string(course['shortname']),
+            course['displayname'],
+            course['categoryid'],
+            f'{os.environ["MOODLE_BASE_URL"]}/mod/lti/services.php/{course["id"]}/lineitems',
+        )
 
     @classmethod
     def get_name(cls, user: JsonType) -> t.Tuple[str, str]:
@@ -138,19 +132,46 @@ def format_user(cls, user: JsonType) -> User:
             user (JsonType): Raw Json from LMS containing user data.
 
         Returns:
-            User: JsonDict with user information
+            User: User with raw Moodle roles
 
         '''
         first_name, last_name = cls.get_name(user)
 
-        return JsonDict({
-            'id': user['id'],
-            'first_name': first_name,
-            'last_name': last_name,
-            'username': cls.email_to_username(user.get('username', None) or user['email']),
-            'email': user['email'],
-            'roles': [role['shortname'] for role in user['roles']],
-        })
+        return models.User(
+            user['id'],
+            first_name,
+            last_name,
+            cls.email_to_username(user.get('username', None) or user['email']),
+            user['email'],
+            [role['shortname'] for role in user['roles']],
+        )
+
+    @classmethod
+    def format_users(cls, users: t.Iterable[JsonType]) -> t.Generator[User, None, None]:
+        '''Formats the enrolment list one user at a time, as it is received.
+
+        Different emails normalized to the same username are reported,
+        since such users would share one account.
+
+        Args:
+            users (t.Iterable[JsonType]): Raw Json users from LMS.
+
+        Yields:
+            User: User with raw Moodle roles.
+        '''
+
+        emails: t.Dict[str, str] = {}
+
+        for raw_user in users:
+
+            user = cls.format_user(raw_user)
+
+            email = emails.setdefault(user.username, user.email)
+
+            if email != user.email:
+                logger.warning(f'Users {sorted((email, user.email))} share the username {user.username!r}')
+
+            yield user
 
     @classmethod
     def skip_course(
@@ -251,6 +272,113 @@ def add_student(self, course_id: str, student: User) -> None:
                 email=student['email'],
             )
 
+    @staticmethod
+    def _student_fields(student: User) -> t.Dict[str, t.Optional[str]]:
+        '''
+        Map LMS user to the nbgrader Student columns.
+        '''
+
+        return {
+            'lms_user_id': str(student['id']) if student.get('id') is not None else None,
+            'first_name': student['first_name'],
+            'last_name': student['last_name'],
+            'email': student['email'],
+        }
+
+    def add_students(
+                self,
+                course_id: str,
+                students: t.Iterable[User],
+                drop_missing: bool = False,
+            ) -> t.Dict[str, int]:
+        '''Reconcile the course students with the nbgrader sqlite database.
+
+        Existing rows are read with a single query, then new students are
+        inserted and changed ones are updated. Everything is committed in
+        one transaction instead of a commit per student.
+
+        Students stored in the database but missing from ``students``
+        are counted as dropped. nbgrader has no column to mark them,
+        so with ``drop_missing`` only the ones without any submission
+        are removed: their grades must never be lost.
+
+        Args:
+            course_id (str): Course short name.
+            students (t.Iterable[User]): Every student enrolled in the course.
+            drop_missing (bool): Remove dropped students without
+                submissions. Defaults to False.
+
+        Returns:
+            t.Dict[str, int]: Number of added, updated, unchanged,
+                and dropped students, and how many of dropped were removed.
+
+        Raises:
+            InvalidEntry: The transaction was rolled back.
+        '''
+
+        summary = dict.fromkeys(('added', 'updated', 'unchanged', 'dropped', 'removed'), 0)
+
+        with self.get_db(course_id) as gb:
+
+            existing: t.Dict[str, Student] = {
+                row.id: row for row in gb.db.query(Student).all()
+            }
+
+            received: t.Set[str] = set()
+
+            for student in students:
+
+                username: str = student['username']
+
+                if username in received:
+                    continue
+
+                received.add(username)
+
+                fields = self._student_fields(student)
+
+                row = existing.get(username)
+
+                if row is None:
+
+                    gb.db.add(Student(id=username, **fields))
+
+                    summary['added'] += 1
+
+                elif any(getattr(row, field) != value for field, value in fields.items()):
+
+                    for field, value in fields.items():
+                        setattr(row, field, value)
+
+                    summary['updated'] += 1
+
+                else:
+
+                    summary['unchanged'] += 1
+
+            for username in existing.keys() - received:
+
+                summary['dropped'] += 1
+
+                if drop_missing and not existing[username].submissions:
+
+                    gb.db.delete(existing[username])
+
+                    summary['removed'] += 1
+
+            try:
+                gb.db.commit()
+
+            except (IntegrityError, FlushError, StatementError) as e:
+
+                gb.db.rollback()
+
+                raise InvalidEntry(*e.args)
+
+        logger.debug(f'Reconciled students of {course_id!r}: {summary}')
+
+        return summary
+
     def update_course(self, course_id: str, **kwargs: t.Any) -> None:
         '''
         Updates the course in nbgrader database
@@ -0,0 +1,229 @@
+'''
+Applies users, admins and groups to a running Jupyterhub.
+
+Jupyterhub reads allowed users, admin users and groups from the
+configuration file on start only, so every enrolment change used to require
+a restart of the hub, which drops every user session. A running hub can
+take the same changes through its REST API. The client below reads the
+current state of the hub, compares it with the synchronized one, and sends
+only the difference, one request per kind of change.
+
+Services still can't be registered on a running hub, so when they change
+the configuration has to be rewritten and the hub restarted.
+
+Read more about `Jupyterhub REST API`_
+
+.. _Jupyterhub REST API: https://jupyterhub.readthedocs.io/en/stable/reference/rest-api.html
+'''
+
+import typing as t
+
+from loguru import logger
+
+from moodle.client.base import make_session
+from moodle.settings import (JUPYTERHUB_API_TOKEN, JUPYTERHUB_API_URL,
+                             JUPYTERHUB_DELETE_USERS, MOODLE_TIMEOUT)
+
+
+# Groups created by the synchronization, others are never deleted.
+MANAGED_GROUPS: t.Tuple[str, ...] = ('formgrade-', 'nbgrader-')
+
+# Only reading calls are resent after they reached the hub,
+# a repeated POST or DELETE may be applied twice.
+RETRIED_METHODS: t.FrozenSet[str] = frozenset({'GET'})
+
+
+class HubAPIClient:
+    '''Client of the Jupyterhub REST API.
+
+    The token must belong to an admin user or service.
+
+    Args:
+        url (t.Optional[str]): Hub API url. Defaults to settings.JUPYTERHUB_API_URL.
+        token (t.Optional[str]): API token. Defaults to settings.JUPYTERHUB_API_TOKEN.
+        timeout (float): Timeout of every call in seconds. Defaults to settings.MOODLE_TIMEOUT.
+        delete_users (bool):
+            Delete hub users that are not allowed anymore.
+            Defaults to settings.JUPYTERHUB_DELETE_USERS.
+
+    Raises:
+        EnvironmentError: API token is not set.
+    '''
+
+    def __init__(
+                self,
+                url: t.Optional[str] = None,
+                token: t.Optional[str] = None,
+                timeout: float = MOODLE_TIMEOUT,
+                delete_users: bool = JUPYTERHUB_DELETE_USERS,
+            ) -> None:
+
+        self.url = (url or JUPYTERHUB_API_URL).rstrip('/')
+
+        token = token or JUPYTERHUB_API_TOKEN
+
+        if not token:
+            raise EnvironmentError('JUPYTERHUB_API_TOKEN should be set.')
+
+        self.timeout = timeout
+
+        self.delete_users = delete_users
+
+        self.session = make_session(pool_size=1, allowed_methods=RETRIED_METHODS)
+
+        self.session.headers['Authorization'] = f'token {token}'
+
+    def close(self) -> None:
+        self.session.close()
+
+    def request(self, method: str, path: str, **kwargs: t.Any) -> t.Any:
+        '''Calls the hub API.
+
+        Args:
+            method (str): HTTP method.
+            path (str): API path, like ``/users``.
+            **kwargs (t.Any): JSON body of the request.
+
+        Returns:
+            t.Any: Decoded JSON response, if any.
+
+        Raises:
+            requests.HTTPError: Non-success status code received.
+        '''
+
+        resp = self.session.request(
+            method,
+            self.url + path,
+            json=kwargs or None,
+            timeout=self.timeout,
+        )
+
+        resp.raise_for_status()
+
+        return resp.json() if resp.content else None
+
+    def get_users(self) -> t.Dict[str, bool]:
+        '''
+        Gets every hub user mapped to the admin flag.
+        '''
+
+        return {user['name']: user['admin'] for user in self.request('GET', '/users')}
+
+    def get_groups(self) -> t.Dict[str, t.Set[str]]:
+        '''
+        Gets every hub group mapped to its members.
+        '''
+
+        return {group['name']: set(group['users']) for group in self.request('GET', '/groups')}
+
+    def apply(
+                self,
+                whitelist: t.Iterable[str],
+                admin_users: t.Iterable[str],
+                groups: t.Dict[str, t.Iterable[str]],
+                delete: bool = False,
+            ) -> t.Dict[str, int]:
+        '''Brings the hub to the synchronized state with the least requests.
+
+        New users are created in one request per admin flag. Group members
+        are added and removed in one request per group.
+
+        Deleting a hub user deletes its server as well, so users not allowed
+        anymore are deleted only if asked to, and only if the whitelist is
+        complete. Admins not managed by the synchronization, like the ones
+        from the default configuration, are never deleted.
+
+        Args:
+            whitelist (t.Iterable[str]): Allowed users.
+            admin_users (t.Iterable[str]): Admin users.
+            groups (t.Dict[str, t.Iterable[str]]): Group members.
+            delete (bool): Delete users that are not allowed. Defaults to False.
+
+        Returns:
+            t.Dict[str, int]: Number of applied changes of every kind.
+
+        Raises:
+            requests.RequestException: The hub did not accept a change.
+        '''
+
+        admins: t.Set[str] = set(admin_users)
+
+        allowed: t.Set[str] = set(whitelist) | admins
+
+        hub_users = self.get_users()
+
+        hub_groups = self.get_groups()
+
+        summary = dict.fromkeys((
+            'created', 'deleted', 'promoted', 'demoted',
+            'groups_created', 'groups_deleted', 'added', 'removed',
+        ), 0)
+
+        new_users = allowed - hub_users.keys()
+
+        for admin in (True, False):
+
+            usernames = sorted(name for name in new_users if (name in admins) is admin)
+
+            if usernames:
+                self.request('POST', '/users', usernames=usernames, admin=admin)
+                summary['created'] += len(usernames)
+
+        for name in sorted(allowed & hub_users.keys()):
+
+            if hub_users[name] != (name in admins):
+
+                self.request('PATCH', f'/users/{name}', admin=name in admins)
+
+                summary['promoted' if name in admins else 'demoted'] += 1
+
+        for name, members in groups.items():
+
+            members = set(members)
+
+            if name not in hub_groups:
+
+                self.request('POST', f'/groups/{name}', users=sorted(members))
+
+                summary['groups_created'] += 1
+
+                continue
+
+            added = members - hub_groups[name]
+            removed = hub_groups[name] - members
+
+            if added:
+                self.request('POST', f'/groups/{name}/users', users=sorted(added))
+                summary['added'] += len(added)
+
+            if removed:
+                self.request('DELETE', f'/groups/{name}/users', users=sorted(removed))
+                summary['removed'] += len(removed)
+
+        for name in sorted(hub_groups.keys() - groups.keys()):
+
+            if name.startswith(MANAGED_GROUPS):
+
+                self.request('DELETE', f'/groups/{name}')
+
+                summary['groups_deleted'] += 1
+
+        if not delete:
+
+            logger.info(f'Applied changes to the running hub: {summary}')
+
+            return summary
+
+        for name in sorted(hub_users.keys() - allowed):
+
+            if hub_users[name]:
+                logger.debug(f'Keeping admin {name!r} not managed by the synchronization.')
+                continue
+
+            self.request('DELETE', f'/users/{name}')
+
+            summary['deleted'] += 1
+
+        logger.info(f'Applied changes to the running hub: {summary}')
+
+        return summary
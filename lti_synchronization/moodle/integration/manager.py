@@ -1,17 +1,24 @@
+import os
 import typing as t
 from collections import defaultdict
 from contextlib import suppress
 from pathlib import Path
-from secrets import token_hex
 
+import requests
 from loguru import logger
+from moodle import models
 from moodle.utils import load_moodle_courses
 from moodle.helper import NBGraderHelper
-from moodle.settings import BASE_DIR
-from moodle.typehints import Course, JsonType, User, PathLike, Filters
-from moodle.utils import grader, JsonDict
-
+from moodle.settings import BASE_DIR, PORTS_FILE, SNAPSHOT_FILE, TOKENS_FILE
+from moodle.typehints import Course, JsonType, PathLike, Filters
+from moodle.utils import grader
+
+from .hub import HubAPIClient
+from .ports import PortAllocator
+from .provision import Provisioner
+from .snapshot import CourseDiff, Snapshot, SyncDiff
 from .template import Templater
+from .tokens import TokenStore
 from . import system
 
 
@@ -23,12 +30,53 @@ class SyncManager:
         admin_users (set): Set of users with admin permissions. Such as instructors.
         whitelist (set): All users enrolled in all the courses.
         courses (JsonType): Formatted courses with enrolled students.
+        users (t.Dict[str, models.User]): Users of loaded courses by username,
+                                          shared between the courses.
         groups (JsonType): One of nbgrader-{course_id} or formgrader-{course_id}
                            Group name defined whether a user is a student or a grader.
         tokens (type): Unique keys that allow services to access Jupyterhub.
+        provisioner (Provisioner): Queue of user creations and permission
+                                   changes applied in the end of
+                                   synchronization.
         services (type): A service (local notebook server) for every course
                          will be created in order to be accessible for graders
                          and instructors.
+        snapshot (Snapshot): State of the current synchronization.
+        previous (Snapshot): State stored by the previous synchronization.
+                             Empty unless the manager is incremental.
+        diff (SyncDiff): Difference between previous and current states.
+        ports (PortAllocator): Service port of every nbgrader course,
+                               kept across synchronizations.
+        token_store (TokenStore): Service token of every nbgrader course,
+                                  kept across synchronizations.
+        hub (t.Optional[HubAPIClient]): Running hub to apply users, admins
+                                        and groups to without a restart.
+
+    Args:
+        incremental (bool):
+            Compare received data with the previous synchronization and
+            run OS and gradebook operations only for what has changed.
+            Defaults to False.
+        snapshot_path (t.Optional[PathLike]):
+            Where the snapshot is stored. Defaults to settings.SNAPSHOT_FILE.
+        deep_verify (bool):
+            Walk every home directory to fix ownership of single files.
+            Otherwise only homes with wrong top directory owner are walked.
+            Defaults to False.
+        ports_path (t.Optional[PathLike]):
+            Where service ports are stored. Defaults to settings.PORTS_FILE.
+        tokens_path (t.Optional[PathLike]):
+            Where service tokens are stored. Defaults to settings.TOKENS_FILE.
+        rotate_tokens (t.Iterable[str]):
+            Courses which services get new tokens. Defaults to empty tuple.
+        hub (t.Optional[HubAPIClient]):
+            If provided, users, admins and groups are applied to the running
+            hub, so it has to be restarted only if services have changed.
+            Defaults to None.
+        provision_batch (int):
+            Apply queued system changes after every ``provision_batch``
+            processed courses, so they overlap with fetching of streamed
+            courses. Defaults to 0, which applies them once in the end.
 
     '''
 
@@ -44,34 +92,83 @@ class path:
 
     temp: Templater
 
+    provisioner: Provisioner
+
     admin_users: set
 
     whitelist: set
 
     courses: t.List[Course]
 
+    users: t.Dict[str, models.User]
+
     groups: defaultdict
 
     tokens: t.Dict[str, str]
 
     services: t.List[dict]
 
-    def __init__(self) -> None:
+    snapshot: Snapshot
+
+    previous: Snapshot
+
+    diff: SyncDiff
+
+    ports: PortAllocator
+
+    token_store: TokenStore
+
+    hub: t.Optional[HubAPIClient]
+
+    def __init__(
+                self,
+                incremental: bool = False,
+                snapshot_path: t.Optional[PathLike] = None,
+                deep_verify: bool = False,
+                ports_path: t.Optional[PathLike] = None,
+                tokens_path: t.Optional[PathLike] = None,
+                rotate_tokens: t.Iterable[str] = (),
+                hub: t.Optional[HubAPIClient] = None,
+                provision_batch: int = 0,
+            ) -> None:
 
         self.helper = NBGraderHelper()
 
         self.temp = Templater()
 
+        self.provisioner = Provisioner(deep_verify=deep_verify)
+
+        self._new_graders: t.List[str] = []
+
         self.admin_users = set()
         self.whitelist = set()
 
         self.courses = []
+        self.users = {}
         self.groups = defaultdict(list)
 
         self.tokens = {}
         self.services = []
 
-        self._unix_users = set(system.get_unix_usernames())
+        self.ports_path = ports_path or PORTS_FILE
+        self.ports = PortAllocator.load(self.ports_path)
+
+        self.tokens_path = tokens_path or TOKENS_FILE
+        self.token_store = TokenStore.load(self.tokens_path)
+
+        for course_id in rotate_tokens:
+            self.token_store.rotate(course_id)
+
+        self.hub = hub
+
+        self.provision_batch = provision_batch
+
+        self.incremental = incremental
+        self.snapshot_path = snapshot_path or SNAPSHOT_FILE
+
+        self.previous = Snapshot.load(self.snapshot_path) if incremental else Snapshot()
+        self.snapshot = Snapshot()
+        self.diff = SyncDiff()
 
     def update_services(self, course_id: str, port: int = 0) -> None:
         '''Add new Jupyterhub service to data.
@@ -81,7 +178,8 @@ def update_services(self, course_id: str, port: int = 0) -> None:
         in the ``jupyterhub_config`` file. To communicate with services, Jupyterhub
         uses tokens which are randomly generated strings. To allow services
         talk back to Jupyterhub, we need to map these tokens to services' names
-        in the configuration file as well.
+        in the configuration file as well. A course keeps its token across
+        synchronizations, so running services stay valid.
 
         Note:
             Port argument is the offset from `9000`. So if you pass `1`, the
@@ -92,7 +190,7 @@ def update_services(self, course_id: str, port: int = 0) -> None:
             port (int): A port offset that service should take. Defaults to 0.
         '''
 
-        service_token = token_hex(32)
+        service_token = self.token_store.get(course_id)
 
         self.tokens[service_token] = grader / course_id
 
@@ -112,11 +210,27 @@ def update_admins(self, course: Course) -> None:
         self.admin_users.update(user.username for user in course.instructors)
         self.admin_users.add(grader / course.course_id)
 
+    def user_exists(self, username: str) -> bool:
+        '''
+        Check whether the unix user exists or is queued to be created.
+
+        Args:
+            username (str): User's name.
+
+        Returns:
+            bool: True if the user exists.
+        '''
+
+        return username in self.provisioner.users or username in system.passwd
+
     def create_grader(self, course_id: str) -> None:
         '''Create daemon user for hosting a course server.
 
         Here we have some low-level OS operations. A lot of errors occur
         because nbgrader heavily relate on file hierarchy and file permissions.
+        Creating the user and changing permissions are queued to the
+        provisioner, and nbgrader extensions are enabled after it is applied
+        (see ``apply_system_changes``).
 
         To launch new service properly, a user should exist on the system.
         Then you need to create several directories and write nbgrader_config
@@ -131,7 +245,7 @@ def create_grader(self, course_id: str) -> None:
 
         course_grader: str = grader / course_id
 
-        if course_grader in self._unix_users:
+        if self.user_exists(course_grader):
 
             return
 
@@ -146,17 +260,19 @@ def create_grader(self, course_id: str) -> None:
 
         self.temp.write_grader_config(course_id)
 
-        system.create_user(course_grader)
+        system.touch(grader_home / 'grader.db')
+
+        self.provisioner.add_user(course_grader)
 
-        system.create_database(course_grader)
+        self.provisioner.chown(course_grader, grader_home, group=course_grader)
 
-        system.enable_nbgrader(course_grader)
+        self.provisioner.chmod(700, grader_home)
 
-        system.chmod(700, grader_home)
+        self.provisioner.chmod(755, grader_home / 'grader.db')
 
-        system.chmod(755, grader_home / 'grader.db')
+        self._new_graders.append(course_grader)
 
-    def add_users(self, course: Course) -> None:
+    def add_users(self, course: Course, diff: t.Optional[CourseDiff] = None) -> None:
         '''
         Iterate by instructors, graders, and students.
         Add every user to the appropriate group.
@@ -165,21 +281,23 @@ def add_users(self, course: Course) -> None:
 
         Args:
             course (Course): Course contains the users.
+            diff (t.Optional[CourseDiff]):
+                If provided, only touched users go through OS and gradebook
+                operations. Defaults to None.
 
         '''
 
         graders_group: str = f'formgrade-{course.course_id}'
         students_group: str = f'nbgrader-{course.course_id}'
 
-        # for student in course_db.students:
-        #     course_db.remove_student(student.id)
-
         for user in course.instructors + course.graders + course.students:
 
             group: str = self.helper.get_user_group(user)
 
             self.whitelist.add(user.username)
 
+            touched: bool = diff is None or user.username in diff.touched
+
             if group != 'students':
 
                 self.groups[graders_group].append(user.username)
@@ -188,15 +306,39 @@ def add_users(self, course: Course) -> None:
 
                 self.groups[students_group].append(user.username)
 
-                self.helper.add_student(course.course_id, user)
+            if not touched:
+
+                continue
+
+            if not self.user_exists(user.username):
+
+                self.provisioner.add_user(user.username)
 
-            if user.username not in self._unix_users:
+                self.provisioner.chmod(700, f'/home/{user.username}')
 
-                system.create_user(user.username)
+            self.provisioner.chown(user.username, f'/home/{user.username}')
 
-            self._unix_users.add(user.username)
+        students: t.Set[str] = {user.username for user in course.students}
 
-            system.chown(user.username, f'/home/{user.username}')
+        # the gradebook is reconciled against the whole list,
+        # so it is skipped only when no student has changed.
+        if diff is None or diff.removed or diff.touched & students:
+
+            self.helper.add_students(course.course_id, course.students)
+
+    def apply_system_changes(self) -> None:
+        '''
+        Create queued users, apply queued permission changes,
+        and enable nbgrader extensions for new graders.
+        '''
+
+        if self.provisioner:
+            self.provisioner.apply()
+
+        for course_grader in self._new_graders:
+            system.enable_nbgrader(course_grader)
+
+        self._new_graders.clear()
 
     def process_course(self, course: Course) -> None:
         '''Process data neccesary to configure Jupyterhub, interacts with OS.
@@ -246,34 +388,38 @@ def process_course(self, course: Course) -> None:
         .. _Jupyterhub user management: https://jupyterhub.readthedocs.io/en/stable/getting-started/authenticators-users-basics.html
         '''
 
-        def _format(users: JsonType) -> t.List[User]:
-            return [JsonDict(user) for user in users]
+        diff: CourseDiff = self.previous.diff_course(course)
+
+        self.diff.courses[course.course_id] = diff
 
-        course.graders = _format(course.graders)
-        course.students = _format(course.students)
-        course.instructors = _format(course.instructors)
+        self.snapshot.add(course)
+
+        if diff:
+            logger.debug(f'Processing changes: {diff!r}')
 
         self.update_admins(course)
 
         if course.need_nbgrader:
 
-            self.update_services(course.course_id, self.courses.index(course))
+            self.update_services(course.course_id, self.ports.get(course.course_id))
 
             self.groups.update({
                     f'formgrade-{course.course_id}': [grader / course.course_id, ],
                     f'nbgrader-{course.course_id}': [],
             })
 
-            self.create_grader(course.course_id)
+            if diff.new or diff.changed:
 
-            self.helper.update_course(
-                course.course_id,
-                lms_lineitems_endpoint=course.lms_lineitems_endpoint,
-            )
+                self.create_grader(course.course_id)
+
+                self.helper.update_course(
+                    course.course_id,
+                    lms_lineitems_endpoint=course.lms_lineitems_endpoint,
+                )
 
             self.whitelist.add(grader / course.course_id)
 
-        self.add_users(course)
+        self.add_users(course, diff)
 
     def process_data(
                 self,
@@ -284,7 +430,20 @@ def process_data(
         '''Iterates through json file and calls self.process_course for
         every course found in a file.
 
+        Courses loaded as dictionaries are converted to models.Course,
+        users enrolled in several courses are shared between them.
+
+        If ``provision_batch`` is set, queued system changes are applied after
+        every batch of courses, while a streamed source is fetching the next
+        ones. The rest is applied by ``apply_system_changes`` in the end.
+
+        Service ports and tokens of courses which were not processed are
+        released only if no filters are set, since a filtered run skips
+        courses still in use.
+
         Args:
+            courses (t.Optional[Course]):
+                Courses to process instead of the json file. Defaults to None.
             json_path (t.Optional[PathLike]):
                 Custom path to json. Defaults to None.
             filters (t.Dict[str, t.Union[t.Sequence[t.AnyStr], t.AnyStr]]):
@@ -293,20 +452,39 @@ def process_data(
         '''
 
         if courses is None:
-            courses = (JsonDict(crs) for crs in load_moodle_courses(json_path))
+            courses = load_moodle_courses(json_path)
 
         for course in courses:
 
             if self.helper.skip_course(course, filters):
-                logger.debug(f'Skipping course {course.title!r}')
+                logger.debug(f'Skipping course {course["title"]!r}')
                 continue
 
+            if not isinstance(course, models.Course):
+                course = models.Course.from_dict(course, self.users)
+
             logger.debug(f'Processing course {course.title!r}')
 
             self.courses.append(course)
 
             self.process_course(course)
 
+            if self.provision_batch and len(self.courses) % self.provision_batch == 0:
+                self.apply_system_changes()
+
+        self.diff.removed_courses = (
+            self.previous.courses.keys() - self.snapshot.courses.keys()
+        )
+
+        # ports of courses gone or without nbgrader are given to new ones
+        if not filters:
+
+            for course_id in self.ports.release_unused():
+                logger.info(f'Freed service port of {course_id!r}')
+
+            for course_id in self.token_store.release_unused():
+                logger.info(f'Revoked service token of {course_id!r}')
+
     def update_jupyterhub(
                 self,
                 *,
@@ -315,7 +493,7 @@ def update_jupyterhub(
                 in_file: t.Optional[PathLike] = None,
                 out_file: t.Optional[PathLike] = None,
                 **filters: Filters,
-            ) -> None:
+            ) -> bool:
         '''Updates ``jupyterhub_config`` file with data received from Moodle LMS.
 
         After calling moodle.client.api.MoodleClient.download_json method,
@@ -324,6 +502,17 @@ def update_jupyterhub(
         We can now synchronize Jupyterhub configuration file using the data
         about courses and enrolled users.
 
+        If the manager is incremental and nothing has changed since the
+        previous synchronization, the configuration file is left untouched.
+        Snapshot of processed data is saved for the next run afterwards.
+
+        If the manager has a hub client and services have not changed,
+        users, admins and groups are applied to the running hub, so
+        it doesn't have to be restarted. The configuration file is still
+        updated to keep the state after the next restart. If the written
+        configuration is identical to the existing one, the file is not
+        replaced and no restart is required.
+
         Args:
             json_path (t.Optional[PathLike]):
                 json source file path if it differs from default. Defaults to None
@@ -334,8 +523,13 @@ def update_jupyterhub(
             filters (t.Dict[str, t.Union[t.Sequence[t.AnyStr], t.AnyStr]]):
                 key-value pairs where value can be both single value or list
                 of valid items.
+
+        Returns:
+            bool: The hub has to be restarted to apply the configuration.
         '''
 
+        restart: bool = False
+
         with suppress(KeyboardInterrupt):
 
             default_config: str = self.temp.get_default(
@@ -343,14 +537,90 @@ def update_jupyterhub(
 
             self.process_data(courses, json_path, **filters)
 
-            self.temp.update_jupyterhub_config(
-                out_file or self.path.out_file,
-                default_config,
-                **{
-                    'admin_users': self.admin_users,
-                    'whitelist': self.whitelist,
-                    'groups': dict(self.groups),
-                    'tokens': self.tokens,
-                    'services': self.services,
-                }
+            self.apply_system_changes()
+
+            out_file = out_file or self.path.out_file
+
+            if self.incremental:
+                logger.info(f'Changes since the previous synchronization: {self.diff.summary()}')
+
+            # services are read by the hub on start only
+            services_changed: bool = (
+                self.ports.changed or self.token_store.changed
+                or not os.path.exists(out_file)
             )
+
+            if (
+                self.incremental and not self.diff
+                and not self.token_store.changed and os.path.exists(out_file)
+            ):
+
+                logger.info('Nothing has changed. Configuration is up to date.')
+
+            else:
+
+                changed: bool = self.temp.update_jupyterhub_config(
+                    out_file,
+                    default_config,
+                    **{
+                        'admin_users': self.admin_users,
+                        'whitelist': self.whitelist,
+                        'groups': {
+                            name: sorted(members)
+                            for name, members in sorted(self.groups.items())
+                        },
+                        'tokens': dict(sorted(self.tokens.items())),
+                        'services': sorted(self.services, key=lambda service: service['name']),
+                    }
+                )
+
+                # identical configuration needs no restart
+                restart = changed and (services_changed or not self.apply_to_hub(complete=not filters))
+
+            if self.ports.changed:
+                self.ports.save(self.ports_path)
+
+            if self.token_store.changed:
+                self.token_store.save(self.tokens_path)
+
+            if self.incremental:
+
+                # users not provisioned are retried by the next synchronization
+                for username in self.provisioner.failed:
+                    self.snapshot.discard_user(username)
+
+                self.snapshot.save(self.snapshot_path)
+
+        return restart
+
+    def apply_to_hub(self, complete: bool = True) -> bool:
+        '''
+        Apply users, admins and groups to the running hub.
+
+        Args:
+            complete (bool):
+                Every course is synchronized, so users missing from the
+                whitelist may be deleted. A filtered synchronization
+                skips courses and never deletes users. Defaults to True.
+
+        Returns:
+            bool: False if there is no hub client, or the hub
+                did not accept the changes and has to be restarted.
+        '''
+
+        if self.hub is None:
+            return False
+
+        try:
+            self.hub.apply(
+                self.whitelist, self.admin_users, dict(self.groups),
+                delete=complete and self.hub.delete_users,
+            )
+
+        except requests.RequestException as exc:
+
+            logger.error(f'Cannot apply changes to the running hub: {exc}')
+
+            return False
+
+        return True
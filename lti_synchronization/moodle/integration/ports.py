@@ -0,0 +1,150 @@
+'''
+Persistent allocation of service ports.
+
+Every nbgrader course gets a Jupyterhub service listening on its own port.
+The port used to be derived from the course position in the received list,
+so adding or removing a course shifted ports of all the following ones and
+every service had to be restarted. Now a course keeps its port as long as
+it is synchronized, and ports of removed courses are given to new ones.
+
+Table layout::
+
+    {"course_id": 0, "other_course_id": 1}
+
+Values are offsets from the first service port (see Templater.create_service).
+'''
+
+import heapq
+import json
+import os
+import typing as t
+
+from loguru import logger
+
+from moodle.typehints import PathLike
+from . import system
+
+
+class PortAllocator:
+    '''Course to service port offset table.
+
+    Args:
+        ports (t.Optional[t.Dict[str, int]]): Stored allocation. Defaults to None.
+
+    Attributes:
+        ports (t.Dict[str, int]): Port offset of every course.
+        changed (bool): Allocation has changed since it was loaded.
+    '''
+
+    ports: t.Dict[str, int]
+
+    def __init__(self, ports: t.Optional[t.Dict[str, int]] = None) -> None:
+
+        self.ports = dict(ports or {})
+
+        self.changed = False
+
+        self._used: t.Set[str] = set()
+
+        self._next = max(self.ports.values(), default=-1) + 1
+
+        # gaps left by removed courses, smallest offset first
+        self._free = sorted(set(range(self._next)) - set(self.ports.values()))
+
+    @classmethod
+    def load(cls, path: PathLike) -> 'PortAllocator':
+        '''Loads allocation stored by the previous synchronization.
+
+        Args:
+            path (PathLike): Path to the table file.
+
+        Returns:
+            PortAllocator: Stored allocation, empty if there is no valid file.
+        '''
+
+        if not os.path.exists(path):
+            return cls()
+
+        try:
+            with open(path, 'r') as f:
+                return cls(json.loads(f.read()))
+
+        except (OSError, ValueError, TypeError) as exc:
+            logger.warning(f'Cannot read service ports {str(path)!r}: {exc}')
+            return cls()
+
+    def save(self, path: PathLike) -> None:
+        '''Saves allocation to the disk.
+
+        The file is replaced atomically, an interrupted save keeps
+        the previous allocation rather than an empty one.
+
+        Args:
+            path (PathLike): Path to the table file.
+        '''
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        system.write_file(path, json.dumps(self.ports, sort_keys=True))
+
+        self.changed = False
+
+    def get(self, course_id: str) -> int:
+        '''Gets the port offset of the course, allocating a new one
+        if the course has none. Freed offsets are reused first.
+
+        Args:
+            course_id (str): Normalized course name.
+
+        Returns:
+            int: Port offset.
+        '''
+
+        self._used.add(course_id)
+
+        if course_id in self.ports:
+            return self.ports[course_id]
+
+        if self._free:
+            port = heapq.heappop(self._free)
+        else:
+            port = self._next
+            self._next += 1
+
+        self.ports[course_id] = port
+
+        self.changed = True
+
+        logger.debug(f'Allocated service port offset {port} to {course_id!r}')
+
+        return port
+
+    def release(self, course_id: str) -> None:
+        '''Frees the port of the course.
+
+        Args:
+            course_id (str): Normalized course name.
+        '''
+
+        port = self.ports.pop(course_id, None)
+
+        if port is not None:
+
+            heapq.heappush(self._free, port)
+
+            self.changed = True
+
+    def release_unused(self) -> t.Set[str]:
+        '''Frees ports of courses which were not requested
+        since the allocation was loaded.
+
+        Returns:
+            t.Set[str]: Courses whose ports were freed.
+        '''
+
+        unused = self.ports.keys() - self._used
+
+        for course_id in unused:
+            self.release(course_id)
+
+        return unused
@@ -0,0 +1,183 @@
+'''
+Batch provisioning of unix users and file permissions.
+
+SyncManager used to create every user and change permissions of every home
+directory as soon as it met the user in a course, forking several shells per
+user. Instead, the manager queues operations to the Provisioner during the
+synchronization and applies them at once in the end: all users are created
+with a single ``newusers`` call, ownership and permissions are changed with
+native calls.
+'''
+
+import os
+import typing as t
+
+from loguru import logger
+
+from moodle.typehints import PathLike
+
+from . import system
+
+
+class Provisioner:
+    '''
+    Collects pending user creations and permission changes
+    and applies them in bulk.
+
+    Every path is processed once per synchronization. If the same path
+    was queued several times, the last request wins.
+
+    Ownership is reconciled rather than changed blindly: a tree is walked
+    only if its top entry has a wrong owner, or the owner was created in
+    this run, or ``deep_verify`` is set. Even then only entries with a
+    wrong owner are changed (see ``system.reconcile_owner``).
+
+    Args:
+        deep_verify (bool): Walk every queued tree to find mismatched
+            entries. Defaults to False.
+
+    Attributes:
+        users (t.Dict[str, None]): Users to create, in order of queueing.
+        owners (t.Dict[str, t.Tuple[str, t.Optional[str]]]):
+            Path mapped to new owner and group.
+        modes (t.Dict[str, int]): Path mapped to new permissions.
+        failed (t.Set[str]): Users which could not be created or given
+            their files, by every ``apply`` call so far.
+    '''
+
+    users: t.Dict[str, None]
+
+    owners: t.Dict[str, t.Tuple[str, t.Optional[str]]]
+
+    modes: t.Dict[str, int]
+
+    failed: t.Set[str]
+
+    def __init__(self, deep_verify: bool = False) -> None:
+
+        self.deep_verify = deep_verify
+
+        self.users = {}
+        self.owners = {}
+        self.modes = {}
+        self.failed = set()
+
+    def clear(self) -> None:
+        '''
+        Drop all queued operations.
+        '''
+
+        self.users.clear()
+        self.owners.clear()
+        self.modes.clear()
+
+    def __len__(self) -> int:
+        return len(self.users) + len(self.owners) + len(self.modes)
+
+    def add_user(self, username: str) -> None:
+        '''
+        Queue new user creation.
+
+        Args:
+            username (str): New user's name.
+        '''
+
+        if not username:
+            raise ValueError('User must be set.')
+
+        self.users[username] = None
+
+    def chown(self, user: str, path: PathLike, group: t.Optional[str] = None) -> None:
+        '''
+        Queue recursive change of the path's owner.
+
+        Args:
+            user (str): New owner's name.
+            path (PathLike): File or directory.
+            group (t.Optional[str]): Group name. Defaults to None.
+        '''
+
+        if not user:
+            raise ValueError('User must be set.')
+
+        self.owners[str(path)] = (user, group)
+
+    def chmod(self, mod: t.Union[str, int], path: PathLike) -> None:
+        '''
+        Queue change of the path's permissions.
+
+        Args:
+            mod (t.Union[str, int]): Unix-style permissions, like 700 or '755'.
+            path (PathLike): File or directory.
+        '''
+
+        self.modes[str(path)] = int(str(mod), 8)
+
+    def apply(self) -> t.Dict[str, int]:
+        '''
+        Apply all queued operations and clear the queue.
+
+        Users are created first, so they can own files afterwards.
+        Then home directories are created, ownership and permissions
+        are changed.
+
+        Returns:
+            t.Dict[str, int]: Number of created users, reconciled trees,
+                scanned and fixed inodes, and changed modes.
+        '''
+
+        summary = {
+            'users': len(self.users),
+            'chown': 0,
+            'scanned': 0,
+            'fixed': 0,
+            'chmod': 0,
+        }
+
+        if self.users:
+
+            failed: t.List[str] = system.create_users(list(self.users))
+
+            summary['users'] -= len(failed)
+
+            self.failed.update(failed)
+
+            for username in self.users:
+                if username not in failed:
+                    os.makedirs(f'/home/{username}', exist_ok=True)
+
+        for path, (user, group) in self.owners.items():
+
+            if not os.path.lexists(path):
+                logger.warning(f'Cannot change owner of {path!r}: no such file.')
+                continue
+
+            try:
+                uid, gid = system.get_ids(user, group)
+            except KeyError:
+                logger.error(f'Cannot change owner of {path!r}: unknown user {user!r}.')
+                self.failed.add(user)
+                continue
+
+            scanned, fixed = system.reconcile_owner(
+                path, uid, gid, deep=self.deep_verify or user in self.users)
+
+            summary['chown'] += 1
+            summary['scanned'] += scanned
+            summary['fixed'] += fixed
+
+        for path, mode in self.modes.items():
+
+            if not os.path.lexists(path):
+                logger.warning(f'Cannot change mode of {path!r}: no such file.')
+                continue
+
+            os.chmod(path, mode)
+
+            summary['chmod'] += 1
+
+        logger.info(f'Provisioning is completed: {summary}')
+
+        self.clear()
+
+        return summary
@@ -0,0 +1,296 @@
+'''
+Snapshot of the last synchronized state and a diff engine over it.
+
+Every synchronization receives the whole picture from Moodle, but between
+two runs only a handful of enrolments usually change. To avoid touching
+the system for every user on every run, we store what was processed last
+time and compare every received course with it. Only added and changed
+users, and new or changed courses, go through OS and gradebook operations.
+
+Snapshot layout::
+
+    {
+        "courses": {
+            "course_id": {
+                "id": 1,
+                "title": "Course title",
+                "need_nbgrader": true,
+                "lms_lineitems_endpoint": "https://...",
+                "users": {"username": "student", ...}
+            }
+        },
+        "users": {
+            "username": {"id": 1, "first_name": "", "last_name": "", "email": ""}
+        }
+    }
+'''
+
+import json
+import os
+import typing as t
+
+from loguru import logger
+
+from moodle.typehints import Course, JsonType, PathLike, User
+from . import system
+
+
+# Course fields which require to reconfigure the course when changed.
+COURSE_FIELDS: t.Tuple[str, ...] = ('id', 'need_nbgrader', 'lms_lineitems_endpoint')
+
+# User fields stored in the nbgrader database.
+USER_FIELDS: t.Tuple[str, ...] = ('id', 'first_name', 'last_name', 'email')
+
+GROUPS: t.Tuple[str, ...] = ('instructors', 'graders', 'students')
+
+
+class CourseDiff:
+    '''Difference between the stored and the received state of a course.
+
+    Args:
+        course_id (str): Normalized course name.
+        new (bool): Course was not synchronized before. Defaults to False.
+        changed (bool): One of COURSE_FIELDS has changed. Defaults to False.
+        added (t.Iterable[str]): Newly enrolled users.
+        removed (t.Iterable[str]): Users not enrolled anymore.
+        updated (t.Iterable[str]): Users whose role or profile has changed.
+    '''
+
+    def __init__(
+                self,
+                course_id: str,
+                *,
+                new: bool = False,
+                changed: bool = False,
+                added: t.Iterable[str] = (),
+                removed: t.Iterable[str] = (),
+                updated: t.Iterable[str] = (),
+            ) -> None:
+
+        self.course_id = course_id
+        self.new = new
+        self.changed = changed
+        self.added = set(added)
+        self.removed = set(removed)
+        self.updated = set(updated)
+
+    @property
+    def touched(self) -> t.Set[str]:
+        '''
+        Users which should go through OS and gradebook operations.
+        '''
+
+        return self.added | self.updated
+
+    def __bool__(self) -> bool:
+        return bool(
+            self.new or self.changed
+            or self.added or self.removed or self.updated
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f'CourseDiff({self.course_id!r}, new={self.new}, '
+            f'changed={self.changed}, added={len(self.added)}, '
+            f'removed={len(self.removed)}, updated={len(self.updated)})'
+        )
+
+
+class SyncDiff:
+    '''Difference between two synchronizations.
+
+    Attributes:
+        courses (t.Dict[str, CourseDiff]): Diff of every received course.
+        removed_courses (t.Set[str]): Courses not received anymore.
+    '''
+
+    def __init__(self) -> None:
+
+        self.courses: t.Dict[str, CourseDiff] = {}
+        self.removed_courses: t.Set[str] = set()
+
+    def __bool__(self) -> bool:
+        return bool(self.removed_courses) or any(self.courses.values())
+
+    def summary(self) -> t.Dict[str, int]:
+        '''
+        Count changes of every kind.
+        '''
+
+        diffs = self.courses.values()
+
+        return {
+            'new_courses': sum(diff.new for diff in diffs),
+            'changed_courses': sum(diff.changed for diff in diffs),
+            'removed_courses': len(self.removed_courses),
+            'added_users': sum(len(diff.added) for diff in diffs),
+            'removed_users': sum(len(diff.removed) for diff in diffs),
+            'updated_users': sum(len(diff.updated) for diff in diffs),
+        }
+
+
+class Snapshot:
+    '''Processed courses, users and their roles.
+
+    Args:
+        courses (t.Optional[JsonType]): Stored courses. Defaults to None.
+        users (t.Optional[JsonType]): Stored users. Defaults to None.
+    '''
+
+    courses: t.Dict[str, JsonType]
+
+    users: t.Dict[str, JsonType]
+
+    def __init__(
+                self,
+                courses: t.Optional[JsonType] = None,
+                users: t.Optional[JsonType] = None,
+            ) -> None:
+
+        self.courses = courses or {}
+        self.users = users or {}
+
+    @classmethod
+    def load(cls, path: PathLike) -> 'Snapshot':
+        '''Loads snapshot stored by the previous synchronization.
+
+        Missing or corrupted file results in empty snapshot, which means
+        every course would be processed as a new one.
+
+        Args:
+            path (PathLike): Path to the snapshot file.
+
+        Returns:
+            Snapshot: Stored snapshot.
+        '''
+
+        if not os.path.exists(path):
+            logger.info(f'No snapshot found at {str(path)!r}.')
+            return cls()
+
+        try:
+            with open(path, 'r') as f:
+                data = json.loads(f.read())
+
+        except (OSError, ValueError) as exc:
+            logger.warning(f'Cannot read snapshot {str(path)!r}: {exc}')
+            return cls()
+
+        return cls(data.get('courses'), data.get('users'))
+
+    def save(self, path: PathLike) -> None:
+        '''Saves snapshot to the disk.
+
+        The file is replaced atomically, an interrupted save keeps the
+        previous snapshot, so the next run is not treated as the first one.
+
+        Args:
+            path (PathLike): Path to the snapshot file.
+        '''
+
+        system.write_file(path, json.dumps(
+            {'courses': self.courses, 'users': self.users},
+            sort_keys=True,
+            separators=(',', ':'),
+        ))
+
+        logger.debug(f'Saved snapshot of {len(self.courses)} courses.')
+
+    @staticmethod
+    def _iter_users(course: Course) -> t.Generator[t.Tuple[str, User], None, None]:
+        '''
+        Yields group name and user for every user enrolled in the course.
+        '''
+
+        for group in GROUPS:
+            for user in course.get(group, ()):
+                yield group, user
+
+    @staticmethod
+    def _profile(user: User) -> JsonType:
+        return {field: user.get(field) for field in USER_FIELDS}
+
+    def add(self, course: Course) -> None:
+        '''Stores the course and its users in the snapshot.
+
+        Args:
+            course (Course): Processed course.
+        '''
+
+        users: t.Dict[str, str] = {}
+
+        for group, user in self._iter_users(course):
+
+            users[user['username']] = user.get('role') or group
+
+            self.users[user['username']] = self._profile(user)
+
+        self.courses[course['course_id']] = {
+            'title': course.get('title'),
+            **{field: course.get(field) for field in COURSE_FIELDS},
+            'users': users,
+        }
+
+    def discard_user(self, username: str) -> None:
+        '''Forgets the user, so the next synchronization treats
+        the user as added to every course.
+
+        Args:
+            username (str): User to forget.
+        '''
+
+        self.users.pop(username, None)
+
+        for course in self.courses.values():
+            course['users'].pop(username, None)
+
+    def diff_course(self, course: Course) -> CourseDiff:
+        '''Compares received course with the stored one.
+
+        Args:
+            course (Course): Course received from Moodle.
+
+        Returns:
+            CourseDiff: What has changed since the snapshot was taken.
+        '''
+
+        course_id: str = course['course_id']
+
+        stored = self.courses.get(course_id)
+
+        if stored is None:
+
+            return CourseDiff(
+                course_id,
+                new=True,
+                added=(user['username'] for _, user in self._iter_users(course)),
+            )
+
+        stored_users: t.Dict[str, str] = stored['users']
+
+        added, updated = [], []
+
+        received = set()
+
+        for group, user in self._iter_users(course):
+
+            username: str = user['username']
+
+            received.add(username)
+
+            if username not in stored_users:
+                added.append(username)
+
+            elif (
+                stored_users[username] != (user.get('role') or group)
+                or self.users.get(username) != self._profile(user)
+            ):
+                updated.append(username)
+
+        return CourseDiff(
+            course_id,
+            changed=any(stored.get(f) != course.get(f) for f in COURSE_FIELDS),
+            added=added,
+            removed=stored_users.keys() - received,
+            updated=updated,
+        )
@@ -1,12 +1,22 @@
+import contextlib
 import os
 import functools
+import grp
+import hashlib
+import re
+import secrets
+import shutil
+import stat
+import subprocess
+import tempfile
+import threading
 from pathlib import Path
 import typing as t
 
 from loguru import logger
 from custom_inherit import doc_inherit
 
-from moodle.typehints import Dirs
+from moodle.typehints import Dirs, PathLike
 
 
 def join_dirs(dirs: Dirs) -> str:
@@ -68,11 +78,12 @@ def create_dirs(*dirs) -> None:
 
     '''
 
-    # make unrelated directories
-    # in contrast with os.mkdirs
-    os.system(f'mkdir -p {join_dirs(dirs)}')
+    str_dirs: str = join_dirs(dirs)
 
-    logger.debug(f'Create {len(dirs)} directories: {join_dirs(dirs)}.')
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+
+    logger.debug(f'Create {len(dirs)} directories: {str_dirs}.')
 
 
 @doc_inherit(create_dirs)
@@ -97,16 +108,264 @@ def create_database(grader: str) -> None:
 
     grader_db: str = f'/home/{grader}/grader.db'
 
-    os.system(f'touch {grader_db}')
+    touch(grader_db)
 
     chown(grader, f'/home/{grader}', group=grader)
 
     chmod(755, f'/home/{grader}')
 
 
+def touch(path: PathLike) -> None:
+    '''
+    Create an empty file if not exists already.
+
+    Args:
+        path (PathLike): Path to the file.
+    '''
+
+    with open(path, 'a'):
+        pass
+
+
+@contextlib.contextmanager
+def open_atomic(
+            path: PathLike,
+            mode: t.Optional[int] = None,
+            encoding: t.Optional[str] = None,
+        ) -> t.Iterator[t.IO]:
+    '''
+    Open a temporary file which atomically replaces the path when closed.
+
+    The file is created in the same directory, flushed to the disk and
+    renamed over the target only if the block succeeds, so readers see
+    either the old or the new file, never a truncated one. Owner and
+    permissions of the replaced file are kept, unless ``mode`` is set.
+
+    Args:
+        path (PathLike): Target file.
+        mode (t.Optional[int]):
+            Permissions of the file. Defaults to None, which keeps
+            the permissions of the replaced file, 0o644 for a new one.
+        encoding (t.Optional[str]):
+            Open the file in text mode with the encoding.
+            Defaults to None, which opens it in binary mode.
+
+    Yields:
+        t.IO: Temporary file to write to.
+    '''
+
+    path = str(path)
+
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        current = None
+
+    directory = os.path.dirname(os.path.abspath(path))
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}.')
+
+    try:
+        with os.fdopen(fd, 'wb' if encoding is None else 'w', encoding=encoding) as f:
+
+            yield f
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        if current is None:
+            os.chmod(tmp_path, 0o644 if mode is None else mode)
+        else:
+            os.chmod(tmp_path, stat.S_IMODE(current.st_mode) if mode is None else mode)
+            os.chown(tmp_path, current.st_uid, current.st_gid)
+
+        os.replace(tmp_path, path)
+
+    except BaseException:
+
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+
+        raise
+
+    # persist the rename itself
+    dir_fd = os.open(directory, os.O_RDONLY)
+
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def write_file(path: PathLike, content: str, mode: t.Optional[int] = None) -> bool:
+    '''
+    Atomically replace the file's content, if it differs.
+
+    The file is written with ``open_atomic``. Identical content is not
+    written at all, so the modification time changes only with the content.
+
+    Args:
+        path (PathLike): Target file.
+        content (str): New content.
+        mode (t.Optional[int]):
+            Permissions of the file. Defaults to None, which keeps
+            the permissions of the replaced file, 0o644 for a new one.
+
+    Returns:
+        bool: The file was created or changed.
+    '''
+
+    path = str(path)
+
+    data: bytes = content.encode()
+
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        current = None
+
+    if (
+        current is not None and current.st_size == len(data)
+        and (mode is None or stat.S_IMODE(current.st_mode) == mode)
+    ):
+
+        with open(path, 'rb') as f:
+
+            if hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest():
+
+                logger.debug(f'{path!r} is up to date.')
+
+                return False
+
+    with open_atomic(path, mode) as f:
+        f.write(data)
+
+    return True
+
+
+def get_ids(user: str, group: t.Optional[str] = None) -> t.Tuple[int, int]:
+    '''
+    Get uid of the user and gid of the group.
+
+    Args:
+        user (str): User name.
+        group (t.Optional[str]): Group name. Defaults to None.
+
+    Returns:
+        t.Tuple[int, int]: uid and gid. gid is -1 if the group is not
+            specified, which leaves a group unchanged by os.chown.
+
+    Raises:
+        KeyError: the user or the group does not exist.
+    '''
+
+    return (
+        passwd.uid(user),
+        grp.getgrnam(group).gr_gid if group else -1,
+    )
+
+
+def chown_tree(path: PathLike, uid: int, gid: int = -1) -> int:
+    '''
+    Change owner of the path and everything below it like ``chown -R``.
+    Symbolic links are not followed.
+
+    Args:
+        path (PathLike): Top file or directory.
+        uid (int): New owner's id.
+        gid (int): New group's id. Defaults to -1 (unchanged).
+
+    Returns:
+        int: Number of changed entries.
+    '''
+
+    os.chown(path, uid, gid, follow_symlinks=False)
+
+    changed: int = 1
+
+    if os.path.isdir(path) and not os.path.islink(path):
+
+        for root, dirs, files in os.walk(path):
+
+            for name in dirs + files:
+
+                os.chown(os.path.join(root, name), uid, gid, follow_symlinks=False)
+
+                changed += 1
+
+    return changed
+
+
+def reconcile_owner(
+            path: PathLike,
+            uid: int,
+            gid: int = -1,
+            deep: bool = False,
+        ) -> t.Tuple[int, int]:
+    '''
+    Change owner only of entries which have a wrong one.
+
+    If the top entry already has the expected owner, the tree is assumed
+    to be consistent and is not walked unless ``deep`` is set. Otherwise
+    the tree is walked with ``os.scandir`` and only mismatched entries are
+    changed. Symbolic links are not followed.
+
+    Args:
+        path (PathLike): Top file or directory.
+        uid (int): Expected owner's id.
+        gid (int): Expected group's id. Defaults to -1 (any group).
+        deep (bool): Walk the tree even if the top entry is fine.
+            Defaults to False.
+
+    Returns:
+        t.Tuple[int, int]: Number of scanned and fixed entries.
+    '''
+
+    def _mismatched(st: os.stat_result) -> bool:
+        return st.st_uid != uid or (gid != -1 and st.st_gid != gid)
+
+    scanned, fixed = 1, 0
+
+    st = os.lstat(path)
+
+    if _mismatched(st):
+
+        os.chown(path, uid, gid, follow_symlinks=False)
+
+        fixed += 1
+
+    elif not deep:
+
+        return scanned, fixed
+
+    if not stat.S_ISDIR(st.st_mode):
+        return scanned, fixed
+
+    stack: t.List[str] = [str(path)]
+
+    while stack:
+
+        with os.scandir(stack.pop()) as entries:
+
+            for entry in entries:
+
+                scanned += 1
+
+                if _mismatched(entry.stat(follow_symlinks=False)):
+
+                    os.chown(entry.path, uid, gid, follow_symlinks=False)
+
+                    fixed += 1
+
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+
+    return scanned, fixed
+
+
 def chown(user: str, /, *dirs: Dirs, group: t.Optional[str] = None) -> None:
     '''
-    Change owner of files and / or directories in the system.
+    Change owner of files and / or directories in the system recursively.
 
     Args:
         user (str): New owner's name
@@ -120,9 +379,18 @@ def chown(user: str, /, *dirs: Dirs, group: t.Optional[str] = None) -> None:
     if group is not None and group == '':
         raise ValueError('Group should not be empty string.')
 
-    who_to = user if not group else f'{user}:{group}'
+    # validate directories before changing anything
+    join_dirs(dirs)
 
-    os.system(f'chown -R {who_to} {join_dirs(dirs)}')
+    uid, gid = get_ids(user, group)
+
+    for d in dirs:
+
+        if not os.path.lexists(d):
+            logger.warning(f'Cannot change owner of {d!r}: no such file.')
+            continue
+
+        chown_tree(d, uid, gid)
 
 
 def chmod(mod: t.Union[str, int], *dirs: Dirs) -> None:
@@ -130,12 +398,17 @@ def chmod(mod: t.Union[str, int], *dirs: Dirs) -> None:
     Update files and / or directories permissions.
 
     Args:
-        mod (t.Union[str, int]): Unix-style permissions.
+        mod (t.Union[str, int]): Unix-style permissions, like 700 or '755'.
         *dirs (Dirs): Tuple of PathLike objects.
 
     '''
 
-    os.system(f'chmod {mod} {join_dirs(dirs)}')
+    mode: int = int(str(mod), 8)
+
+    join_dirs(dirs)
+
+    for d in dirs:
+        os.chmod(d, mode)
 
 
 def enable_nbgrader(user: str) -> None:
@@ -159,26 +432,276 @@ def enable_nbgrader(user: str) -> None:
               " --user --py nbgrader'")
 
 
-def create_user(username: str) -> None:
+def create_user(username: str) -> bool:
     '''
     Create new user in the system.
 
+    A failed account is logged and skipped, so one rejected name
+    doesn't stop the synchronization.
+
     Args:
         username (str): New user's name.
+
+    Returns:
+        bool: The user was created.
     '''
 
     logger.info(f'Create linux user {username}.')
 
-    os.system(f'adduser -q --gecos "" --disabled-password --force-badname {username}')
+    result = subprocess.run(
+        ['adduser', '-q', '--gecos', '', '--disabled-password', '--force-badname', username])
+
+    if result.returncode:
+        logger.error(f'Cannot create linux user {username!r}: adduser exited with {result.returncode}.')
+        return False
 
     # if 'grader' not in username:
     #
     #     # graders should have public folders in order to communicate with
     #     # their databases.
 
-    chmod(700, f'/home/{username}')
+    try:
+        chmod(700, f'/home/{username}')
+
+        chown(username, f'/home/{username}')
+
+    except (KeyError, OSError) as exc:
+
+        logger.error(f'Cannot set up home of linux user {username!r}: {exc!r}')
+
+        return False
+
+    return True
+
+
+# Names accepted by useradd and newusers with the default NAME_REGEX,
+# others are created by adduser --force-badname.
+USERADD_NAME: t.Pattern = re.compile(r'[a-z_][a-z0-9_-]{0,30}\$?')
+
+SKEL_DIR: str = '/etc/skel'
+
+
+def copy_skel(username: str, home: t.Optional[PathLike] = None) -> None:
+    '''
+    Copy /etc/skel to the user's home like adduser does.
+    Files already in the home directory are kept.
+
+    Args:
+        username (str): Owner of the home directory.
+        home (t.Optional[PathLike]): Home directory. Defaults to /home/<username>.
+    '''
+
+    home = str(home or f'/home/{username}')
+
+    if not os.path.isdir(SKEL_DIR):
+        return
+
+    for entry in os.scandir(SKEL_DIR):
+
+        target = os.path.join(home, entry.name)
+
+        if os.path.lexists(target):
+            continue
+
+        if entry.is_dir(follow_symlinks=False):
+            shutil.copytree(entry.path, target, symlinks=True)
+        else:
+            shutil.copy2(entry.path, target, follow_symlinks=False)
+
+    chown_tree(home, passwd.uid(username), passwd.gid(username))
+
+
+def create_users(usernames: t.Sequence[str]) -> t.List[str]:
+    '''
+    Create new users in the system with a single ``newusers`` call.
+
+    Every user gets a group with the same name and /home/<username> home
+    directory with /etc/skel copied in. Passwords are locked afterwards
+    with a single ``chpasswd`` call, like ``adduser --disabled-password``
+    does.
+
+    ``newusers`` rejects the whole batch if one name breaks useradd's
+    rules, so such names are created one by one with create_user, as well
+    as every user if the batch call fails or shadow utils are not available.
+    Users that can't be created are logged and skipped.
+
+    Args:
+        usernames (t.Sequence[str]): New users' names.
+
+    Returns:
+        t.List[str]: Users that could not be created.
+    '''
+
+    new_users: t.List[str] = [
+        username for username in usernames if username not in passwd]
+
+    if not new_users:
+        return []
+
+    if not (shutil.which('newusers') and shutil.which('chpasswd')):
+        return [username for username in new_users if not create_user(username)]
+
+    batch: t.List[str] = [
+        username for username in new_users if USERADD_NAME.fullmatch(username)]
+
+    if batch:
+
+        logger.info(f'Create {len(batch)} linux users.')
+
+        try:
+            subprocess.run(
+                ['newusers'],
+                input=''.join(
+                    f'{username}:{secrets.token_hex(16)}:::'
+                    f':/home/{username}:/bin/bash\n'
+                    for username in batch
+                ),
+                text=True,
+                check=True,
+            )
+
+            subprocess.run(
+                ['chpasswd', '-e'],
+                input=''.join(f'{username}:!\n' for username in batch),
+                text=True,
+                check=True,
+            )
+
+        except subprocess.CalledProcessError as exc:
+
+            logger.warning(f'Cannot create users at once, creating them one by one: {exc}')
+
+        else:
+
+            for username in batch:
+
+                try:
+                    copy_skel(username)
+                except (KeyError, OSError) as exc:
+                    logger.warning(f'Cannot copy {SKEL_DIR} to the home of {username!r}: {exc!r}')
+
+    return [
+        username for username in new_users
+        if username not in passwd and not create_user(username)
+    ]
+
+
+class PasswdIndex:
+    '''In-process index of the passwd file.
+
+    The file is parsed once and parsed again only when its inode, size,
+    or modification time changes, so checking whether a user exists costs
+    one ``stat`` call and a dictionary lookup instead of forking a shell.
+
+    Examples:
+
+        Check that the user exists and get its ids::
+
+            'plato' in passwd
+            >>> True
+
+            passwd.uid('plato'), passwd.gid('plato')
+            >>> (1000, 1000)
+
+    Args:
+        path (PathLike): Path to passwd file. Defaults to /etc/passwd.
+    '''
+
+    def __init__(self, path: PathLike = '/etc/passwd') -> None:
+
+        self.path = path
+
+        self._stamp: t.Optional[t.Tuple[int, int, int]] = None
+        self._entries: t.Dict[str, t.Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def _parse(self) -> t.Dict[str, t.Tuple[int, int]]:
+
+        entries: t.Dict[str, t.Tuple[int, int]] = {}
+
+        with open(self.path, 'r') as f:
+
+            for line in f:
+
+                fields = line.rstrip('\n').split(':')
+
+                # skip comments, NIS entries, and malformed lines
+                if len(fields) < 4 or line.startswith(('#', '+', '-')):
+                    continue
+
+                try:
+                    entries[fields[0]] = (int(fields[2]), int(fields[3]))
+                except ValueError:
+                    continue
+
+        return entries
+
+    def refresh(self) -> t.Dict[str, t.Tuple[int, int]]:
+        '''
+        Parse the file again if it has changed since the last call.
+
+        Returns:
+            t.Dict[str, t.Tuple[int, int]]: username mapped to uid and gid.
+        '''
+
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return {}
+
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+        if stamp != self._stamp:
+
+            with self._lock:
+
+                if stamp != self._stamp:
+
+                    self._entries = self._parse()
+                    self._stamp = stamp
+
+                    logger.debug(f'Loaded {len(self._entries)} users from {self.path}')
+
+        return self._entries
+
+    def __contains__(self, username: str) -> bool:
+        return username in self.refresh()
+
+    def __iter__(self) -> t.Iterator[str]:
+        return iter(list(self.refresh()))
+
+    def __len__(self) -> int:
+        return len(self.refresh())
+
+    def get(self, username: str) -> t.Optional[t.Tuple[int, int]]:
+        '''
+        Get uid and gid of the user or None if the user does not exist.
+        '''
+
+        return self.refresh().get(username)
+
+    def uid(self, username: str) -> int:
+        '''
+        Get uid of the user.
+
+        Raises:
+            KeyError: the user does not exist.
+        '''
+
+        return self.refresh()[username][0]
+
+    def gid(self, username: str) -> int:
+        '''
+        Get primary group id of the user.
+
+        Raises:
+            KeyError: the user does not exist.
+        '''
+
+        return self.refresh()[username][1]
+
 
-    chown(username, f'/home/{username}')
+passwd = PasswdIndex()
 
 
 def get_unix_usernames() -> t.List[str]:
@@ -189,4 +712,4 @@ def get_unix_usernames() -> t.List[str]:
 
     '''
 
-    return os.popen('cut -d: -f1 /etc/passwd').read().split()
+    return list(passwd)
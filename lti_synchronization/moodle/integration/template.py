@@ -2,10 +2,65 @@
 import typing as t
 
 from loguru import logger
+from .system import write_file
 from .templates import Config
 from moodle.typehints import PathLike
 from moodle.utils import JsonDict, grader
-from yapf.yapflib.yapf_api import FormatCode
+
+
+INDENT: str = ' ' * 4
+
+
+def format_literal(value: t.Any, level: int = 0) -> str:
+    '''Formats a value as Python literal for the configuration file.
+
+    Every item of a non-empty container is put on its own line, so the
+    output is readable and changes of a single user are single-line diffs.
+    Set items are sorted, dicts and lists keep their order, so the output
+    is the same for the same data.
+
+    Args:
+        value (t.Any): Set, dict, list, tuple or a scalar.
+        level (int): Nesting level of the value. Defaults to 0.
+
+    Returns:
+        str: Python source of the value.
+    '''
+
+    inner: str = INDENT * (level + 1)
+    outer: str = INDENT * level
+
+    if isinstance(value, (set, frozenset)):
+
+        if not value:
+            return 'set()'
+
+        brackets = '{}'
+        items = [format_literal(item, level + 1) for item in sorted(value)]
+
+    elif isinstance(value, dict):
+
+        if not value:
+            return '{}'
+
+        brackets = '{}'
+        items = [
+            f'{format_literal(key, level + 1)}: {format_literal(item, level + 1)}'
+            for key, item in value.items()
+        ]
+
+    elif isinstance(value, (list, tuple)) and value:
+
+        brackets = '()' if isinstance(value, tuple) else '[]'
+        items = [format_literal(item, level + 1) for item in value]
+
+    else:
+
+        return repr(value)
+
+    body: str = ''.join(f'{inner}{item},\n' for item in items)
+
+    return f'{brackets[0]}\n{body}{outer}{brackets[1]}'
 
 
 class Templater:
@@ -43,35 +98,39 @@ def update_jupyterhub_config(
         file_path: PathLike,
         default_config: str,
         **kwargs: t.Any
-    ) -> None:
+    ) -> bool:
         '''Short summary.
 
+        Values are emitted with format_literal, so the same data
+        always produces the same file. The file is replaced atomically
+        and only if its content has changed.
+
         Args:
             file_path (PathLike): .
             default_config (str): .
-            **kwargs (t.Any): .
+            **kwargs (t.Any): Values for the Config.users template.
 
         Returns:
-            None: .
+            bool: The file was created or changed.
 
         '''
 
-        if os.path.exists(file_path):
+        changed: bool = write_file(
+            file_path,
+            Config.template_warning
+            + '\n\n\n'
+            + default_config
+            + Config.users.format(**{
+                key: format_literal(value) for key, value in kwargs.items()
+            })
+        )
 
-            logger.warning(f'Old {file_path!r} will be overwritten.')
+        if changed:
+            logger.info(f'Successfully updated {file_path!r}')
+        else:
+            logger.info(f'{file_path!r} is up to date.')
 
-        with open(file_path, 'w') as jupyterhub_config:
-
-            jupyterhub_config.write(
-                FormatCode(
-                    Config.template_warning
-                    + '\n\n\n'
-                    + default_config
-                    + Config.users.format(**kwargs), style_config='pep8'
-                )[0]
-            )
-
-        logger.info(f'Successfully updated {file_path!r}')
+        return changed
 
     @staticmethod
     def create_service(course_id: str, api_token: str, port: int = 0) -> JsonDict:
@@ -104,7 +163,7 @@ def create_service(course_id: str, api_token: str, port: int = 0) -> JsonDict:
         })
 
     @staticmethod
-    def write_grader_config(course_id: str) -> None:
+    def write_grader_config(course_id: str) -> bool:
         '''
         In order to set up course, we need to create two configuration files.
 
@@ -119,22 +178,27 @@ def write_grader_config(course_id: str) -> None:
 
         Args:
             course_id (str): Normalized name of the course
+
+        Returns:
+            bool: One of the files was created or changed.
         '''
 
         course_grader: str = grader / course_id
 
         logger.debug(f'Writing grader config for {course_grader}')
 
-        with open(f'/home/{course_grader}/.jupyter/nbgrader_config.py', 'w') as f:
-            f.write(
-                Config.home_config.format(
-                    grader=grader / course_id,
-                    course_id=course_id,
-                    db_url='sqlite:///' + f'/home/{course_grader}/grader.db'
-                )
+        changed: bool = write_file(
+            f'/home/{course_grader}/.jupyter/nbgrader_config.py',
+            Config.home_config.format(
+                grader=grader / course_id,
+                course_id=course_id,
+                db_url='sqlite:///' + f'/home/{course_grader}/grader.db'
             )
+        )
 
-        with open(f'/home/{course_grader}/{course_id}/nbgrader_config.py', 'w') as f:
-            f.write(
-                Config.course_config.format(course_id=course_id)
-            )
+        changed |= write_file(
+            f'/home/{course_grader}/{course_id}/nbgrader_config.py',
+            Config.course_config.format(course_id=course_id)
+        )
+
+        return changed
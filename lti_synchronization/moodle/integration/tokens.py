@@ -0,0 +1,138 @@
+'''
+Persistent API tokens of course services.
+
+Every nbgrader course service talks to Jupyterhub with its own API token.
+Tokens used to be generated anew on every synchronization, which invalidated
+all running services. Now a course keeps its token until it is removed or
+the token is rotated explicitly.
+
+Table layout::
+
+    {"course_id": "hex token", ...}
+
+The file contains secrets, so it is readable by its owner only.
+'''
+
+import json
+import os
+import typing as t
+from secrets import token_hex
+
+from loguru import logger
+
+from moodle.typehints import PathLike
+from . import system
+
+
+class TokenStore:
+    '''Course to service API token table.
+
+    Args:
+        tokens (t.Optional[t.Dict[str, str]]): Stored tokens. Defaults to None.
+
+    Attributes:
+        tokens (t.Dict[str, str]): API token of every course.
+        changed (bool): Tokens have changed since they were loaded.
+    '''
+
+    tokens: t.Dict[str, str]
+
+    def __init__(self, tokens: t.Optional[t.Dict[str, str]] = None) -> None:
+
+        self.tokens = dict(tokens or {})
+
+        self.changed = False
+
+        self._used: t.Set[str] = set()
+
+    @classmethod
+    def load(cls, path: PathLike) -> 'TokenStore':
+        '''Loads tokens stored by the previous synchronization.
+
+        Args:
+            path (PathLike): Path to the tokens file.
+
+        Returns:
+            TokenStore: Stored tokens, empty if there is no valid file.
+        '''
+
+        if not os.path.exists(path):
+            return cls()
+
+        try:
+            with open(path, 'r') as f:
+                return cls(json.loads(f.read()))
+
+        except (OSError, ValueError, TypeError) as exc:
+            logger.warning(f'Cannot read service tokens {str(path)!r}: {exc}')
+            return cls()
+
+    def save(self, path: PathLike) -> None:
+        '''Saves tokens to the disk, readable by the owner only.
+
+        The file is replaced atomically, an interrupted save keeps
+        the previous tokens rather than an empty table.
+
+        Args:
+            path (PathLike): Path to the tokens file.
+        '''
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        system.write_file(path, json.dumps(self.tokens, sort_keys=True), mode=0o600)
+
+        self.changed = False
+
+    def get(self, course_id: str) -> str:
+        '''Gets the token of the course, issuing a new one
+        if the course has none.
+
+        Args:
+            course_id (str): Normalized course name.
+
+        Returns:
+            str: API token.
+        '''
+
+        self._used.add(course_id)
+
+        if course_id not in self.tokens:
+            self.rotate(course_id)
+
+        return self.tokens[course_id]
+
+    def rotate(self, course_id: str) -> str:
+        '''Issues a new token for the course.
+
+        Args:
+            course_id (str): Normalized course name.
+
+        Returns:
+            str: New API token.
+        '''
+
+        self.tokens[course_id] = token_hex(32)
+
+        self.changed = True
+
+        logger.debug(f'Issued new service token for {course_id!r}')
+
+        return self.tokens[course_id]
+
+    def release_unused(self) -> t.Set[str]:
+        '''Revokes tokens of courses which were not requested
+        since the tokens were loaded.
+
+        Returns:
+            t.Set[str]: Courses whose tokens were revoked.
+        '''
+
+        unused = self.tokens.keys() - self._used
+
+        for course_id in unused:
+            del self.tokens[course_id]
+
+        if unused:
+            self.changed = True
+
+        return unused
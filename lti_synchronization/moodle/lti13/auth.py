@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 import time
@@ -8,18 +9,153 @@
 import jwt
 import pem
 from Crypto.PublicKey import RSA
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
 from jwcrypto.jwk import JWK
 from loguru import logger
+from moodle.settings import LTI13_TOKEN_EXPIRY_MARGIN
 from moodle.utils import dump_json
 from tornado.httpclient import AsyncHTTPClient, HTTPClientError
 
 
+DEFAULT_SCOPE: str = ' '.join([
+    'https://purl.imsglobal.org/spec/lti-ags/scope/score',
+    'https://purl.imsglobal.org/spec/lti-ags/scope/lineitem',
+    'https://purl.imsglobal.org/spec/lti-ags/scope/result.readonly',
+    'https://purl.imsglobal.org/spec/lti-ags/scope/lineitem.readonly',
+])
+
+TokenKey = t.Tuple[str, str, str]
+
+
+class AccessTokenCache:
+    '''
+    Access tokens received from the LMS, stored until they expire.
+
+    Tokens are keyed by token endpoint, client id and scope.
+    A token is dropped ``margin`` seconds before its ``expires_in``,
+    so it never expires during a request. Responses without
+    ``expires_in`` are never cached.
+
+    Args:
+        margin (int): Safety margin in seconds.
+            Defaults to LTI13_TOKEN_EXPIRY_MARGIN.
+    '''
+
+    _tokens: t.Dict[TokenKey, t.Tuple[dict, float]]
+
+    _locks: t.Dict[TokenKey, asyncio.Lock]
+
+    def __init__(self, margin: int = LTI13_TOKEN_EXPIRY_MARGIN) -> None:
+
+        self.margin = margin
+
+        self._tokens = {}
+        self._locks = {}
+
+    def get(self, key: TokenKey) -> t.Optional[dict]:
+        '''
+        Returns the token if it is still valid.
+        '''
+
+        token, expires_at = self._tokens.get(key, (None, 0.0))
+
+        if time.monotonic() >= expires_at:
+            return None
+
+        return token
+
+    def set(self, key: TokenKey, token: dict) -> None:
+        '''
+        Stores the token if the platform told when it expires.
+        '''
+
+        try:
+            expires_in = float(token['expires_in'])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        if 'access_token' not in token or expires_in <= self.margin:
+            return
+
+        self._tokens[key] = (token, time.monotonic() + expires_in - self.margin)
+
+    def lock(self, key: TokenKey) -> asyncio.Lock:
+        '''
+        Lock guarding the refresh of a single token.
+        '''
+
+        return self._locks.setdefault(key, asyncio.Lock())
+
+    def clear(self) -> None:
+        '''
+        Drop all stored tokens.
+        '''
+
+        self._tokens.clear()
+        self._locks.clear()
+
+
+token_cache = AccessTokenCache()
+
+
 async def get_lms_access_token(
     token_endpoint: str,
     private_key_path: str,
     client_id: str,
     scope: t.Optional[str] = None,
-) -> str:
+) -> dict:
+    '''
+    Gets an access token for the LMS, reusing the cached one
+    while it is valid. Concurrent calls with the same key wait
+    for a single request to the token endpoint.
+
+    Args:
+        token_endpoint (str): The url that will be used to make the request
+        private_key_path (str): specify where the pem is
+        client_id (str): For LTI 1.3 the Client ID that was obtained with the tool setup
+        scope (t.Optional[str]): Space-separated scopes.
+            Defaults to AGS scopes.
+
+    Returns:
+        dict: A json with the token value
+
+    '''
+
+    scope = scope or DEFAULT_SCOPE
+
+    key: TokenKey = (token_endpoint, client_id, scope)
+
+    token = token_cache.get(key)
+
+    if token is not None:
+        return token
+
+    async with token_cache.lock(key):
+
+        # the token could be received while waiting for the lock
+        token = token_cache.get(key)
+
+        if token is None:
+
+            token = await request_lms_access_token(
+                token_endpoint, private_key_path, client_id, scope)
+
+            token_cache.set(key, token)
+
+        else:
+
+            logger.debug('Reusing cached lms access token')
+
+    return token
+
+
+async def request_lms_access_token(
+    token_endpoint: str,
+    private_key_path: str,
+    client_id: str,
+    scope: t.Optional[str] = None,
+) -> dict:
     '''
     Gets an access token from the LMS Token endpoint
     by using the private key (pem format) and client id
@@ -31,7 +167,7 @@ async def get_lms_access_token(
         scope (type): . Defaults to None.
 
     Returns:
-        str: A json with the token value
+        dict: A json with the token value
 
     '''
 
@@ -67,22 +203,15 @@ def _get_params() -> t.Generator:
 
     logger.debug('Getting lms access token with parameters\n%s' % next(_params))
 
-    # get the pem-encoded content
-    private_key = get_pem_text_from_file(private_key_path)
+    # parsed once and reused until the pem file changes
+    signing_key = get_signing_key(private_key_path)
 
-    headers = get_headers_to_jwt_encode(private_key)
-
-    token = jwt.encode(token_params, private_key,
-                       algorithm='RS256', headers=headers)
+    token = jwt.encode(token_params, signing_key.private_key,
+                       algorithm='RS256', headers=signing_key.headers)
 
     logger.debug('Obtaining token %s' % next(_params))
 
-    scope: str = scope or ' '.join([
-        'https://purl.imsglobal.org/spec/lti-ags/scope/score',
-        'https://purl.imsglobal.org/spec/lti-ags/scope/lineitem',
-        'https://purl.imsglobal.org/spec/lti-ags/scope/result.readonly',
-        'https://purl.imsglobal.org/spec/lti-ags/scope/lineitem.readonly',
-    ])
+    scope: str = scope or DEFAULT_SCOPE
 
     logger.debug('Scope is %s' % next(_params))
 
@@ -185,3 +314,85 @@ def get_pem_text_from_file(private_key_path: str) -> str:
         raise ValueError('Invalid pem file.')
 
     return certs[0].as_text()
+
+
+class SigningKey:
+    '''
+    Key material derived from the tool's private key.
+
+    Parsing the PEM, importing the RSA key and building the JWK
+    is expensive, so it is done once per version of the file.
+
+    Args:
+        path (str): Path to the private key in PEM format.
+        stamp (t.Tuple[int, int, int]): Modification time, size
+            and inode of the file when it was read.
+        private_pem (str): PEM-encoded private key.
+
+    Attributes:
+        private_key: Private key object used to sign JWT.
+        public_pem (bytes): PEM-encoded public key.
+        jwk (dict): Public key as JWK.
+        headers (t.Optional[dict]): JWT headers with the key id.
+        jwks (bytes): Serialized JWKS served to the platform.
+    '''
+
+    def __init__(self, path: str, stamp: t.Tuple[int, int, int], private_pem: str) -> None:
+
+        self.path = path
+        self.stamp = stamp
+
+        self.private_pem = private_pem
+
+        self.private_key = load_pem_private_key(
+            private_pem.encode(), password=None, backend=default_backend())
+
+        self.public_pem = RSA.importKey(private_pem).publickey().exportKey()
+
+        self.jwk = get_jwk(self.public_pem)
+
+        self.headers = {'kid': self.jwk['kid']} if self.jwk.get('kid') else None
+
+        self.jwks = json.dumps({'keys': [self.jwk]}).encode()
+
+
+signing_keys: t.Dict[str, SigningKey] = {}
+
+
+def _file_stamp(path: str) -> t.Tuple[int, int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def get_signing_key(private_key_path: str) -> SigningKey:
+    '''
+    Get parsed key material, loading it again
+    only if the pem file has changed since the last call.
+
+    Args:
+        private_key_path (str): Path to the private key file.
+
+    Returns:
+        SigningKey: Parsed key material.
+
+    Raises:
+        PermissionError: PEM File is not accessible
+        ValueError: PEM file is invalid, no certificates found.
+    '''
+
+    if not os.access(private_key_path, os.R_OK):
+        raise PermissionError()
+
+    stamp = _file_stamp(private_key_path)
+
+    key = signing_keys.get(private_key_path)
+
+    if key is None or key.stamp != stamp:
+
+        logger.debug(f'Loading key material from {private_key_path!r}')
+
+        key = SigningKey(private_key_path, stamp, get_pem_text_from_file(private_key_path))
+
+        signing_keys[private_key_path] = key
+
+    return key
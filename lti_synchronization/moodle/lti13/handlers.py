@@ -3,10 +3,8 @@
 from pathlib import Path
 from urllib.parse import quote, urlencode
 
-import pem
-from Crypto.PublicKey import RSA
 from moodle.authentication.helper import LTIHelper
-from .auth import get_jwk
+from .auth import get_signing_key
 from .templates import get_lti13_keys
 from tornado import web
 
@@ -72,24 +70,15 @@ def get(self) -> None:
 
             raise PermissionError()
 
-        private_key = pem.parse_file(key_path)
+        signing_key = get_signing_key(key_path)
 
-        public_key = RSA.import_key(
-            private_key[0].as_text()).publickey().exportKey()
+        self.log.debug('the jwks is %s' % signing_key.jwks)
 
-        self.log.debug('public_key is %s' % public_key)
-
-        jwk = get_jwk(public_key)
-
-        self.log.debug('the jwks is %s' % jwk)
-
-        keys_obj = {'keys': []}
-        keys_obj['keys'].append(jwk)
+        # serialized once per version of the key file,
+        # so polling by the platform is a memory read
+        self.set_header('Content-Type', 'application/json')
 
-        # we do not need to use json.dumps because tornado is
-        # converting our dict automatically and adding the content-type as json
-        # https://www.tornadoweb.org/en/stable/web.html#tornado.web.RequestHandler.write
-        self.write(keys_obj)
+        self.write(signing_key.jwks)
 
 
 class FileSelectHandler(BaseHandler):
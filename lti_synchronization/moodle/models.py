@@ -0,0 +1,329 @@
+'''
+Compact models of courses and enrolled users.
+
+Courses and users used to be ``JsonDict`` instances, so every one of them
+carried a whole dictionary, and every attribute access went through
+a failed attribute lookup first. Models below store their fields in
+``__slots__`` and the role as an index in settings.ROLES.
+
+A user enrolled in many courses is stored once. Every course refers to
+the same User through an Enrolment, which adds the course role to it.
+
+Models keep a dictionary view (``model['field']``, ``get``, ``keys``,
+``items``), so callers written for dictionaries keep working, and they
+are equal to dictionaries with the same content.
+
+Examples:
+
+    Models are created from the saved json::
+
+        >>> users = {}
+        >>> course = Course.from_dict(json_course, users)
+        >>> course.students[0].role
+        'student'
+        >>> course.students[0].user is users[course.students[0].username]
+        True
+
+    And serialized back with the dictionary view::
+
+        >>> json.dumps(course, default=to_json)
+'''
+
+import typing as t
+
+from moodle.settings import ROLES
+from moodle.typehints import JsonType, Role
+
+
+# Index of every role in settings.ROLES.
+ROLE_INDEX: t.Dict[str, int] = {role: index for index, role in enumerate(ROLES)}
+
+GROUPS: t.Tuple[str, ...] = ('instructors', 'graders', 'students')
+
+
+class Model:
+    '''Base of slotted models with a dictionary view.
+
+    Attributes:
+        fields (t.Tuple[str, ...]): Fields exposed by the dictionary view.
+    '''
+
+    __slots__ = ()
+
+    fields: t.ClassVar[t.Tuple[str, ...]] = ()
+
+    def __getitem__(self, key: str) -> t.Any:
+
+        if key not in self.fields:
+            raise KeyError(key)
+
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: t.Any) -> None:
+
+        if key not in self.fields:
+            raise KeyError(key)
+
+        setattr(self, key, value)
+
+    def __contains__(self, key: t.Any) -> bool:
+        return key in self.fields
+
+    def __iter__(self) -> t.Iterator[str]:
+        return iter(self.fields)
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def get(self, key: str, default: t.Any = None) -> t.Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> t.Tuple[str, ...]:
+        return self.fields
+
+    def values(self) -> t.List[t.Any]:
+        return [getattr(self, field) for field in self.fields]
+
+    def items(self) -> t.List[t.Tuple[str, t.Any]]:
+        return [(field, getattr(self, field)) for field in self.fields]
+
+    def to_dict(self) -> t.Dict[str, t.Any]:
+        '''
+        Shallow dictionary of the model's fields.
+        '''
+
+        return {field: getattr(self, field) for field in self.fields}
+
+    def __eq__(self, other: t.Any) -> bool:
+
+        if isinstance(other, Model):
+            other = other.to_dict()
+
+        if not isinstance(other, dict):
+            return NotImplemented
+
+        return self.to_dict() == other
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+
+def to_json(obj: t.Any) -> JsonType:
+    '''Serializes models, use as ``default`` of json.dumps.
+
+    Raises:
+        TypeError: Object is not a model.
+    '''
+
+    if isinstance(obj, Model):
+        return obj.to_dict()
+
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class User(Model):
+    '''Moodle user, shared between all courses the user is enrolled in.
+
+    Args:
+        id (int): Moodle user id.
+        first_name (str): First name.
+        last_name (str): Last name.
+        username (str): Normalized username.
+        email (str): Email.
+        roles (t.Optional[t.List[Role]]):
+            Raw Moodle roles, until the highest one is found. Defaults to None.
+    '''
+
+    __slots__ = ('id', 'first_name', 'last_name', 'username', 'email', 'roles')
+
+    fields = ('id', 'first_name', 'last_name', 'username', 'email')
+
+    def __init__(
+                self,
+                id: int,
+                first_name: str,
+                last_name: str,
+                username: str,
+                email: str,
+                roles: t.Optional[t.List[Role]] = None,
+            ) -> None:
+
+        self.id = id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.username = username
+        self.email = email
+        self.roles = roles
+
+    @classmethod
+    def from_dict(cls, data: JsonType) -> 'User':
+        return cls(
+            data.get('id'),
+            data.get('first_name'),
+            data.get('last_name'),
+            data['username'],
+            data.get('email'),
+            data.get('roles'),
+        )
+
+
+def _user_field(name: str) -> property:
+    '''
+    Property reading and writing the field of the enrolled user.
+    '''
+
+    def _get(self: 'Enrolment') -> t.Any:
+        return getattr(self.user, name)
+
+    def _set(self: 'Enrolment', value: t.Any) -> None:
+        setattr(self.user, name, value)
+
+    return property(_get, _set)
+
+
+class Enrolment(Model):
+    '''User enrolled in a course with a role.
+
+    User fields are read from and written to the shared User.
+
+    Args:
+        user (User): Enrolled user.
+        role (t.Union[Role, int, None]): Role name or its index in settings.ROLES.
+
+    Raises:
+        KeyError: Role is not in settings.ROLES.
+    '''
+
+    __slots__ = ('user', 'rank')
+
+    fields = ('id', 'first_name', 'last_name', 'username', 'email', 'role')
+
+    id = _user_field('id')
+    first_name = _user_field('first_name')
+    last_name = _user_field('last_name')
+    username = _user_field('username')
+    email = _user_field('email')
+
+    def __init__(self, user: User, role: t.Union[Role, int, None] = None) -> None:
+
+        self.user = user
+
+        self.role = role
+
+    @property
+    def role(self) -> t.Optional[Role]:
+        return None if self.rank is None else ROLES[self.rank]
+
+    @role.setter
+    def role(self, role: t.Union[Role, int, None]) -> None:
+        self.rank = ROLE_INDEX[role] if isinstance(role, str) else role
+
+    @classmethod
+    def from_dict(
+                cls,
+                data: JsonType,
+                users: t.Optional[t.Dict[str, User]] = None,
+            ) -> 'Enrolment':
+        '''Creates the enrolment of a saved user.
+
+        Args:
+            data (JsonType): User with the role.
+            users (t.Optional[t.Dict[str, User]]):
+                Users by username. The stored user is reused, a new one
+                is stored. Defaults to None.
+
+        Returns:
+            Enrolment: Enrolment of the user.
+        '''
+
+        user: t.Optional[User] = None if users is None else users.get(data['username'])
+
+        if user is None:
+
+            user = User.from_dict(data)
+
+            if users is not None:
+                users[user.username] = user
+
+        return cls(user, data.get('role'))
+
+
+class Course(Model):
+    '''Course synchronized with Jupyterhub.
+
+    Args:
+        id (int): Moodle course id.
+        course_id (str): Normalized course short name.
+        title (str): Course name.
+        category (t.Optional[int]): Moodle category id. Defaults to None.
+        lms_lineitems_endpoint (t.Optional[str]):
+            LTI line items of the course. Defaults to None.
+        need_nbgrader (bool): Course uses nbgrader. Defaults to False.
+    '''
+
+    __slots__ = fields = (
+        'id', 'course_id', 'title', 'category', 'need_nbgrader',
+        'lms_lineitems_endpoint', 'instructors', 'graders', 'students',
+    )
+
+    def __init__(
+                self,
+                id: int,
+                course_id: str,
+                title: str,
+                category: t.Optional[int] = None,
+                lms_lineitems_endpoint: t.Optional[str] = None,
+                need_nbgrader: bool = False,
+            ) -> None:
+
+        self.id = id
+        self.course_id = course_id
+        self.title = title
+        self.category = category
+        self.lms_lineitems_endpoint = lms_lineitems_endpoint
+        self.need_nbgrader = need_nbgrader
+
+        self.instructors: t.List[Enrolment] = []
+        self.graders: t.List[Enrolment] = []
+        self.students: t.List[Enrolment] = []
+
+    @classmethod
+    def from_dict(
+                cls,
+                data: JsonType,
+                users: t.Optional[t.Dict[str, User]] = None,
+            ) -> 'Course':
+        '''Creates the course from a saved one. Unknown fields are ignored.
+
+        Args:
+            data (JsonType): Saved course.
+            users (t.Optional[t.Dict[str, User]]):
+                Users by username shared between courses. Defaults to None.
+
+        Returns:
+            Course: Course with enrolled users.
+        '''
+
+        course = cls(
+            data.get('id'),
+            data['course_id'],
+            data.get('title'),
+            data.get('category'),
+            data.get('lms_lineitems_endpoint'),
+            bool(data.get('need_nbgrader')),
+        )
+
+        if users is None:
+            users = {}
+
+        for group in GROUPS:
+            course[group] = [
+                Enrolment.from_dict(user, users) for user in data.get(group) or ()
+            ]
+
+        return course
@@ -0,0 +1,101 @@
+'''
+Normalization of Moodle usernames and course short names.
+
+Every user of every course is normalized on every synchronization, and
+every LTI launch normalizes the user and the course once more. Patterns
+are compiled once, and results are memoized in a bounded LRU cache keyed
+on the raw value, so a user enrolled in many courses is normalized once.
+
+Normalization is lossy, two different emails may end up with the same
+username, like ``john.doe@foo.edu`` and ``johndoe@bar.edu``. Such users
+would share one unix account, so collisions are reported by
+``MoodleBasicHelper.format_users`` and ``MoodleClient._merge_users``.
+'''
+
+import functools
+import re
+import typing as t
+
+from loguru import logger
+
+from moodle.settings import NORMALIZE_CACHE_SIZE
+
+
+# Characters not allowed in usernames and course ids.
+INVALID_CHARACTERS: t.Pattern = re.compile(r'[^\w-]+')
+
+# Comments in the local part of the email, like john(comment)@mail.com
+EMAIL_COMMENT: t.Pattern = re.compile(r'\([^)]*\)')
+
+MAX_LENGTH: int = 50
+
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def format_string(string: str) -> str:
+    '''
+    Replace all invalid characters with underscore.
+
+    Args:
+        string (str): input string
+
+    Returns:
+        str: valid string in lowercase.
+
+    Raises:
+        ValueError: if string is empty
+    '''
+
+    if not string:
+        raise ValueError('string is empty')
+
+    string = INVALID_CHARACTERS.sub('_', string)
+
+    if string[0].isdigit():
+        string = f'a_{string}'
+
+    return string.lstrip('_.-').lower()[:MAX_LENGTH]
+
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def email_to_username(email: str) -> str:
+    '''
+    Normalizes an email to get a username. This function
+    calculates the username by getting the string before the
+    @ symbol, removing special characters, removing comments,
+    converting string to lowercase, and adds 1 if the username
+    has an integer value already in the string.
+
+    Args:
+        email: A valid email address
+
+    Returns:
+        str: A username string
+
+    Raises:
+        ValueError: if email is empty
+    '''
+
+    if not email:
+        raise ValueError('email is missing')
+
+    username = email.split('@')[0].split('+')[0]
+
+    username = EMAIL_COMMENT.sub('', username)
+
+    username = INVALID_CHARACTERS.sub('', username).lower()
+
+    username = format_string(username)
+
+    # built only when debug messages are enabled
+    logger.debug('Normalized email {!r} to {!r}', email, username)
+
+    return username
+
+
+def clear_cache() -> None:
+    '''
+    Forgets memoized usernames and course ids.
+    '''
+
+    format_string.cache_clear()
+    email_to_username.cache_clear()
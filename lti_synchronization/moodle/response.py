@@ -1,3 +1,4 @@
+import codecs
 import json
 from collections import abc
 import typing as t
@@ -8,6 +9,35 @@
 from moodle.utils import dump_json
 
 
+# Bytes read from a streamed response at once.
+CHUNK_SIZE: int = 64 * 1024
+
+WHITESPACE: str = ' \t\n\r'
+
+# Characters which may follow an array element.
+DELIMITERS: str = WHITESPACE + ',]'
+
+
+def check_payload(payload: t.Any, function_name: str) -> None:
+    '''Raises if Moodle responded with an exception.
+
+    Args:
+        payload (t.Any): Decoded response.
+        function_name (str): REST function name.
+
+    Raises:
+        MoodlePermissionError: The function is not enabled for the service.
+        MoodleAPIException: Any other exception.
+    '''
+
+    if isinstance(payload, dict) and 'exception' in payload:
+
+        if payload['exception'] == 'webservice_access_exception':
+            raise MoodlePermissionError(function_name)
+
+        raise MoodleAPIException(payload)
+
+
 class FluidResponse:
     '''
     Wrapper of a received HTTP response.
@@ -31,12 +61,7 @@ def __init__(self, resp: Response, function_name: str):
         except json.decoder.JSONDecodeError as e:
             raise MoodleAPIException(self.http_resp) from e
 
-        if isinstance(self.resp, dict) and 'exception' in self.resp:
-
-            if self.resp['exception'] == 'webservice_access_exception':
-                raise MoodlePermissionError(function_name)
-
-            raise MoodleAPIException(self.resp)
+        check_payload(self.resp, function_name)
 
     def __iter__(self) -> t.Generator[t.Any, None, None]:
         for el in self.resp:
@@ -77,3 +102,203 @@ def items(self) -> t.Optional[abc.ItemsView]:
             return self.resp.items()
 
         raise AttributeError('items')
+
+
+class StreamingResponse:
+    '''
+    Wrapper of a streamed HTTP response.
+
+    A json array is decoded one element at a time while iterated, so only
+    the current element and the unread chunk are held in memory. Moodle
+    reports exceptions as json objects, so any other payload is decoded
+    at once on creation and checked the same way FluidResponse does.
+
+    The array can be iterated once. The connection is released when the
+    array is consumed or the iteration is stopped.
+
+    Args:
+        resp (Response): HTTP Response requested with ``stream=True``.
+        function_name (str): REST function name.
+        chunk_size (int): Bytes read at once. Defaults to CHUNK_SIZE.
+
+    Attributes:
+        http_resp (Response): Stored HTTP Response.
+        resp (t.Optional[JsonType]): Decoded payload if it is not an array.
+        count (int): Number of array elements decoded so far.
+
+    Raises:
+        MoodlePermissionError: The function is not enabled for the service.
+        MoodleAPIException: Exception payload or invalid json.
+    '''
+
+    def __init__(self, resp: Response, function_name: str, chunk_size: int = CHUNK_SIZE):
+
+        self.http_resp = resp
+
+        self.function_name = function_name
+
+        self.resp = None
+
+        self.count = 0
+
+        self._chunks = resp.iter_content(chunk_size)
+
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+
+        self._buffer = ''
+
+        self._pos = 0
+
+        self._eof = False
+
+        self._consumed = False
+
+        if self._next_char() == '[':
+            self._pos += 1
+            return
+
+        # not an array, the whole payload is needed anyway
+        while self._read():
+            pass
+
+        text: str = self._buffer
+
+        self.close()
+
+        try:
+            self.resp = json.loads(text)
+        except json.decoder.JSONDecodeError as e:
+            raise MoodleAPIException({'error': 'invalid json', 'content': text[:1000]}) from e
+
+        check_payload(self.resp, function_name)
+
+    def _read(self) -> bool:
+        '''
+        Appends the next chunk to the buffer, False if the body is over.
+        '''
+
+        if self._eof:
+            return False
+
+        for chunk in self._chunks:
+
+            text = self._decoder.decode(chunk)
+
+            if text:
+                self._buffer = self._buffer[self._pos:] + text
+                self._pos = 0
+                return True
+
+        self._buffer = self._buffer[self._pos:] + self._decoder.decode(b'', final=True)
+        self._pos = 0
+
+        self._eof = True
+
+        return False
+
+    def _next_char(self) -> str:
+        '''
+        Skips whitespace and returns the next character, empty if the body is over.
+        '''
+
+        while True:
+
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in WHITESPACE:
+                self._pos += 1
+
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+
+            if not self._read():
+                return ''
+
+    def _invalid(self) -> MoodleAPIException:
+
+        self.close()
+
+        return MoodleAPIException({
+            'error': 'invalid json array',
+            'content': self._buffer[self._pos:self._pos + 1000],
+        })
+
+    def _iter_array(self) -> t.Generator[t.Any, None, None]:
+
+        decoder = json.JSONDecoder()
+
+        expect_value: bool = True
+
+        try:
+            while True:
+
+                char = self._next_char()
+
+                if char == ']' and (not expect_value or not self.count):
+                    return
+
+                if not expect_value:
+
+                    if char != ',':
+                        raise self._invalid()
+
+                    self._pos += 1
+
+                    expect_value = True
+
+                    continue
+
+                while True:
+
+                    try:
+                        value, end = decoder.raw_decode(self._buffer, self._pos)
+
+                    except json.decoder.JSONDecodeError:
+                        value, end = None, -1
+
+                    # a value not followed by a delimiter, like a number
+                    # at the end of the buffer, may continue in the next chunk
+                    if 0 <= end < len(self._buffer) and self._buffer[end] in DELIMITERS:
+                        break
+
+                    if not self._read():
+
+                        if end < 0:
+                            raise self._invalid()
+
+                        break
+
+                self._pos = end
+
+                self.count += 1
+
+                expect_value = False
+
+                yield value
+
+        finally:
+            self.close()
+
+    def __iter__(self) -> t.Iterator[t.Any]:
+
+        if self.resp is not None:
+            return iter(self.resp)
+
+        if self._consumed:
+            raise RuntimeError('Streamed response can be iterated once.')
+
+        self._consumed = True
+
+        return self._iter_array()
+
+    def __getitem__(self, key: t.Union[str, int]) -> t.Any:
+
+        if self.resp is None:
+            raise TypeError('Streamed array does not support indexing.')
+
+        return self.resp[key]
+
+    def close(self) -> None:
+        '''
+        Releases the connection.
+        '''
+
+        self.http_resp.close()
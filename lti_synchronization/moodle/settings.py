@@ -18,11 +18,84 @@
 
 JSON_FILE: Path = BASE_DIR / 'data' / 'courses.json'
 
+# Moodle id of every synchronized course, rewritten by every synchronization.
+COURSE_IDS_FILE: Path = BASE_DIR / 'data' / 'course_ids.json'
+
+# State of the last synchronization used by incremental sync.
+SNAPSHOT_FILE: Path = BASE_DIR / 'data' / 'snapshot.json'
+
+# Service port of every nbgrader course.
+PORTS_FILE: Path = BASE_DIR / 'data' / 'ports.json'
+
+# API token of every nbgrader course service.
+TOKENS_FILE: Path = BASE_DIR / 'data' / 'tokens.json'
+
 EXCHANGE_DIR: Path = Path('/srv/nbgrader/exchange')
 
 NB_UID = os.environ.get("NB_UID", 10001)
 NB_GID = os.environ.get("NB_GID", 100)
 
+# Moodle REST API connection pool.
+# Retries are applied to connection resets and 5xx responses.
+
+MOODLE_POOL_SIZE: int = int(os.environ.get('MOODLE_POOL_SIZE', 10))
+MOODLE_MAX_RETRIES: int = int(os.environ.get('MOODLE_MAX_RETRIES', 3))
+MOODLE_BACKOFF_FACTOR: float = float(os.environ.get('MOODLE_BACKOFF_FACTOR', 0.5))
+MOODLE_TIMEOUT: float = float(os.environ.get('MOODLE_TIMEOUT', 30))
+
+# Number of courses which enrolments are fetched at once.
+
+MOODLE_CONCURRENCY: int = int(os.environ.get('MOODLE_CONCURRENCY', 1))
+
+# Enrolments are fetched in pages of MOODLE_PAGE_SIZE users, 0 fetches
+# a course at once. Suspended enrolments are skipped if MOODLE_ONLY_ACTIVE.
+
+MOODLE_PAGE_SIZE: int = int(os.environ.get('MOODLE_PAGE_SIZE', 1000))
+MOODLE_ONLY_ACTIVE: bool = os.environ.get('MOODLE_ONLY_ACTIVE', '').lower() in ('1', 'true', 'yes')
+
+# Courses fetched ahead of the manager by the pipelined synchronization.
+# Users and permissions are provisioned after every PIPELINE_PROVISION_BATCH
+# courses, while the next courses are being fetched.
+
+PIPELINE_QUEUE_SIZE: int = int(os.environ.get('PIPELINE_QUEUE_SIZE', 4))
+PIPELINE_PROVISION_BATCH: int = int(os.environ.get('PIPELINE_PROVISION_BATCH', 10))
+
+# Normalized usernames and course ids memoized by moodle.normalization.
+
+NORMALIZE_CACHE_SIZE: int = int(os.environ.get('NORMALIZE_CACHE_SIZE', 65536))
+
+# REST API of the running Jupyterhub used to apply users and groups
+# without restarting the hub. The token must have admin rights.
+# Hub users not allowed anymore are deleted only if JUPYTERHUB_DELETE_USERS.
+
+JUPYTERHUB_API_URL: str = os.environ.get('JUPYTERHUB_API_URL', 'http://127.0.0.1:8081/hub/api')
+JUPYTERHUB_API_TOKEN: t.Optional[str] = os.environ.get('JUPYTERHUB_API_TOKEN')
+JUPYTERHUB_DELETE_USERS: bool = os.environ.get('JUPYTERHUB_DELETE_USERS', '').lower() in ('1', 'true', 'yes')
+
+# LTI 1.3 grades submission.
+# Scores are posted concurrently, at most GRADES_CONCURRENCY at once.
+# Retries are applied to 429 and 5xx responses and to connection errors
+# with exponential backoff. Retry-After of the LMS is followed, but the
+# instructor waits for the report, so no longer than GRADES_MAX_RETRY_DELAY.
+
+GRADES_CONCURRENCY: int = int(os.environ.get('GRADES_CONCURRENCY', 10))
+GRADES_MAX_RETRIES: int = int(os.environ.get('GRADES_MAX_RETRIES', 3))
+GRADES_BACKOFF_FACTOR: float = float(os.environ.get('GRADES_BACKOFF_FACTOR', 0.5))
+GRADES_MAX_RETRY_DELAY: float = float(os.environ.get('GRADES_MAX_RETRY_DELAY', 10))
+
+# LMS access tokens are reused until they expire,
+# minus this margin in seconds.
+
+LTI13_TOKEN_EXPIRY_MARGIN: int = int(os.environ.get('LTI13_TOKEN_EXPIRY_MARGIN', 60))
+
+# Nonces issued by the LTI 1.3 login are accepted by the callback
+# once within the window. Stored in memory unless LTI13_NONCE_DB
+# points to a SQLite database.
+
+LTI13_NONCE_WINDOW: int = int(os.environ.get('LTI13_NONCE_WINDOW', 600))
+LTI13_NONCE_MAX_SIZE: int = int(os.environ.get('LTI13_NONCE_MAX_SIZE', 500_000))
+LTI13_NONCE_DB: t.Optional[str] = os.environ.get('LTI13_NONCE_DB') or None
+
 DESCRIPTION = r'''
 ██╗  ████████╗██╗    ███████╗██╗   ██╗███╗   ██╗ ██████╗
 ██║  ╚══██╔══╝██║    ██╔════╝╚██╗ ██╔╝████╗  ██║██╔════╝
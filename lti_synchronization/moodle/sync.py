@@ -5,7 +5,10 @@
 from dotenv import load_dotenv
 
 from .client.api import MoodleClient
+from .integration.hub import HubAPIClient
 from .integration.manager import SyncManager
+from .settings import (MOODLE_CONCURRENCY, MOODLE_POOL_SIZE, MOODLE_TIMEOUT,
+                       PIPELINE_PROVISION_BATCH)
 from .typehints import PathLike, Filters
 from .utils import dump_json
 
@@ -21,8 +24,16 @@ def synchronize(
     endpoint: t.Optional[str] = None,
     url_env_name: t.Optional[str] = None,
     key_env_name: t.Optional[str] = None,
+    pool_size: int = MOODLE_POOL_SIZE,
+    timeout: float = MOODLE_TIMEOUT,
+    concurrency: int = MOODLE_CONCURRENCY,
+    incremental: bool = False,
+    deep_verify: bool = False,
+    rotate_tokens: t.Sequence[str] = (),
+    hub_api: bool = False,
+    pipeline: bool = False,
     **filters: Filters,
-) -> None:
+) -> bool:
     '''Short summary.
 
     Args:
@@ -47,9 +58,38 @@ def synchronize(
             Custom environment variable name for url. Defaults to None.
         key_env_name (:obj:`str`, optional):
             Custom environment variable name for api token. Defaults to None.
+        pool_size (int):
+            Number of keep-alive connections to Moodle.
+            Defaults to settings.MOODLE_POOL_SIZE.
+        timeout (float):
+            Timeout of every Moodle API call in seconds.
+            Defaults to settings.MOODLE_TIMEOUT.
+        concurrency (int):
+            Number of courses which enrolments are fetched at once.
+            Defaults to settings.MOODLE_CONCURRENCY.
+        incremental (bool):
+            Apply only changes since the previous synchronization.
+            Defaults to False.
+        deep_verify (bool):
+            Verify ownership of every file in users' homes.
+            Defaults to False.
+        rotate_tokens (t.Sequence[str]):
+            Courses which services get new API tokens.
+            Defaults to empty tuple.
+        hub_api (bool):
+            Apply users, admins and groups to the running hub
+            through its REST API. Defaults to False.
+        pipeline (bool):
+            Process every course as soon as its enrolments are fetched,
+            while the next ones are still being fetched. Users and
+            permissions are provisioned after every
+            settings.PIPELINE_PROVISION_BATCH courses. Defaults to False.
         **filters (Filters):
             key-value pairs where value can be both single value or list
             of valid items.
+
+    Returns:
+        bool: The hub has to be restarted to apply the configuration.
     '''
 
     load_dotenv(verbose=True)
@@ -80,16 +120,50 @@ def synchronize(
                 if not isinstance(val, (str, int)):
                     raise TypeError(f'Invalid course\'s id in JSON: {val}')
 
-    client = MoodleClient(url, key, endpoint, url_env_name, key_env_name)
+    client = MoodleClient(
+        url, key, endpoint, url_env_name, key_env_name,
+        pool_size=pool_size,
+        timeout=timeout,
+        concurrency=concurrency,
+    )
 
-    manager = SyncManager()
+    manager = SyncManager(
+        incremental=incremental,
+        deep_verify=deep_verify,
+        rotate_tokens=rotate_tokens,
+        hub=HubAPIClient() if hub_api else None,
+        provision_batch=PIPELINE_PROVISION_BATCH if pipeline else 0,
+    )
 
-    client.fetch_courses(json_in=json_in_file, json_out=json_out)
+    try:
 
-    manager.update_jupyterhub(
-                courses=client.courses if not json_out else None,
-                json_path=json_out,
-                in_file=in_file,
-                out_file=out_file,
-                **filters,
-    )
+        if pipeline:
+
+            with client:
+
+                restart: bool = manager.update_jupyterhub(
+                            courses=client.stream_courses(json_in_file, json_out),
+                            in_file=in_file,
+                            out_file=out_file,
+                            **filters,
+                )
+
+        else:
+
+            with client:
+                client.fetch_courses(json_in=json_in_file, json_out=json_out)
+
+            restart = manager.update_jupyterhub(
+                        courses=client.courses if not json_out else None,
+                        json_path=json_out,
+                        in_file=in_file,
+                        out_file=out_file,
+                        **filters,
+            )
+
+    finally:
+
+        if manager.hub is not None:
+            manager.hub.close()
+
+    return restart
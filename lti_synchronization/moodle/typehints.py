@@ -55,12 +55,16 @@
 '''Alias for
 
 Dict[Literal['id', 'first_name', 'last_name', 'username', 'email', 'role'], Union[str, int, Role]]
+
+or moodle.models.Enrolment, which has the same dictionary view.
 '''
 
 Course = 'Course'
 '''Alias for
 
 Dict[Literal['id', 'title', 'short_name', 'instructors', 'graders', 'students'], Union[str, List[User]]]
+
+or moodle.models.Course, which has the same dictionary view.
 '''
 
 
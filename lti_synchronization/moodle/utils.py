@@ -1,13 +1,16 @@
 ''' Function utils '''
 
+import itertools
 import json
 import typing as t
 from functools import wraps
 
 from loguru import logger
 
+from .integration import system
+from .models import to_json
 from .settings import JSON_FILE
-from .typehints import JsonType, PathLike
+from .typehints import Course, JsonType, PathLike
 
 
 def dump_json(dict_in: JsonType) -> str:
@@ -15,7 +18,7 @@ def dump_json(dict_in: JsonType) -> str:
     Dump json-like dictionary to string with indentation.
     '''
 
-    return json.dumps(dict_in, indent=4, sort_keys=True, ensure_ascii=False)
+    return json.dumps(dict_in, indent=4, sort_keys=True, ensure_ascii=False, default=to_json)
 
 
 def log_load_data(attr_name: str) -> t.Callable:
@@ -107,7 +110,7 @@ def __delattr__(self, key: t.Hashable) -> None:
             super().__delattr__(str(key))
 
 
-def save_moodle_courses(courses: JsonType, filename: t.Optional[PathLike] = None) -> None:
+def save_moodle_courses(courses: t.Iterable[Course], filename: t.Optional[PathLike] = None) -> int:
     '''Saves downloaded formatted courses to a json file.
 
     To make lti_synchronization package more configurable, we added two ways of
@@ -117,19 +120,41 @@ def save_moodle_courses(courses: JsonType, filename: t.Optional[PathLike] = None
     If you would like just to store courses somewhere so you can modify or inspect
     the data you receive from Moodle, this function would call to create json file.
 
+    Courses are stored as newline-delimited json, one course per line, and
+    written as soon as the iterable produces them, so a generator of courses
+    is never held in memory at once. The file is replaced atomically only when
+    every course has been written (see ``system.open_atomic``), an interrupted
+    run keeps the previous file.
+
     Args:
-        data (JsonType): Data to be saved in json.
+        courses (t.Iterable[Course]): Courses to be saved.
         filename (t.Optional[PathLike]): Path to json file. Defaults to None.
+
+    Returns:
+        int: Number of saved courses.
     '''
 
-    with open(filename or JSON_FILE, 'w') as f:
+    count: int = 0
+
+    with system.open_atomic(filename or JSON_FILE, mode=0o644, encoding='utf-8') as f:
 
-        f.write(dump_json(courses))
+        for course in courses:
 
+            f.write(json.dumps(course, ensure_ascii=False, separators=(',', ':'), default=to_json))
+            f.write('\n')
 
-def load_moodle_courses(filename: t.Optional[PathLike] = None) -> JsonType:
+            count += 1
+
+    return count
+
+
+def load_moodle_courses(filename: t.Optional[PathLike] = None) -> t.Iterator[JsonType]:
     '''Loads courses that were saved into a json file.
 
+    Courses are parsed one line at a time while the returned generator is
+    iterated. Files saved as a single json array by older versions are
+    still accepted, but read at once.
+
     Note:
         Does not transform courses into JsonDict instance, rather returns
         regular json instance.
@@ -137,11 +162,24 @@ def load_moodle_courses(filename: t.Optional[PathLike] = None) -> JsonType:
     Args:
         filename (t.Optional[PathLike]): Path to json file. Defaults to None.
 
-    Returns:
+    Yields:
         JsonType: Courses from the json file.
 
     '''
 
-    with open(filename or JSON_FILE, 'r') as f:
+    with open(filename or JSON_FILE, 'r', encoding='utf-8') as f:
+
+        first_line = f.readline()
+
+        if first_line.lstrip().startswith('['):
+
+            f.seek(0)
+
+            yield from json.loads(f.read())
+
+            return
+
+        for line in itertools.chain((first_line, ), f):
 
-        return json.loads(f.read())
+            if line.strip():
+                yield json.loads(line)
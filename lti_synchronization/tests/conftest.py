@@ -3,6 +3,7 @@
 import re
 import string
 import typing as t
+from pathlib import Path
 
 import pytest
 from dotenv import load_dotenv
@@ -13,6 +14,7 @@
 from moodle.settings import ROLES
 from moodle.typehints import Course, Role, User
 from moodle.utils import JsonDict
+from tests.typehints import MonkeyPatch
 
 ''' HOOKS '''
 
@@ -30,6 +32,19 @@ def disable_logging():
     logger.remove()
 
 
+@pytest.fixture(autouse=True)
+def course_ids_file(tmp_path: Path, monkeypatch: MonkeyPatch) -> Path:
+    '''
+    Keep ids of courses loaded by the tests out of the data directory.
+    '''
+
+    path = tmp_path / 'course_ids.json'
+
+    monkeypatch.setattr('moodle.client.api.COURSE_IDS_FILE', path)
+
+    return path
+
+
 ''' UTILS '''
 
 
@@ -0,0 +1,140 @@
+import typing as t
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import jwt
+import pytest
+from tornado.web import HTTPError, RequestHandler
+
+from moodle.authentication.handlers import LTI13CallbackHandler, get_nonce
+from moodle.authentication.nonce import MemoryNonceStore, NonceStore, SQLiteNonceStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_store(request, tmp_path: Path) -> t.Callable[..., NonceStore]:
+
+    def _make_store(**kwargs: t.Any) -> NonceStore:
+
+        if request.param == 'memory':
+            return MemoryNonceStore(**kwargs)
+
+        return SQLiteNonceStore(tmp_path / 'nonces.db', **kwargs)
+
+    return _make_store
+
+
+def test_nonce_is_consumed_once(make_store: t.Callable[..., NonceStore]):
+    '''
+    Is an issued nonce accepted only once?
+    '''
+
+    store = make_store()
+
+    store.issue('foo')
+
+    assert not store.consume('bar')
+    assert store.consume('foo')
+    assert not store.consume('foo')
+
+
+def test_nonce_expires(make_store: t.Callable[..., NonceStore]):
+    '''
+    Is a nonce rejected after the window,
+    and are expired nonces evicted by new ones?
+    '''
+
+    store = make_store(window=10)
+
+    with patch('time.monotonic', return_value=1000), patch('time.time', return_value=1000):
+
+        store.issue('foo')
+        store.issue('bar')
+
+    with patch('time.monotonic', return_value=1011), patch('time.time', return_value=1011):
+
+        assert not store.consume('foo')
+
+        store.issue('baz')
+
+        assert len(store) == 1
+        assert store.consume('baz')
+
+
+def test_nonce_store_is_bounded(make_store: t.Callable[..., NonceStore]):
+    '''
+    Are the oldest nonces evicted when the store is full?
+    '''
+
+    store = make_store(max_size=3)
+
+    for i in range(10):
+        store.issue(str(i))
+
+    assert len(store) == 3
+
+    assert not store.consume('6')
+    assert store.consume('7')
+
+
+def test_sqlite_store_survives_restart(tmp_path: Path):
+
+    SQLiteNonceStore(tmp_path / 'nonces.db').issue('foo')
+
+    assert SQLiteNonceStore(tmp_path / 'nonces.db').consume('foo')
+
+
+@pytest.mark.asyncio
+async def test_callback_rejects_replayed_id_token(make_mock_request_handler: t.Callable):
+    '''
+    Is an id_token accepted only for the login request it was issued for,
+    and only once?
+    '''
+
+    store = MemoryNonceStore()
+
+    handler = make_mock_request_handler(RequestHandler)
+
+    def callback(state: str, nonce: str) -> LTI13CallbackHandler:
+
+        callback = LTI13CallbackHandler(handler.application, handler.request)
+
+        arguments = {
+            'state': state,
+            'id_token': jwt.encode({'nonce': nonce}, 'secret', algorithm='HS256').decode(),
+        }
+
+        callback.get_argument = arguments.__getitem__
+        callback.check_state = lambda: None
+        callback.login_user = AsyncMock(return_value=MagicMock())
+        callback.get_next_url = lambda user: '/hub/'
+        callback.redirect = MagicMock()
+
+        return callback
+
+    with patch('moodle.authentication.handlers.get_nonce_store', return_value=store):
+
+        store.issue(get_nonce('old-state'))
+
+        first = callback('old-state', get_nonce('old-state'))
+        await first.post()
+        first.redirect.assert_called_once()
+
+        # the same launch again
+        with pytest.raises(HTTPError) as exc_info:
+            await callback('old-state', get_nonce('old-state')).post()
+
+        assert exc_info.value.status_code == 403
+
+        # the captured id_token under a newly issued state
+        store.issue(get_nonce('new-state'))
+
+        replayed = callback('new-state', get_nonce('old-state'))
+
+        with pytest.raises(HTTPError) as exc_info:
+            await replayed.post()
+
+        assert exc_info.value.status_code == 403
+        replayed.login_user.assert_not_called()
+
+        # the new login itself is still accepted
+        await callback('new-state', get_nonce('new-state')).post()
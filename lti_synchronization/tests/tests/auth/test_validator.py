@@ -1,11 +1,18 @@
+import json
+import os
+import time
 import typing as t
 from unittest.mock import patch
 
+import jwt
 import pytest
 from tornado.web import HTTPError
-from tornado.httpclient import AsyncHTTPClient
+from tornado.httpclient import AsyncHTTPClient, HTTPResponse
+from tornado.httputil import HTTPHeaders
+from tornado.web import RequestHandler
 
 from moodle.authentication.validator import LTI13LaunchValidator
+from moodle.lti13.auth import get_signing_key
 from moodle.typehints import JsonType
 
 
@@ -61,6 +68,97 @@ async def test_jwt_verify_raises_an_error_with_no_retrieved_platform_keys(
         )
 
 
+@pytest.fixture
+def platform_jwks(lti13_config_environ: None) -> JsonType:
+    '''
+    JWKS with the tool's own public key as a platform key.
+    '''
+
+    jwk = dict(get_signing_key(os.environ['LTI13_PRIVATE_KEY']).jwk, kid='platform-key')
+
+    return {'keys': [jwk]}
+
+
+@pytest.mark.asyncio
+async def test_platform_jwks_is_cached(
+    platform_jwks: JsonType,
+    validator: LTI13LaunchValidator,
+    make_http_response: HTTPResponse,
+    make_mock_request_handler: t.Callable,
+):
+    '''
+    Is the platform JWKS fetched once, and refreshed on an unknown kid
+    not more often than jwks_refresh_interval allows?
+    '''
+
+    local_handler = make_mock_request_handler(RequestHandler)
+
+    endpoint = 'https://my.platform.domain/api/lti/security/jwks'
+
+    def respond(*args, **kwargs):
+        return make_http_response(
+            handler=local_handler.request,
+            body=platform_jwks,
+            headers=HTTPHeaders({'Cache-Control': 'public, max-age=600'}),
+        )
+
+    with patch.object(AsyncHTTPClient, 'fetch', side_effect=respond) as mock_fetch:
+
+        key = await validator._retrieve_matching_jwk(endpoint, 'platform-key')
+
+        assert await validator._retrieve_matching_jwk(endpoint, 'platform-key') is key
+        assert mock_fetch.call_count == 1
+
+        cached = validator._platform_keys[endpoint]
+
+        assert cached.expires_at - cached.fetched_at == pytest.approx(600)
+
+        # refresh is rate limited
+        with pytest.raises(ValueError):
+            await validator._retrieve_matching_jwk(endpoint, 'rotated-key')
+
+        assert mock_fetch.call_count == 1
+
+        validator.jwks_refresh_interval = 0
+
+        with pytest.raises(ValueError):
+            await validator._retrieve_matching_jwk(endpoint, 'rotated-key')
+
+        assert mock_fetch.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_jwt_verify_and_decode_checks_signature(
+    jws: JsonType,
+    platform_jwks: JsonType,
+    validator: LTI13LaunchValidator,
+):
+    '''
+    Is the id token verified with the platform key matching its kid?
+    '''
+
+    signing_key = get_signing_key(os.environ['LTI13_PRIVATE_KEY'])
+
+    jws = dict(jws, exp=int(time.time()) + 60)
+
+    id_token = jwt.encode(
+        jws, signing_key.private_key, algorithm='RS256', headers={'kid': 'platform-key'})
+
+    platform_key = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(platform_jwks['keys'][0]))
+
+    with patch.object(validator, '_retrieve_matching_jwk', return_value=platform_key):
+
+        decoded = await validator.jwt_verify_and_decode(id_token, 'endpoint', audience=jws['aud'])
+
+        assert decoded == jws
+
+        # a token not signed by the platform is rejected
+        with pytest.raises(jwt.InvalidTokenError):
+            await validator.jwt_verify_and_decode(
+                jwt.encode(jws, 'secret', algorithm='HS256', headers={'kid': 'platform-key'}),
+                'endpoint', audience=jws['aud'])
+
+
 @pytest.mark.parametrize('field, value, passes', [
     ('message_type', 'FakeLinkRequest', False),
     ('version', '1.0.0', False),
@@ -1,13 +1,19 @@
+import json
 import os
+import threading
 import typing as t
-from unittest.mock import call, patch
+from unittest.mock import MagicMock, call, patch
 
 import pytest
 from moodle.client.api import MoodleClient
+from moodle.client.base import make_session
 from moodle.client.helper import MoodleDataHelper
+from moodle.helper import ROLE_TABLE
+from moodle.errors import MoodleAPIException, MoodlePermissionError
+from moodle.response import StreamingResponse
 from moodle.settings import ROLES
 from moodle.typehints import Course, User
-from moodle.utils import JsonDict
+from moodle.utils import JsonDict, dump_json, load_moodle_courses, save_moodle_courses
 from tests.typehints import MonkeyPatch
 
 
@@ -72,6 +78,34 @@ def test_user_group(helper: MoodleDataHelper, test_user: dict, expected: str):
     assert helper.get_user_group(test_user) == expected
 
 
+def test_resolve_roles(helper: MoodleDataHelper):
+    '''
+    Are roles of a whole course resolved at once,
+    and unknown roles counted instead of raised?
+    '''
+
+    resolved, unknown = helper.resolve_roles([
+        ['student', 'teacher'],
+        ['superman', 'student'],
+        ['superman', 'batman'],
+        [],
+    ])
+
+    assert resolved == [
+        (ROLES.index('teacher'), 'graders'),
+        (ROLES.index('student'), 'students'),
+        None,
+        None,
+    ]
+
+    assert unknown == {'superman': 2, 'batman': 1}
+
+    # ranks are read from one table
+    assert all(helper._table[role][0] == helper.get_priority(role) for role in ROLES)
+    assert all(helper.get_role_name(helper._table[role][0]) == role for role in ROLES)
+    assert helper._table is ROLE_TABLE
+
+
 def test_load_courses(client: MoodleClient):
 
     with patch.object(client, 'call', autospec=True) as mocked_call:
@@ -89,6 +123,104 @@ def test_load_courses(client: MoodleClient):
             assert mock_format.call_args_list == list(map(call, range(5)))
 
 
+def test_find_courses(client: MoodleClient, tmp_path):
+    '''
+    Are courses synchronized before requested by Moodle ids at once,
+    with a fallback to all courses for new ones?
+    '''
+
+    def raw_course(id: int, shortname: str, category: int = 1) -> dict:
+        return {'id': id, 'shortname': shortname, 'displayname': shortname, 'categoryid': category}
+
+    by_field = {
+        ('ids', '1,5'): [raw_course(1, 'FOO'), raw_course(5, 'renamed')],
+        ('ids', '1'): [raw_course(1, 'FOO')],
+        ('category', 7): [raw_course(3, 'baz', 7), raw_course(1, 'FOO', 7)],
+    }
+
+    all_courses = [raw_course(1, 'FOO'), raw_course(2, 'BAR 101'), raw_course(4, 'spam')]
+
+    def _call(api_func: str, **kwargs: t.Any) -> t.Any:
+
+        if api_func == 'core_course_get_courses':
+            return all_courses
+
+        return {'courses': by_field[kwargs['field'], kwargs['value']], 'warnings': []}
+
+    assert client.read_course_ids() == {}
+
+    client.ids_path.write_text(json.dumps({'foo': 1, 'old': 5}))
+
+    known_ids = client.read_course_ids()
+
+    assert known_ids == {'foo': 1, 'old': 5}
+
+    client.ids_path.write_text('{corrupted')
+
+    assert client.read_course_ids() == {}
+
+    with patch.dict(os.environ, {'MOODLE_BASE_URL': 'https://moodle'}), \
+            patch.object(client, 'call', side_effect=_call) as mocked_call:
+
+        courses = list(client._find_courses(
+            ['foo', 'old', 'bar_101'], categories=[7], known_ids=known_ids))
+
+        assert [course.course_id for course in courses] == ['foo', 'baz', 'bar_101']
+
+        # ids at once, the category, and all courses for the rest
+        assert mocked_call.call_count == 3
+
+        mocked_call.reset_mock()
+
+        assert [c.course_id for c in client._find_courses(['foo'], known_ids=known_ids)] == ['foo']
+
+        mocked_call.assert_called_once_with('core_course_get_courses_by_field', field='ids', value='1')
+
+        mocked_call.reset_mock()
+
+        # nothing is known, every course is looked up in the list
+        assert [c.course_id for c in client._find_courses(['foo'])] == ['foo']
+
+        mocked_call.assert_called_once_with('core_course_get_courses', stream=True)
+
+
+
+def test_fetch_courses_remembers_ids(get_client: t.Callable[[], MoodleClient], course_ids_file):
+    '''
+    Does the default synchronization, without an output file, keep ids
+    of found courses, so the next one requests them by Moodle ids?
+    '''
+
+    raw_courses = [
+        {'id': 1, 'shortname': 'FOO', 'displayname': 'Foo', 'categoryid': 1},
+        {'id': 2, 'shortname': 'spam', 'displayname': 'Spam', 'categoryid': 1},
+    ]
+
+    def _call(api_func: str, **kwargs: t.Any) -> t.Any:
+
+        if api_func == 'core_course_get_courses':
+            return raw_courses
+
+        return {'courses': raw_courses[:1], 'warnings': []}
+
+    json_in = {'jupyterhub': ['foo'], 'nbgrader': []}
+
+    for _ in range(2):
+
+        client = get_client()
+
+        with patch.dict(os.environ, {'MOODLE_BASE_URL': 'https://moodle'}), \
+                patch.object(client, 'call', side_effect=_call) as mocked_call, \
+                patch.object(client, '_get_users', return_value=iter([])):
+
+            client.fetch_courses(json_in=json_in, json_out=None)
+
+        assert [course.course_id for course in client.courses] == ['foo']
+        assert json.loads(course_ids_file.read_text()) == {'foo': 1}
+
+    mocked_call.assert_called_once_with('core_course_get_courses_by_field', field='ids', value='1')
+
+
 def test_load_users(client: MoodleClient, student: User, teacher: User, course: Course):
     '''
     Test transforming data process.
@@ -122,8 +254,310 @@ def test_load_users(client: MoodleClient, student: User, teacher: User, course:
                 'students': [student, student]
             }]
 
+        # users are stored without a course role
         assert client.users == {
-            teacher.username: teacher, student.username: student}
+            user.username: {k: v for k, v in user.items() if k != 'role'}
+            for user in (teacher, student)
+        }
+
+        # both enrolments refer to the same user
+        assert client.courses[0].students[0].user is client.users[student.username]
+        assert client.courses[0].students[1].user is client.users[student.username]
+
+
+def test_session_pool(get_client: t.Callable[[], MoodleClient]):
+    '''
+    Does the client mount one pooled adapter with retries for every scheme?
+    '''
+
+    session = make_session(pool_size=4, max_retries=2, backoff_factor=0.1)
+
+    adapter = session.get_adapter('https://test.moodle.com')
+
+    assert adapter is session.get_adapter('http://test.moodle.com')
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 2
+    assert 502 in adapter.max_retries.status_forcelist
+
+    client = get_client()
+
+    assert isinstance(client.session.get_adapter('https://x'), type(adapter))
+
+
+def test_call_uses_session(client: MoodleClient):
+    '''
+    Does the client reuse its session and pass per-call timeout?
+    '''
+
+    with patch.object(client, 'session') as mock_session:
+
+        mock_session.post.return_value.json.return_value = []
+
+        client.call('core_course_get_courses')
+        client.call('core_course_get_courses', timeout=5)
+
+        assert mock_session.post.call_count == 2
+
+        assert mock_session.post.call_args_list[0][1] == {'timeout': client.timeout, 'stream': False}
+        assert mock_session.post.call_args_list[1][1] == {'timeout': 5, 'stream': False}
+
+    with patch.object(client.session, 'close') as mock_close:
+
+        with client:
+            pass
+
+        mock_close.assert_called_once()
+
+
+def test_get_users_pages():
+    '''
+    Are enrolments fetched page by page with only consumed fields?
+    '''
+
+    client = MoodleClient(url='test.moodle.com', key='key', page_size=2, only_active=True)
+
+    raw_users = [
+        {'id': i, 'username': f'user_{i}', 'fullname': f'User {i}',
+         'email': f'user_{i}@mail.com', 'roles': [{'shortname': 'student'}]}
+        for i in range(5)
+    ]
+
+    def _call(api_func: str, courseid: int, options: t.List[dict], stream: bool) -> t.List[dict]:
+
+        assert stream
+
+        options = {option['name']: option['value'] for option in options}
+
+        assert options['userfields'] == 'id,username,fullname,email,roles'
+        assert options['onlyactive'] == 1
+
+        return raw_users[options['limitfrom']:options['limitfrom'] + options['limitnumber']]
+
+    course = JsonDict(id=1, title='Foo')
+
+    with patch.object(client, 'call', side_effect=_call) as mocked_call:
+
+        assert [u.username for u in client._get_users(course)] == [f'user_{i}' for i in range(5)]
+
+    assert [c.kwargs['options'][-2]['value'] for c in mocked_call.call_args_list] == [0, 2, 4]
+
+    client.page_size = 0
+
+    with patch.object(client, 'call', return_value=raw_users) as mocked_call:
+
+        assert len(list(client._get_users(course))) == 5
+
+    mocked_call.assert_called_once()
+
+    with pytest.raises(ValueError):
+        MoodleClient(url='test.moodle.com', key='key', page_size=-1)
+
+
+def test_load_users_concurrently(user_fabric: t.Callable):
+    '''
+    Are enrolments fetched concurrently merged in the order of courses?
+    '''
+
+    client = MoodleClient(url='test.moodle.com', key='key', concurrency=4)
+
+    assert client.session.get_adapter('https://x')._pool_maxsize >= 4
+
+    courses = [
+        JsonDict(course_id=f'course_{i}', instructors=[], graders=[], students=[])
+        for i in range(8)
+    ]
+
+    enrolments = {
+        course.course_id: [
+            user_fabric(username=f'{course.course_id}_{j}', roles=['student'])
+            for j in range(3)
+        ] + [user_fabric(username='shared', roles=['teacher'])]
+        for course in courses
+    }
+
+    client.courses = courses
+
+    with patch.object(client, '_get_users', side_effect=lambda c: iter(enrolments[c.course_id])):
+
+        client.load_users()
+
+    for course in courses:
+
+        assert [u.username for u in course.students] == [
+            f'{course.course_id}_{j}' for j in range(3)]
+
+        assert [u.username for u in course.graders] == ['shared']
+
+    # every course refers to the first course's copy of the shared user
+    assert all(course.graders[0].user is client.users['shared'] for course in courses)
+
+    assert len(client.users) == 8 * 3 + 1
+
+    with pytest.raises(ValueError):
+        MoodleClient(url='test.moodle.com', key='key', concurrency=0)
+
+
+def test_iter_courses_waits_for_consumer(user_fabric: t.Callable):
+    '''
+    Are no more than concurrency courses fetched ahead of a slow consumer?
+    '''
+
+    client = MoodleClient(url='test.moodle.com', key='key', concurrency=2)
+
+    client.courses = [
+        JsonDict(course_id=f'course_{i}', instructors=[], graders=[], students=[])
+        for i in range(8)
+    ]
+
+    fetched: t.List[str] = []
+
+    def _get_users(course: Course) -> t.Iterator[User]:
+        fetched.append(course.course_id)
+        return iter([user_fabric(username=f'{course.course_id}_student', roles=['student'])])
+
+    with patch.object(client, '_get_users', side_effect=_get_users):
+
+        courses = client.iter_courses()
+
+        assert next(courses) is client.courses[0]
+
+        # give the pool the time to fetch everything it was given
+        threading.Event().wait(0.1)
+
+        # the taken course and the two submitted after it
+        assert sorted(fetched) == [f'course_{i}' for i in range(3)]
+
+        assert next(courses) is client.courses[1]
+
+        threading.Event().wait(0.1)
+
+        assert len(fetched) == 4
+
+        courses.close()
+
+    assert len(fetched) == 4
+
+
+def test_load_users_saves_json(tmp_path, user_fabric: t.Callable):
+    '''
+    Are courses streamed to the file while users are fetched,
+    and released once written?
+    Are both the streamed and the legacy files loaded back?
+    '''
+
+    client = MoodleClient(url='test.moodle.com', key='key')
+
+    client.courses = [
+        JsonDict(course_id=f'course_{i}', instructors=[], graders=[], students=[])
+        for i in range(3)
+    ]
+
+    path = tmp_path / 'courses.json'
+
+    with patch.object(client, '_get_users', side_effect=lambda c: iter([
+                user_fabric(username=f'{c.course_id}_student', roles=['student'])])), \
+            patch('moodle.client.api.save_moodle_courses', side_effect=save_moodle_courses) as mock_save:
+
+        client.load_users(json_out=path)
+
+    # courses are passed lazily, not as a loaded list
+    courses, filename = mock_save.call_args.args
+
+    assert not isinstance(courses, list)
+    assert filename == path
+
+    assert len(path.read_text().splitlines()) == 3
+
+    # written courses don't keep their enrolments in memory
+    assert all(not course.students for course in client.courses)
+    assert client.users == {}
+
+    loaded = load_moodle_courses(path)
+
+    assert not isinstance(loaded, list)
+
+    loaded = list(loaded)
+
+    assert [course['course_id'] for course in loaded] == [f'course_{i}' for i in range(3)]
+    assert [course['students'][0]['username'] for course in loaded] == [
+        f'course_{i}_student' for i in range(3)]
+
+    path.write_text(dump_json(loaded))
+
+    assert list(load_moodle_courses(path)) == loaded
+
+    # no temporary files are left behind
+    assert os.listdir(tmp_path) == ['courses.json']
+
+
+def test_stream_courses(user_fabric: t.Callable):
+    '''
+    Are courses handed over in order while the next ones are fetched,
+    no more than maxsize ahead of the consumer?
+    Are fetching errors raised in the consumer?
+    '''
+
+    client = MoodleClient(url='test.moodle.com', key='key')
+
+    courses = [
+        JsonDict(course_id=f'course_{i}', instructors=[], graders=[], students=[])
+        for i in range(6)
+    ]
+
+    fetched: t.List[str] = []
+
+    def _get_users(course: Course) -> t.Iterator[User]:
+
+        fetched.append(course.course_id)
+
+        if course.course_id == 'course_5':
+            raise ConnectionError('Moodle is down')
+
+        return iter([user_fabric(username=f'{course.course_id}_student', roles=['student'])])
+
+    def _load_courses(json_in: dict, known_ids: t.Optional[dict] = None) -> None:
+        client.courses = courses
+
+    with patch.object(client, 'load_courses', side_effect=_load_courses), \
+            patch.object(client, '_get_users', side_effect=_get_users):
+
+        stream = client.stream_courses({}, maxsize=2)
+
+        first = next(stream)
+
+        assert first is courses[0]
+        assert first.students[0].username == 'course_0_student'
+
+        # wait for the producer to be blocked by the full queue
+        for _ in range(100):
+            if len(fetched) == 4:
+                break
+            threading.Event().wait(0.01)
+
+        # one course is consumed, two are queued, one waits to be queued
+        assert fetched == [f'course_{i}' for i in range(4)]
+
+        rest: t.List[str] = []
+
+        with pytest.raises(ConnectionError):
+            for course in stream:
+                rest.append(course.course_id)
+
+        assert rest == [f'course_{i}' for i in range(1, 5)]
+
+        # processed courses are released
+        assert first.students == []
+
+        fetched.clear()
+
+        stream = client.stream_courses({}, maxsize=1)
+
+        next(stream)
+
+        # the producer is stopped when the consumer is
+        stream.close()
+
+        assert len(fetched) < 5
 
 
 @pytest.mark.smoke
@@ -282,3 +716,54 @@ def test_filter_categories(client: MoodleClient, setenv_category: t.Callable):
         client.load_courses(course_id=('spam', 'baz'))
 
         assert client.courses == []
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1024])
+def test_streaming_response(chunk_size: int):
+    '''
+    Are array elements decoded one by one whatever the chunks are,
+    and are exception payloads still detected?
+    '''
+
+    def response(body: str) -> MagicMock:
+
+        resp = MagicMock()
+
+        data = body.encode()
+
+        resp.iter_content.side_effect = lambda size: (
+            data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+
+        return resp
+
+    body = json.dumps([{'id': 1, 'name': 'Платон'}, 12345, 'x, ]', [1, [2]], None, 6.5])
+
+    stream = StreamingResponse(response(' \n' + body), 'foo', chunk_size=chunk_size)
+
+    elements = iter(stream)
+
+    assert next(elements) == {'id': 1, 'name': 'Платон'}
+    assert stream.count == 1
+
+    assert list(elements) == [12345, 'x, ]', [1, [2]], None, 6.5]
+
+    stream.http_resp.close.assert_called()
+
+    with pytest.raises(RuntimeError):
+        iter(stream)
+
+    assert list(StreamingResponse(response('[ ]'), 'foo', chunk_size=chunk_size)) == []
+
+    courses = StreamingResponse(response('{"courses": [], "warnings": []}'), 'foo', chunk_size=chunk_size)
+
+    assert courses['courses'] == []
+
+    with pytest.raises(MoodleAPIException):
+        StreamingResponse(response('{"exception": "invalid_parameter_exception"}'), 'foo')
+
+    with pytest.raises(MoodlePermissionError):
+        StreamingResponse(response('{"exception": "webservice_access_exception"}'), 'foo')
+
+    for invalid in ('[1, 2', '[1 2]', '[1,]', '<html>'):
+        with pytest.raises(MoodleAPIException):
+            list(StreamingResponse(response(invalid), 'foo', chunk_size=chunk_size))
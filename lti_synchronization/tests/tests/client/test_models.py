@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from moodle.models import Course, Enrolment, User, to_json
+from moodle.settings import ROLES
+
+
+def make_json_course(course_id: str, **groups: list) -> dict:
+    return {
+        'id': 1, 'course_id': course_id, 'title': course_id.title(), 'category': 2,
+        'need_nbgrader': True, 'lms_lineitems_endpoint': 'https://moodle/lineitems',
+        'instructors': [], 'graders': [], 'students': [], **groups,
+    }
+
+
+def make_json_user(username: str, role: str) -> dict:
+    return {
+        'id': len(username), 'first_name': username.title(), 'last_name': '',
+        'username': username, 'email': f'{username}@mail.com', 'role': role,
+    }
+
+
+def test_models_share_users():
+    '''
+    Is a user enrolled in several courses stored once,
+    with a course role for every enrolment?
+    '''
+
+    users = {}
+
+    foo = Course.from_dict(make_json_course(
+        'foo', students=[make_json_user('plato', 'student')]), users)
+
+    bar = Course.from_dict(make_json_course(
+        'bar', graders=[make_json_user('plato', 'teaching_assistant')]), users)
+
+    student, = foo.students
+    grader, = bar.graders
+
+    assert student.user is grader.user is users['plato']
+
+    assert (student.role, grader.role) == ('student', 'teaching_assistant')
+    assert grader.rank == ROLES.index('teaching_assistant')
+
+    grader.email = 'new@mail.com'
+
+    assert student['email'] == 'new@mail.com'
+
+    assert not hasattr(student, '__dict__')
+    assert not hasattr(foo, '__dict__')
+
+    with pytest.raises(KeyError):
+        Enrolment(users['plato'], 'superman')
+
+
+def test_models_dict_view():
+    '''
+    Do models behave like the dictionaries they replace?
+    '''
+
+    json_course = make_json_course('foo', instructors=[make_json_user('socrates', 'editingteacher')])
+
+    course = Course.from_dict({**json_course, 'unknown': 'ignored'})
+
+    assert course == json_course
+    assert dict(course) == {**json_course, 'instructors': course.instructors}
+
+    assert course['title'] == course.get('title') == 'Foo'
+    assert course.get('unknown', 'missing') == 'missing'
+    assert 'course_id' in course and 'unknown' not in course
+
+    course['need_nbgrader'] = False
+
+    assert course.need_nbgrader is False
+
+    with pytest.raises(KeyError):
+        course['unknown'] = 'value'
+
+    assert json.loads(json.dumps(course, default=to_json)) == {**json_course, 'need_nbgrader': False}
+
+    # raw Moodle roles are not a part of the dictionary view
+    user = User(1, 'Plato', '', 'plato', 'plato@mail.com', roles=['student'])
+
+    assert 'roles' not in user
+    assert user.to_dict() == {
+        'id': 1, 'first_name': 'Plato', 'last_name': '',
+        'username': 'plato', 'email': 'plato@mail.com',
+    }
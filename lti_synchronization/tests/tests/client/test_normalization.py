@@ -0,0 +1,71 @@
+import pytest
+from loguru import logger
+
+from moodle import normalization
+from moodle.client.helper import MoodleDataHelper
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    normalization.clear_cache()
+    yield
+    normalization.clear_cache()
+
+
+@pytest.mark.parametrize(
+    'email, expected',
+    [
+        ('John.Doe+moodle@mail.com', 'johndoe'),
+        ('john(comment)doe@mail.com', 'johndoe'),
+        ('2pac@mail.com', 'a_2pac'),
+        ('plato', 'plato'),
+        ('x' * 60 + '@mail.com', 'x' * 50),
+    ],
+)
+def test_email_to_username(email: str, expected: str):
+
+    assert normalization.email_to_username(email) == expected
+
+
+def test_normalization_is_memoized():
+    '''
+    Is every raw value normalized once?
+    '''
+
+    for _ in range(3):
+        assert normalization.format_string('Foo Course 101') == 'foo_course_101'
+        assert normalization.email_to_username('Plato@mail.com') == 'plato'
+
+    assert normalization.email_to_username.cache_info().misses == 1
+    assert normalization.format_string.cache_info().hits == 2
+
+    with pytest.raises(ValueError):
+        normalization.format_string('')
+
+
+def test_format_users_collisions(helper: MoodleDataHelper):
+    '''
+    Are different emails normalized to the same username reported?
+    '''
+
+    raw_users = [
+        {'id': i, 'email': email, 'fullname': 'John Doe', 'roles': [{'shortname': 'student'}]}
+        for i, email in enumerate(('john.doe@foo.edu', 'johndoe@bar.edu'))
+    ]
+
+    messages = []
+
+    handler = logger.add(messages.append, level='WARNING', format='{message}')
+
+    try:
+        users = list(helper.format_users(raw_users))
+    finally:
+        logger.remove(handler)
+
+    assert [user.username for user in users] == ['johndoe', 'johndoe']
+    assert [user.roles for user in users] == [['student'], ['student']]
+
+    assert any(
+        "share the username 'johndoe'" in message
+        for message in messages
+    )
@@ -1,3 +1,4 @@
+import json
 from unittest.mock import AsyncMock, Mock, MagicMock, patch
 
 import pytest
@@ -7,6 +8,9 @@
 from moodle.grades.handlers import SendGradesHandler
 
 
+REPORT = {'sent': [{'student_id': 'plato', 'lms_user_id': '1', 'reason': None}], 'failed': [], 'skipped': []}
+
+
 @pytest.fixture
 def mock_tornado_write() -> MagicMock:
     with patch('tornado.web.RequestHandler.write') as mocker:
@@ -56,7 +60,7 @@ async def test_SendGrades_calls_GradeSender(
 
     with patch('moodle.grades.handlers.LTI13GradeSender') as mock_sender:
 
-        mock_sender.return_value.send_grades = AsyncMock()
+        mock_sender.return_value.send_grades = AsyncMock(return_value=REPORT)
 
         await grades_client.post('course_example', 'assignment_test')
 
@@ -87,8 +91,26 @@ async def test_SendGradesHandler_calls_write_method(
 
     with patch('moodle.grades.handlers.LTI13GradeSender') as mock_sender:
 
-        mock_sender.return_value.send_grades = AsyncMock()
+        mock_sender.return_value.send_grades = AsyncMock(return_value=REPORT)
 
         await grades_client.post('course_example', 'assignment_test')
 
         assert mock_tornado_write.called
+
+
+@pytest.mark.asyncio
+async def test_SendGradesHandler_writes_report(
+    mock_tornado_write: MagicMock,
+    grades_client: SendGradesHandler
+):
+    '''
+    Does the SendGradesHandler write the submission report?
+    '''
+
+    with patch('moodle.grades.handlers.LTI13GradeSender') as mock_sender:
+
+        mock_sender.return_value.send_grades = AsyncMock(return_value=REPORT)
+
+        await grades_client.post('course_example', 'assignment_test')
+
+        assert json.loads(mock_tornado_write.call_args[0][0]) == {'success': True, **REPORT}
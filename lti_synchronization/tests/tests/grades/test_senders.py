@@ -1,8 +1,9 @@
+import json
 import os
 from unittest.mock import patch, Mock, AsyncMock
 
 import pytest
-from tornado.httpclient import AsyncHTTPClient, HTTPResponse
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPResponse
 from tornado.httputil import HTTPHeaders
 from tornado.web import RequestHandler
 
@@ -187,3 +188,87 @@ async def test_get_lineitems_from_url_method_calls_itself_recursively(
         assert len(sender.all_lineitems) == 2
 
         assert mock_fetch.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_sender_reports_sent_failed_and_skipped(
+    lti13_config_environ: None,
+    mock_nbgrader_helper: Mock,
+):
+    '''
+    Are scores sent concurrently, retried on 5xx and connection errors,
+    and reported per student in one shape?
+    '''
+
+    sender = LTI13GradeSender('course-id', 'lab')
+
+    grades = (10, [
+        {'score': 10, 'lms_user_id': '1', 'student_id': 'plato'},
+        {'score': 5, 'lms_user_id': '2', 'student_id': 'zeno'},
+        {'score': 7, 'lms_user_id': '3', 'student_id': 'thales'},
+        {'score': 3, 'lms_user_id': None, 'student_id': 'socrates'},
+    ])
+
+    attempts = {}
+
+    async def fetch(url, body, **kwargs):
+
+        user_id = json.loads(body)['userId']
+
+        attempts[user_id] = attempts.get(user_id, 0) + 1
+
+        if user_id == '2' and attempts[user_id] == 1:
+            raise HTTPClientError(503)
+
+        if user_id == '1' and attempts[user_id] == 1:
+            raise ConnectionRefusedError('Connection refused')
+
+        if user_id == '3':
+            raise HTTPClientError(400)
+
+    with patch.object(sender, '_retrieve_grades_from_db', return_value=grades), \
+            patch.object(sender, '_set_access_token_header', AsyncMock()), \
+            patch.object(
+                sender, '_get_line_item_info_by_assignment_name',
+                AsyncMock(return_value={'id': 'line_item_url', 'scoreMaximum': 10})), \
+            patch('moodle.grades.senders.GRADES_BACKOFF_FACTOR', 0), \
+            patch.object(AsyncHTTPClient, 'fetch', side_effect=fetch):
+
+        report = await sender.send_grades()
+
+    assert sorted(s['lms_user_id'] for s in report['sent']) == ['1', '2']
+    assert [f['lms_user_id'] for f in report['failed']] == ['3']
+    assert [s['student_id'] for s in report['skipped']] == ['socrates']
+    assert attempts == {'1': 2, '2': 2, '3': 1}
+
+    assert all(
+        entry.keys() == {'student_id', 'lms_user_id', 'reason'}
+        for entries in report.values() for entry in entries
+    )
+
+
+def test_sender_retry_delay():
+    '''
+    Is Retry-After of the LMS followed, but no longer than the limit?
+    '''
+
+    def error(retry_after: str) -> HTTPClientError:
+
+        request = Mock()
+
+        response = HTTPResponse(request, 429, headers=HTTPHeaders({'Retry-After': retry_after}))
+
+        return HTTPClientError(429, response=response)
+
+    with patch('moodle.grades.senders.GRADES_MAX_RETRY_DELAY', 10), \
+            patch('moodle.grades.senders.GRADES_BACKOFF_FACTOR', 0.5):
+
+        assert LTI13GradeSender._retry_delay(error('3'), 0) == 3
+        assert LTI13GradeSender._retry_delay(error('3600'), 0) == 10
+        assert LTI13GradeSender._retry_delay(ConnectionResetError(), 2) == 2
+        assert LTI13GradeSender._retry_delay(ConnectionResetError(), 10) == 10
+
+    assert LTI13GradeSender._is_retriable(ConnectionRefusedError())
+    assert LTI13GradeSender._is_retriable(HTTPClientError(599))
+    assert not LTI13GradeSender._is_retriable(HTTPClientError(400))
+    assert not LTI13GradeSender._is_retriable(ValueError())
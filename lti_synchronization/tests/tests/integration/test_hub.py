@@ -0,0 +1,302 @@
+import json
+import threading
+import typing as t
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import pytest
+import requests
+
+from moodle.integration.hub import HubAPIClient
+from moodle.integration.manager import SyncManager
+from moodle.sync import synchronize
+from moodle.utils import JsonDict
+
+
+class StubHub:
+    '''
+    In-memory Jupyterhub serving the part of the REST API used by the client.
+    '''
+
+    def __init__(self) -> None:
+
+        self.users: t.Dict[str, bool] = {}
+        self.groups: t.Dict[str, t.Set[str]] = {}
+
+        self.calls: t.List[t.Tuple[str, str]] = []
+
+        # number of next calls answered with a server error
+        self.failures: int = 0
+
+    def handle(self, method: str, path: str, body: t.Any) -> t.Any:
+
+        self.calls.append((method, path))
+
+        parts = path.split('/')[1:]
+
+        if parts == ['users']:
+
+            if method == 'GET':
+                return [{'name': name, 'admin': admin} for name, admin in self.users.items()]
+
+            for name in body['usernames']:
+                self.users[name] = body['admin']
+
+        elif parts[0] == 'users':
+
+            if method == 'PATCH':
+                self.users[parts[1]] = body['admin']
+
+            else:
+                del self.users[parts[1]]
+
+                for members in self.groups.values():
+                    members.discard(parts[1])
+
+        elif parts == ['groups']:
+            return [{'name': name, 'users': sorted(users)} for name, users in self.groups.items()]
+
+        elif len(parts) == 2:
+
+            if method == 'POST':
+                self.groups[parts[1]] = set(body['users'])
+
+            else:
+                del self.groups[parts[1]]
+
+        elif method == 'POST':
+            self.groups[parts[1]].update(body['users'])
+
+        else:
+            self.groups[parts[1]].difference_update(body['users'])
+
+
+@pytest.fixture
+def stub_hub() -> t.Generator[t.Tuple[StubHub, str], None, None]:
+
+    hub = StubHub()
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _respond(self) -> None:
+
+            assert self.headers['Authorization'] == 'token secret'
+
+            length = int(self.headers.get('Content-Length') or 0)
+
+            body = json.loads(self.rfile.read(length)) if length else None
+
+            if hub.failures:
+
+                hub.failures -= 1
+
+                hub.calls.append((self.command, self.path[len('/hub/api'):]))
+
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+                return
+
+            result = hub.handle(self.command, self.path[len('/hub/api'):], body)
+
+            content = json.dumps(result).encode() if result is not None else b''
+
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = do_POST = do_PATCH = do_DELETE = _respond
+
+        def log_message(self, *args: t.Any) -> None:
+            ...
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield hub, f'http://127.0.0.1:{server.server_port}/hub/api'
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_hub_client_applies_delta(stub_hub: t.Tuple[StubHub, str]):
+    '''
+    Does the client send only the difference with the hub state?
+    '''
+
+    hub, url = stub_hub
+
+    hub.users = {'admin': True, 'plato': False, 'zeno': False, 'thales': False}
+    hub.groups = {
+        'nbgrader-foo': {'plato', 'zeno', 'thales'},
+        'nbgrader-old': {'zeno'},
+        'custom': {'zeno'},
+    }
+
+    client = HubAPIClient(url, 'secret')
+
+    summary = client.apply(
+        whitelist={'plato', 'zeno', 'socrates', 'aristotle'},
+        admin_users={'socrates', 'zeno'},
+        groups={'nbgrader-foo': ['plato', 'aristotle'], 'formgrade-foo': ['socrates']},
+    )
+
+    # users are not deleted unless asked to
+    assert hub.users == {
+        'admin': True, 'plato': False, 'zeno': True, 'thales': False,
+        'socrates': True, 'aristotle': False,
+    }
+
+    assert hub.groups == {
+        'nbgrader-foo': {'plato', 'aristotle'},
+        'formgrade-foo': {'socrates'},
+        'custom': {'zeno'},
+    }
+
+    assert summary == {
+        'created': 2, 'deleted': 0, 'promoted': 1, 'demoted': 0,
+        'groups_created': 1, 'groups_deleted': 1, 'added': 1, 'removed': 2,
+    }
+
+    summary = client.apply(
+        whitelist={'plato', 'zeno', 'socrates', 'aristotle'},
+        admin_users={'socrates', 'zeno'},
+        groups={'nbgrader-foo': ['plato', 'aristotle'], 'formgrade-foo': ['socrates']},
+        delete=True,
+    )
+
+    # admins not managed by the synchronization are kept
+    assert hub.users.keys() == {'admin', 'plato', 'zeno', 'socrates', 'aristotle'}
+
+    assert summary['deleted'] == 1
+
+    hub.calls.clear()
+
+    client.apply(
+        whitelist={'plato', 'zeno', 'socrates', 'aristotle'},
+        admin_users={'socrates', 'zeno'},
+        groups={'nbgrader-foo': ['plato', 'aristotle'], 'formgrade-foo': ['socrates']},
+        delete=True,
+    )
+
+    # nothing to change, only the state is read
+    assert hub.calls == [('GET', '/users'), ('GET', '/groups')]
+
+
+def test_hub_client_retries_only_reads(stub_hub: t.Tuple[StubHub, str]):
+    '''
+    Are failed reads retried, while calls changing the hub are sent once?
+    '''
+
+    hub, url = stub_hub
+
+    client = HubAPIClient(url, 'secret')
+
+    hub.failures = 1
+
+    assert client.get_users() == {}
+
+    assert hub.calls == [('GET', '/users'), ('GET', '/users')]
+
+    hub.calls.clear()
+
+    hub.failures = 1
+
+    with pytest.raises(requests.HTTPError):
+        client.request('POST', '/users', usernames=['plato'], admin=False)
+
+    assert hub.calls == [('POST', '/users')]
+
+    assert hub.users == {}
+
+
+def test_manager_restarts_only_on_service_changes(tmp_path, stub_hub: t.Tuple[StubHub, str]):
+    '''
+    Does the manager apply membership changes to the hub,
+    and require a restart only when services change?
+    '''
+
+    hub, url = stub_hub
+
+    out_file = tmp_path / 'jupyterhub_config.py'
+
+    def write_config(*args: t.Any, **kwargs: t.Any) -> bool:
+        out_file.write_text(json.dumps(kwargs, default=str, sort_keys=True))
+        return True
+
+    def sync(*courses: dict, **filters: t.Any) -> bool:
+
+        manager = SyncManager(
+            ports_path=tmp_path / 'ports.json',
+            tokens_path=tmp_path / 'tokens.json',
+            hub=HubAPIClient(url, 'secret', delete_users=True),
+        )
+
+        with mock.patch.object(manager, 'helper') as helper, \
+                mock.patch.object(manager, 'temp') as temp, \
+                mock.patch.object(manager, 'create_grader'), \
+                mock.patch('moodle.integration.manager.system'), \
+                mock.patch('moodle.integration.manager.Provisioner'):
+
+            helper.skip_course.return_value = False
+            helper.get_user_group.side_effect = lambda u: 'students' if u['role'] == 'student' else 'graders'
+
+            temp.update_jupyterhub_config.side_effect = write_config
+
+            return manager.update_jupyterhub(courses=list(courses), out_file=out_file, **filters)
+
+    def course(*students: str, need_nbgrader: bool = True) -> dict:
+        return JsonDict({
+            'id': 1, 'course_id': 'foo', 'title': 'Foo', 'category': 1,
+            'need_nbgrader': need_nbgrader, 'lms_lineitems_endpoint': '',
+            'instructors': [], 'graders': [],
+            'students': [
+                {'id': i, 'username': name, 'first_name': name, 'last_name': '',
+                 'email': f'{name}@mail.com', 'role': 'student'}
+                for i, name in enumerate(students)
+            ],
+        })
+
+    # first run creates the service
+    assert sync(course('plato'))
+
+    assert sync(course('plato', 'zeno')) is False
+
+    assert hub.groups['nbgrader-foo'] == {'plato', 'zeno'}
+    assert 'zeno' in hub.users
+
+    # a filtered synchronization doesn't see users of skipped courses
+    assert sync(course('plato'), title='Foo') is False
+
+    assert 'zeno' in hub.users
+
+    assert sync(course('plato')) is False
+
+    assert 'zeno' not in hub.users
+
+    # course doesn't need a service anymore
+    assert sync(course('plato', need_nbgrader=False))
+
+
+def test_synchronize_closes_hub_client(tmp_path):
+    '''
+    Are connections to the hub closed when the synchronization fails?
+    '''
+
+    json_in = tmp_path / 'courses.json'
+
+    json_in.write_text(json.dumps({'jupyterhub': [], 'nbgrader': []}))
+
+    with mock.patch('moodle.sync.MoodleClient') as client, \
+            mock.patch('moodle.sync.HubAPIClient') as hub_client:
+
+        client.return_value.fetch_courses.side_effect = ConnectionError('Moodle is down')
+
+        with pytest.raises(ConnectionError):
+            synchronize(json_in=json_in, hub_api=True)
+
+    hub_client.return_value.close.assert_called_once_with()
@@ -1,5 +1,10 @@
+from pathlib import Path
 from unittest.mock import patch
+
+from moodle import models
 from moodle.integration.manager import SyncManager
+from moodle.integration.ports import PortAllocator
+from moodle.integration.tokens import TokenStore
 
 
 def test_manager_keyword_arguments():
@@ -27,3 +32,96 @@ def test_manager_keyword_arguments():
             temp.get_default.side_effect = KeyboardInterrupt
 
             manager.update_jupyterhub()
+
+
+def test_manager_provisions_streamed_courses_in_batches():
+    '''
+    Are system changes applied after every batch of courses,
+    while the next courses are still being produced?
+    '''
+
+    manager = SyncManager(provision_batch=2)
+
+    events = []
+
+    def stream():
+        for i in range(5):
+            events.append(f'fetched {i}')
+            yield models.Course(i, f'course_{i}', f'Course {i}')
+
+    with patch.object(manager, 'helper') as helper, \
+            patch.object(manager, 'process_course'), \
+            patch.object(manager, 'apply_system_changes',
+                         side_effect=lambda: events.append('provisioned')):
+
+        helper.skip_course.return_value = False
+
+        manager.process_data(stream())
+
+    assert events == [
+        'fetched 0', 'fetched 1', 'provisioned',
+        'fetched 2', 'fetched 3', 'provisioned',
+        'fetched 4',
+    ]
+
+
+def test_manager_keeps_ports_of_filtered_courses(tmp_path: Path):
+    '''
+    Are ports of courses skipped by filters kept,
+    and ports of courses gone freed only by a complete run?
+    '''
+
+    ports_path = tmp_path / 'ports.json'
+
+    PortAllocator({'foo': 0, 'bar': 1}).save(ports_path)
+
+    manager = SyncManager(ports_path=ports_path, tokens_path=tmp_path / 'tokens.json')
+
+    with patch.object(manager, 'helper') as helper, \
+            patch.object(manager, 'process_course',
+                         side_effect=lambda course: manager.ports.get(course.course_id)):
+
+        helper.skip_course.side_effect = lambda course, filters: (
+            'course_id' in filters and course.course_id not in filters['course_id'])
+
+        courses = [models.Course(1, 'foo', 'Foo'), models.Course(2, 'bar', 'Bar')]
+
+        manager.process_data(courses, course_id=['foo'])
+
+        assert manager.ports.ports == {'foo': 0, 'bar': 1}
+
+        manager.process_data(courses[:1])
+
+        assert manager.ports.ports == {'foo': 0}
+
+
+def test_manager_keeps_tokens_of_filtered_courses(tmp_path: Path):
+    '''
+    Are tokens of courses skipped by filters kept,
+    and tokens of courses gone revoked only by a complete run?
+    '''
+
+    tokens_path = tmp_path / 'tokens.json'
+
+    store = TokenStore.load(tokens_path)
+    tokens = {course_id: store.get(course_id) for course_id in ('foo', 'bar')}
+    store.save(tokens_path)
+
+    manager = SyncManager(ports_path=tmp_path / 'ports.json', tokens_path=tokens_path)
+
+    with patch.object(manager, 'helper') as helper, \
+            patch.object(manager, 'process_course',
+                         side_effect=lambda course: manager.token_store.get(course.course_id)):
+
+        helper.skip_course.side_effect = lambda course, filters: (
+            'course_id' in filters and course.course_id not in filters['course_id'])
+
+        courses = [models.Course(1, 'foo', 'Foo'), models.Course(2, 'bar', 'Bar')]
+
+        manager.process_data(courses, course_id=['foo'])
+
+        assert manager.token_store.tokens == tokens
+
+        manager.process_data(courses[:1])
+
+        assert manager.token_store.tokens == {'foo': tokens['foo']}
@@ -5,10 +5,14 @@
 
 import pytest
 
+from nbgrader.api import Gradebook
+
 from moodle.helper import NBGraderHelper
-from moodle.integration.system import join_dirs, create_dirs, create_database, chown
-from moodle.integration.template import Templater
+from moodle.integration import system
+from moodle.integration.system import join_dirs, create_dirs, create_database, chown, write_file
+from moodle.integration.template import Templater, format_literal
 from moodle.typehints import User
+from moodle.utils import save_moodle_courses
 
 
 @pytest.fixture
@@ -58,6 +62,50 @@ def test_helper_add_student(student: User, gradebook: t.Tuple[mock.Mock, mock.Mo
     )
 
 
+def test_helper_add_students(tmp_path: Path, user_fabric: t.Callable):
+    '''
+    Does helper reconcile the whole course in the gradebook?
+    '''
+
+    def make_student(username: str, id: int, email: str = '') -> User:
+        return user_fabric(
+            id=id,
+            username=username,
+            first_name=username.title(),
+            last_name='',
+            email=email or f'{username}@mail.com',
+            roles=['student'],
+        )
+
+    helper = NBGraderHelper()
+
+    db_url = f'sqlite:///{tmp_path / "grader.db"}'
+
+    with mock.patch.object(
+                NBGraderHelper, '_get_db',
+                side_effect=lambda course_id: Gradebook(db_url, course_id=course_id)):
+
+        summary = helper.add_students(
+            'foo_course', [make_student('plato', 1), make_student('zeno', 2)])
+
+        assert summary == {'added': 2, 'updated': 0, 'unchanged': 0, 'dropped': 0, 'removed': 0}
+
+        summary = helper.add_students(
+            'foo_course', [make_student('plato', 1, 'plato@academy.gr'), make_student('thales', 3)],
+            drop_missing=True)
+
+        assert summary == {'added': 1, 'updated': 1, 'unchanged': 0, 'dropped': 1, 'removed': 1}
+
+    with Gradebook(db_url, course_id='foo_course') as gb:
+
+        assert sorted(student.id for student in gb.students) == ['plato', 'thales']
+
+        plato = gb.find_student('plato')
+
+        assert plato.email == 'plato@academy.gr'
+        assert plato.lms_user_id == '1'
+
+
 def test_helper_get_db():
     '''
     Does helper manage databases correctly?
@@ -78,21 +126,24 @@ def test_helper_get_db():
         ))
 
 
-@pytest.mark.parametrize('dirs, line', [
-    (['one'], 'mkdir -p one'),
-    (['one', 'two'], 'mkdir -p one two'),
-    ([['one', 'two', 'three']], 'mkdir -p one two three'),
-    (('one', 'two'), 'mkdir -p one two'),
-    ((('one', 'two')), 'mkdir -p one two'),
-    pytest.param([], '', marks=pytest.mark.xfail),
-    pytest.param((), '', marks=pytest.mark.xfail),
-    pytest.param([object(), [], {}], '', marks=pytest.mark.xfail),
+@pytest.mark.parametrize('dirs, created', [
+    (['one'], ['one']),
+    (['one', 'two'], ['one', 'two']),
+    ([['one', 'two', 'three']], ['one', 'two', 'three']),
+    (('one', 'two'), ['one', 'two']),
+    ((('one', 'two')), ['one', 'two']),
+    pytest.param([], [], marks=pytest.mark.xfail),
+    pytest.param((), [], marks=pytest.mark.xfail),
+    pytest.param([object(), [], {}], [], marks=pytest.mark.xfail),
 ])
-@mock.patch('moodle.integration.system.os.system')
-def test_system_create_dirs(mocked_os: mock.MagicMock, dirs: t.Any, line: str):
+@mock.patch('moodle.integration.system.os.makedirs')
+def test_system_create_dirs(mocked_makedirs: mock.MagicMock, dirs: t.Any, created: t.List[str]):
 
     create_dirs(*dirs)
-    mocked_os.assert_called_once_with(line)
+
+    mocked_makedirs.assert_has_calls([mock.call(d, exist_ok=True) for d in created])
+
+    assert mocked_makedirs.call_count == len(created)
 
 
 def test_join_dirs():
@@ -126,29 +177,101 @@ def test_low_level_system_api():
         chown('user', ['dir'], group='')
 
 
-@mock.patch('moodle.integration.system.os.system')
-def test_system_create_db(mocked_os: mock.MagicMock):
+@mock.patch('moodle.integration.system.get_ids', return_value=(1000, 1000))
+@mock.patch('moodle.integration.system.os')
+def test_system_create_db(mocked_os: mock.MagicMock, mocked_get_ids: mock.MagicMock):
+
+    with mock.patch('moodle.integration.system.open', mock.mock_open()) as mocked_open:
+
+        create_database('grader')
+
+    mocked_open.assert_called_once_with('/home/grader/grader.db', 'a')
 
-    create_database('grader')
+    mocked_get_ids.assert_called_once_with('grader', 'grader')
 
-    mocked_os.assert_has_calls([
-        mock.call('touch /home/grader/grader.db'),
-        mock.call('chown -R grader:grader /home/grader/grader.db'),
-        mock.call('chmod 644 /home/grader/grader.db'),
-    ])
+    mocked_os.chown.assert_any_call('/home/grader', 1000, 1000, follow_symlinks=False)
 
+    mocked_os.chmod.assert_called_once_with('/home/grader', 0o755)
 
-@mock.patch('moodle.integration.template.open', new_callable=mock.mock_open)
-def test_templater_write_config(mocked_open: mock.MagicMock):
+    mocked_os.system.assert_not_called()
 
-    Templater.write_grader_config('test_course')
+
+@mock.patch('moodle.integration.template.write_file', return_value=False)
+def test_templater_write_config(mocked_write: mock.MagicMock):
+
+    assert Templater.write_grader_config('test_course') is False
 
     config_path = '/home/grader-test_course/{}/nbgrader_config.py'
 
-    mocked_open.assert_any_call(config_path.format('.jupyter'), 'w')
-    mocked_open.assert_any_call(config_path.format('test_course'), 'w')
+    assert [c.args[0] for c in mocked_write.call_args_list] == [
+        config_path.format('.jupyter'),
+        config_path.format('test_course'),
+    ]
+
+
+def test_write_file(tmp_path: Path):
+    '''
+    Is the file replaced only when its content changes, keeping the mode?
+    '''
+
+    path = tmp_path / 'jupyterhub_config.py'
 
-    assert mocked_open().write.call_count == 2
+    assert write_file(path, 'foo')
+    assert path.read_text() == 'foo'
+
+    os.chmod(path, 0o600)
+
+    mtime = path.stat().st_mtime_ns
+
+    assert write_file(path, 'foo') is False
+    assert path.stat().st_mtime_ns == mtime
+
+    assert write_file(path, 'bar')
+    assert path.read_text() == 'bar'
+    assert path.stat().st_mode & 0o777 == 0o600
+
+    # the same content with other permissions is written again
+    assert write_file(path, 'bar', mode=0o640)
+    assert path.stat().st_mode & 0o777 == 0o640
+
+    # no temporary files are left behind
+    assert os.listdir(tmp_path) == ['jupyterhub_config.py']
+
+
+def test_save_courses_is_durable(tmp_path: Path):
+    '''
+    Are saved courses flushed to the disk before the file is replaced,
+    and is the previous file kept if saving is interrupted?
+    '''
+
+    path = tmp_path / 'courses.json'
+
+    calls = []
+
+    replace = os.replace
+
+    with mock.patch.object(system.os, 'fsync', side_effect=lambda fd: calls.append('fsync')), \
+            mock.patch.object(system.os, 'replace',
+                              side_effect=lambda *args: calls.append('replace') or replace(*args)):
+
+        save_moodle_courses([{'course_id': 'foo'}], path)
+
+    # the file, the rename, and the directory
+    assert calls == ['fsync', 'replace', 'fsync']
+
+    save_moodle_courses([{'course_id': 'foo'}], path)
+
+    def courses():
+        yield {'course_id': 'bar'}
+        raise ConnectionError('Moodle is down')
+
+    with pytest.raises(ConnectionError):
+        save_moodle_courses(courses(), path)
+
+    assert path.read_text() == '{"course_id":"foo"}\n'
+
+    # no temporary files are left behind
+    assert os.listdir(tmp_path) == ['courses.json']
 
 
 def test_templater_new_service():
@@ -165,3 +288,24 @@ def test_templater_new_service():
 
     with pytest.raises(TypeError):
         Templater.create_service('test_course', 'token', 'invalid_port')
+
+
+def test_format_literal():
+    '''
+    Is the configuration emitted as valid and stable Python source?
+    '''
+
+    data = {
+        'whitelist': {'zeno', 'plato', 'aristotle'},
+        'groups': {'nbgrader-foo': ['zeno', 'plato'], 'formgrade-foo': []},
+        'services': [Templater.create_service('foo', 'token')],
+        'empty': set(),
+    }
+
+    source = format_literal(data)
+
+    assert eval(source) == data
+
+    assert source == format_literal({**data, 'whitelist': {'plato', 'aristotle', 'zeno'}})
+
+    assert "    'whitelist': {\n        'aristotle',\n        'plato',\n        'zeno',\n    },\n" in source
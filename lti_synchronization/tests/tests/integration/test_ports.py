@@ -0,0 +1,69 @@
+import os
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from moodle.integration.ports import PortAllocator
+
+
+def test_ports_are_stable_and_reused(tmp_path: Path):
+    '''
+    Does a course keep its port across synchronizations,
+    and does a new course take the port of a removed one?
+    '''
+
+    path = tmp_path / 'ports.json'
+
+    ports = PortAllocator.load(path)
+
+    assert [ports.get(course_id) for course_id in ('foo', 'bar', 'baz')] == [0, 1, 2]
+    assert ports.changed
+
+    ports.save(path)
+
+    ports = PortAllocator.load(path)
+
+    assert ports.get('baz') == 2
+    assert ports.get('foo') == 0
+    assert ports.release_unused() == {'bar'}
+
+    assert ports.get('qux') == 1
+    assert ports.get('quux') == 3
+
+    ports.save(path)
+
+    assert PortAllocator.load(path).ports == {'foo': 0, 'baz': 2, 'qux': 1, 'quux': 3}
+
+
+def test_ports_load_corrupted(tmp_path: Path):
+
+    path = tmp_path / 'ports.json'
+
+    path.write_text('{corrupted')
+
+    assert PortAllocator.load(path).ports == {}
+
+    ports = PortAllocator({'foo': 3})
+
+    # gaps below the largest offset are free
+    assert [ports.get(course_id) for course_id in ('bar', 'baz', 'qux', 'quux')] == [0, 1, 2, 4]
+
+
+def test_ports_save_is_atomic(tmp_path: Path):
+    '''
+    Does an interrupted save keep the previous allocation?
+    '''
+
+    path = tmp_path / 'ports.json'
+
+    PortAllocator({'foo': 0}).save(path)
+
+    with mock.patch('moodle.integration.system.os.replace', side_effect=OSError('disk full')):
+
+        with pytest.raises(OSError):
+            PortAllocator({'foo': 0, 'bar': 1}).save(path)
+
+    assert PortAllocator.load(path).ports == {'foo': 0}
+
+    assert os.listdir(tmp_path) == ['ports.json']
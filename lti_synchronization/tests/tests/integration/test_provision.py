@@ -0,0 +1,281 @@
+import os
+import subprocess
+import typing as t
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from moodle.integration import system
+from moodle.integration.provision import Provisioner
+
+
+@pytest.fixture
+def owner() -> t.Tuple[int, int]:
+    return os.getuid(), os.getgid()
+
+
+def test_provisioner_queue():
+    '''
+    Does the provisioner dedupe paths and keep the last request?
+    '''
+
+    provisioner = Provisioner()
+
+    assert not provisioner
+
+    provisioner.add_user('plato')
+    provisioner.add_user('plato')
+    provisioner.chown('plato', '/home/plato')
+    provisioner.chown('plato', '/home/plato', group='plato')
+    provisioner.chmod(755, '/home/plato')
+    provisioner.chmod('700', '/home/plato')
+
+    assert list(provisioner.users) == ['plato']
+    assert provisioner.owners == {'/home/plato': ('plato', 'plato')}
+    assert provisioner.modes == {'/home/plato': 0o700}
+
+    with pytest.raises(ValueError):
+        provisioner.add_user('')
+
+    with pytest.raises(ValueError):
+        provisioner.chown('', '/home')
+
+
+def test_provisioner_apply(tmp_path, owner: t.Tuple[int, int]):
+    '''
+    Are all users created at once and permissions changed natively?
+    '''
+
+    home = tmp_path / 'plato'
+
+    (home / 'notebooks').mkdir(parents=True)
+    (home / 'notebooks' / 'lab.ipynb').touch()
+
+    provisioner = Provisioner()
+
+    provisioner.add_user('plato')
+    provisioner.add_user('zeno')
+    provisioner.chown('plato', home)
+    provisioner.chown('zeno', tmp_path / 'missing')
+    provisioner.chmod(700, home)
+
+    with mock.patch.object(system, 'create_users', return_value=[]) as create_users, \
+            mock.patch.object(system, 'get_ids', return_value=owner), \
+            mock.patch('moodle.integration.provision.os.makedirs') as makedirs, \
+            mock.patch('moodle.integration.system.os.system') as os_system:
+
+        summary = provisioner.apply()
+
+    create_users.assert_called_once_with(['plato', 'zeno'])
+
+    makedirs.assert_has_calls([
+        mock.call('/home/plato', exist_ok=True),
+        mock.call('/home/zeno', exist_ok=True),
+    ])
+
+    os_system.assert_not_called()
+
+    # plato is a new user, so the whole home is verified
+    assert summary == {'users': 2, 'chown': 1, 'scanned': 3, 'fixed': 0, 'chmod': 1}
+
+    assert os.stat(home).st_mode & 0o777 == 0o700
+
+    # queue is empty after applying
+    assert not provisioner
+
+
+def test_provisioner_tracks_failed_users(tmp_path):
+    '''
+    Are users which could not be created or given their home remembered?
+    '''
+
+    provisioner = Provisioner()
+
+    provisioner.add_user('zeno')
+    provisioner.chown('thales', tmp_path)
+
+    with mock.patch.object(system, 'create_users', return_value=['zeno']), \
+            mock.patch.object(system, 'get_ids', side_effect=KeyError('thales')), \
+            mock.patch('moodle.integration.provision.os.makedirs') as makedirs:
+
+        summary = provisioner.apply()
+
+    makedirs.assert_not_called()
+
+    assert summary['users'] == 0
+    assert provisioner.failed == {'zeno', 'thales'}
+
+
+@pytest.fixture
+def passwd_file(tmp_path) -> str:
+
+    path = tmp_path / 'passwd'
+
+    path.write_text(
+        'root:x:0:0:root:/root:/bin/bash\n'
+        '# comment\n'
+        'plato:x:1000:1001::/home/plato:/bin/bash\n'
+    )
+
+    return str(path)
+
+
+def test_passwd_index(passwd_file: str):
+    '''
+    Does the index parse passwd once and reload it only after a change?
+    '''
+
+    index = system.PasswdIndex(passwd_file)
+
+    with mock.patch.object(index, '_parse', wraps=index._parse) as parse:
+
+        assert 'plato' in index
+        assert 'zeno' not in index
+        assert index.uid('plato') == 1000
+        assert index.gid('plato') == 1001
+        assert index.get('zeno') is None
+        assert list(index) == ['root', 'plato']
+
+        assert parse.call_count == 1
+
+        with open(passwd_file, 'a') as f:
+            f.write('zeno:x:1001:1001::/home/zeno:/bin/bash\n')
+
+        assert 'zeno' in index
+        assert len(index) == 3
+
+        assert parse.call_count == 2
+
+    with pytest.raises(KeyError):
+        index.uid('thales')
+
+    assert 'root' not in system.PasswdIndex(passwd_file + '.missing')
+
+
+@pytest.mark.skipif(os.getuid() != 0, reason='Changing owner requires root.')
+def test_reconcile_owner(tmp_path):
+    '''
+    Is a tree walked only if its top entry has a wrong owner
+    or deep verification is requested, and only mismatched entries fixed?
+    '''
+
+    home = tmp_path / 'home'
+
+    (home / 'a' / 'b').mkdir(parents=True)
+    (home / 'a' / 'b' / 'lab.ipynb').touch()
+    (home / 'notes.txt').touch()
+
+    os.chown(home / 'notes.txt', 1234, 1234)
+
+    assert system.reconcile_owner(home, 0, 0) == (1, 0)
+
+    assert system.reconcile_owner(home, 0, 0, deep=True) == (5, 1)
+
+    assert os.stat(home / 'notes.txt').st_uid == 0
+
+    assert system.reconcile_owner(home, 1234, 1234) == (5, 5)
+
+    assert system.reconcile_owner(home, 1234) == (1, 0)
+
+    assert os.stat(home / 'a' / 'b' / 'lab.ipynb').st_uid == 1234
+
+
+def test_create_users_single_batch(passwd_file: str):
+    '''
+    Does create_users skip existing users and call newusers once?
+    Are names rejected by useradd, and users of a failed batch,
+    created one by one?
+    '''
+
+    index = system.PasswdIndex(passwd_file)
+
+    def _newusers(args: t.List[str], input: str, **kwargs: t.Any) -> None:
+
+        if args == ['newusers']:
+            with open(passwd_file, 'a') as f:
+                f.write(''.join(
+                    f'{line.split(":")[0]}:x:2000:2000::/home/{line.split(":")[0]}:/bin/bash\n'
+                    for line in input.splitlines()))
+
+    with mock.patch.object(system, 'passwd', index), \
+            mock.patch.object(system.shutil, 'which', return_value='/usr/sbin/newusers'), \
+            mock.patch.object(system.subprocess, 'run', side_effect=_newusers) as run, \
+            mock.patch.object(system, 'copy_skel') as copy_skel, \
+            mock.patch.object(system, 'create_user') as create_user:
+
+        system.create_users(['root', 'aristotle', 'zeno', 'sókratēs'])
+
+        assert run.call_count == 2
+
+        newusers, chpasswd = run.call_args_list
+
+        assert newusers[0][0] == ['newusers']
+        assert [line.split(':')[0] for line in newusers[1]['input'].splitlines()] == ['aristotle', 'zeno']
+
+        assert chpasswd[0][0] == ['chpasswd', '-e']
+        assert chpasswd[1]['input'] == 'aristotle:!\nzeno:!\n'
+
+        assert copy_skel.call_args_list == [mock.call('aristotle'), mock.call('zeno')]
+
+        create_user.assert_called_once_with('sókratēs')
+
+        run.reset_mock(side_effect=True)
+        copy_skel.reset_mock()
+        create_user.reset_mock()
+
+        run.side_effect = subprocess.CalledProcessError(1, 'newusers')
+
+        system.create_users(['heraclitus', 'thales'])
+
+        run.assert_called_once()
+        copy_skel.assert_not_called()
+
+        assert create_user.call_args_list == [mock.call('heraclitus'), mock.call('thales')]
+
+
+def test_create_user_failure_is_skipped():
+    '''
+    Does a rejected or broken account not stop the creation of the others?
+    '''
+
+    def _adduser(args: t.List[str], **kwargs: t.Any) -> subprocess.CompletedProcess:
+        return subprocess.CompletedProcess(args, 1 if args[-1] == 'sókratēs' else 0)
+
+    with mock.patch.object(system, 'passwd', system.PasswdIndex('/nonexistent')), \
+            mock.patch.object(system.shutil, 'which', return_value=None), \
+            mock.patch.object(system.subprocess, 'run', side_effect=_adduser), \
+            mock.patch.object(system, 'chmod'), \
+            mock.patch.object(system, 'chown', side_effect=[None, KeyError('zeno')]):
+
+        # adduser rejects the first one, the second one has no passwd entry
+        assert system.create_users(['sókratēs', 'plato', 'zeno']) == ['sókratēs', 'zeno']
+
+
+
+def test_copy_skel(tmp_path: Path):
+    '''
+    Is /etc/skel copied without overwriting files of the user?
+    '''
+
+    skel, home = tmp_path / 'skel', tmp_path / 'home' / 'plato'
+
+    (skel / '.config').mkdir(parents=True)
+    (skel / '.config' / 'settings').write_text('skel')
+    (skel / '.bashrc').write_text('skel')
+
+    home.mkdir(parents=True)
+    (home / '.bashrc').write_text('own')
+
+    with mock.patch.object(system, 'SKEL_DIR', str(skel)), \
+            mock.patch.object(system, 'passwd') as index, \
+            mock.patch.object(system, 'chown_tree') as chown_tree:
+
+        index.uid.return_value, index.gid.return_value = 2000, 2000
+
+        system.copy_skel('plato', home)
+
+    assert (home / '.bashrc').read_text() == 'own'
+    assert (home / '.config' / 'settings').read_text() == 'skel'
+
+    chown_tree.assert_called_once_with(str(home), 2000, 2000)
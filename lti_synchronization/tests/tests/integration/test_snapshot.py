@@ -0,0 +1,210 @@
+import typing as t
+from unittest import mock
+
+import pytest
+
+from moodle.integration.manager import SyncManager
+from moodle.integration.snapshot import Snapshot
+from moodle.utils import JsonDict
+
+
+def make_user(username: str, role: str = 'student', **fields: t.Any) -> JsonDict:
+    return JsonDict({
+        'id': fields.get('id', 1),
+        'username': username,
+        'email': fields.get('email', f'{username}@mail.com'),
+        'first_name': fields.get('first_name', username),
+        'last_name': '',
+        'role': role,
+    })
+
+
+def make_course(course_id: str = 'foo', *, students=(), graders=(), instructors=(), **fields) -> JsonDict:
+    return JsonDict({
+        'id': fields.get('id', 1),
+        'course_id': course_id,
+        'title': course_id.title(),
+        'category': 1,
+        'need_nbgrader': fields.get('need_nbgrader', False),
+        'lms_lineitems_endpoint': 'https://moodle/lineitems',
+        'students': list(students),
+        'graders': list(graders),
+        'instructors': list(instructors),
+    })
+
+
+def test_new_course_diff():
+    '''
+    Is every user of a course unknown to the snapshot added?
+    '''
+
+    diff = Snapshot().diff_course(
+        make_course(students=[make_user('plato')], graders=[make_user('socrates', 'teacher')]))
+
+    assert diff.new
+    assert diff.added == {'plato', 'socrates'}
+    assert diff.touched == diff.added
+    assert not diff.removed
+
+
+def test_course_diff():
+    '''
+    Does the snapshot detect added, removed, and updated users?
+    '''
+
+    snapshot = Snapshot()
+
+    snapshot.add(make_course(students=[make_user('plato'), make_user('zeno'), make_user('thales')]))
+
+    assert not snapshot.diff_course(
+        make_course(students=[make_user('thales'), make_user('zeno'), make_user('plato')]))
+
+    diff = snapshot.diff_course(make_course(
+        students=[make_user('zeno', email='zeno@elea.gr'), make_user('aristotle')],
+        graders=[make_user('plato', 'teacher')],
+    ))
+
+    assert not diff.new and not diff.changed
+    assert diff.added == {'aristotle'}
+    assert diff.removed == {'thales'}
+    assert diff.updated == {'plato', 'zeno'}
+
+    assert snapshot.diff_course(make_course(need_nbgrader=True)).changed
+
+
+def test_snapshot_save_load(tmp_path):
+
+    path = tmp_path / 'snapshot.json'
+
+    assert Snapshot.load(path).courses == {}
+
+    snapshot = Snapshot()
+    snapshot.add(make_course(students=[make_user('plato')]))
+    snapshot.save(path)
+
+    loaded = Snapshot.load(path)
+
+    assert loaded.courses == snapshot.courses
+    assert loaded.users == snapshot.users
+
+    # an interrupted save keeps the previous snapshot
+    snapshot.add(make_course('bar'))
+
+    with mock.patch('moodle.integration.system.os.replace', side_effect=OSError('disk full')):
+
+        with pytest.raises(OSError):
+            snapshot.save(path)
+
+    assert Snapshot.load(path).courses == loaded.courses
+
+    path.write_text('{corrupted')
+
+    assert Snapshot.load(path).courses == {}
+
+
+def test_discard_user():
+    '''
+    Is a forgotten user added to the course again?
+    '''
+
+    snapshot = Snapshot()
+
+    snapshot.add(make_course(students=[make_user('plato'), make_user('zeno')]))
+
+    snapshot.discard_user('zeno')
+
+    assert 'zeno' not in snapshot.users
+
+    diff = snapshot.diff_course(make_course(students=[make_user('plato'), make_user('zeno')]))
+
+    assert diff.added == {'zeno'}
+    assert not diff.removed
+
+
+@pytest.fixture
+def system() -> t.Generator[mock.Mock, None, None]:
+
+    with mock.patch('moodle.integration.manager.system') as mock_system, \
+            mock.patch('moodle.integration.manager.Provisioner'):
+
+        yield mock_system
+
+
+def test_incremental_sync(tmp_path, system: mock.Mock):
+    '''
+    Does the incremental manager touch only changed users,
+    and leave the config file alone when nothing has changed?
+    '''
+
+    snapshot_path = tmp_path / 'snapshot.json'
+    out_file = tmp_path / 'jupyterhub_config.py'
+
+    def sync(*courses: JsonDict) -> SyncManager:
+
+        manager = SyncManager(incremental=True, snapshot_path=snapshot_path)
+
+        with mock.patch.object(manager, 'helper') as helper, \
+                mock.patch.object(manager, 'temp') as temp:
+
+            helper.skip_course.return_value = False
+            helper.get_user_group.side_effect = lambda u: 'students' if u.role == 'student' else 'graders'
+
+            temp.update_jupyterhub_config.side_effect = lambda *_, **__: out_file.write_text('')
+
+            manager.update_jupyterhub(courses=list(courses), out_file=out_file)
+
+            manager.added_students = [
+                [user['username'] for user in c[0][1]] for c in helper.add_students.call_args_list]
+            manager.config_written = temp.update_jupyterhub_config.called
+
+        return manager
+
+    manager = sync(make_course(students=[make_user('plato'), make_user('zeno')]))
+
+    assert manager.added_students == [['plato', 'zeno']]
+    assert manager.config_written
+    assert snapshot_path.exists()
+
+    manager = sync(make_course(students=[make_user('plato'), make_user('zeno')]))
+
+    assert manager.added_students == []
+    assert not manager.config_written
+    assert manager.whitelist == {'plato', 'zeno'}
+
+    manager = sync(make_course(students=[make_user('plato'), make_user('thales')]))
+
+    assert manager.added_students == [['plato', 'thales']]
+    assert manager.config_written
+    assert manager.diff.summary()['removed_users'] == 1
+
+    manager = sync(make_course('bar'))
+
+    assert manager.diff.removed_courses == {'foo'}
+
+
+def test_incremental_sync_retries_failed_users(tmp_path, system: mock.Mock):
+    '''
+    Are users whose provisioning failed left out of the snapshot,
+    so the next synchronization provisions them again?
+    '''
+
+    snapshot_path = tmp_path / 'snapshot.json'
+
+    course = make_course(students=[make_user('plato'), make_user('zeno')])
+
+    manager = SyncManager(incremental=True, snapshot_path=snapshot_path)
+
+    manager.provisioner.failed = {'zeno'}
+
+    with mock.patch.object(manager, 'helper') as helper, \
+            mock.patch.object(manager, 'temp'):
+
+        helper.skip_course.return_value = False
+        helper.get_user_group.return_value = 'students'
+
+        manager.update_jupyterhub(courses=[course], out_file=tmp_path / 'jupyterhub_config.py')
+
+    snapshot = Snapshot.load(snapshot_path)
+
+    assert set(snapshot.users) == {'plato'}
+    assert snapshot.diff_course(course).added == {'zeno'}
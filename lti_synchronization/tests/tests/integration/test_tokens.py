@@ -0,0 +1,49 @@
+import os
+import stat
+from pathlib import Path
+
+from moodle.integration.tokens import TokenStore
+
+
+def test_tokens_are_kept_across_syncs(tmp_path: Path):
+    '''
+    Does a course keep its token, unless the token was rotated,
+    and are tokens of removed courses revoked?
+    '''
+
+    path = tmp_path / 'tokens.json'
+
+    store = TokenStore.load(path)
+
+    foo, bar = store.get('foo'), store.get('bar')
+
+    assert foo != bar and len(foo) == 64
+
+    # a table written with looser permissions is tightened
+    path.write_text('{}')
+    path.chmod(0o644)
+
+    store.save(path)
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    # the file is replaced, not truncated in place
+    assert os.listdir(tmp_path) == ['tokens.json']
+
+    store = TokenStore.load(path)
+
+    assert store.get('foo') == foo
+    assert not store.changed
+
+    rotated = store.rotate('bar')
+
+    assert rotated != bar
+    assert store.get('bar') == rotated
+    assert store.release_unused() == set()
+
+    store = TokenStore({'foo': foo, 'baz': 'token'})
+
+    store.get('foo')
+
+    assert store.release_unused() == {'baz'}
+    assert store.changed
@@ -1,12 +1,21 @@
+import asyncio
+import json
 import os
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pem
 import pytest
-from moodle.lti13.auth import get_lms_access_token, get_pem_text_from_file
+from moodle.lti13.auth import (get_lms_access_token, get_pem_text_from_file,
+                               get_signing_key, signing_keys, token_cache)
 from tornado.httpclient import AsyncHTTPClient
 
 
+@pytest.fixture(autouse=True)
+def clear_token_cache() -> None:
+    token_cache.clear()
+    signing_keys.clear()
+
+
 def test_no_pem_file():
     '''
     Does get_pem_text_from_file raises PermissionError if a pem file is unavailable?
@@ -67,3 +76,72 @@ async def test_get_lms_access_token(
     await get_lms_access_token('url', pem_key, 'client-id')
 
     assert mock_get_pem_text.called
+
+
+@pytest.mark.asyncio
+async def test_get_lms_access_token_is_cached():
+    '''
+    Does get_lms_access_token request a token once per key,
+    even when called concurrently, and refresh an expired one?
+    '''
+
+    token = {'token_type': 'Bearer', 'access_token': 'abc', 'expires_in': 3600}
+
+    async def request(*args):
+        await asyncio.sleep(0)
+        return token
+
+    with patch('moodle.lti13.auth.request_lms_access_token', AsyncMock(side_effect=request)) as mock_request:
+
+        results = await asyncio.gather(
+            *(get_lms_access_token('url', 'key.pem', 'client-id') for _ in range(5)))
+
+        assert results == [token] * 5
+        assert mock_request.call_count == 1
+
+        await get_lms_access_token('url', 'key.pem', 'client-id', 'other-scope')
+
+        assert mock_request.call_count == 2
+
+        with patch('moodle.lti13.auth.time.monotonic', return_value=1e12):
+            await get_lms_access_token('url', 'key.pem', 'client-id')
+
+        assert mock_request.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_get_lms_access_token_without_expiration_is_not_cached():
+
+    token = {'token_type': 'Bearer', 'access_token': 'abc'}
+
+    with patch('moodle.lti13.auth.request_lms_access_token', AsyncMock(return_value=token)) as mock_request:
+
+        await get_lms_access_token('url', 'key.pem', 'client-id')
+        await get_lms_access_token('url', 'key.pem', 'client-id')
+
+        assert mock_request.call_count == 2
+
+
+def test_signing_key_is_reloaded_when_file_changes(lti13_config_environ: None, tmp_path):
+    '''
+    Is the pem file parsed once and reloaded only when it has changed?
+    '''
+
+    key_path = str(tmp_path / 'private.pem')
+
+    with open(os.environ['LTI13_PRIVATE_KEY']) as src, open(key_path, 'w') as dst:
+        dst.write(src.read())
+
+    with patch('moodle.lti13.auth.get_pem_text_from_file', wraps=get_pem_text_from_file) as mock_parse:
+
+        key = get_signing_key(key_path)
+
+        assert get_signing_key(key_path) is key
+        assert mock_parse.call_count == 1
+
+        assert json.loads(key.jwks) == {'keys': [key.jwk]}
+
+        os.utime(key_path, ns=(0, 0))
+
+        assert get_signing_key(key_path) is not key
+        assert mock_parse.call_count == 2
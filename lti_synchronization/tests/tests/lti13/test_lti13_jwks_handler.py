@@ -1,3 +1,4 @@
+import json
 import os
 import platform
 from unittest.mock import patch
@@ -39,9 +40,9 @@ async def test_get_method_raises_an_error_without_lti13_private_key(monkeypatch,
 
 
 @patch('tornado.web.RequestHandler.write')
-def test_get_method_calls_write_method_with_a_dict(mock_write_method, jwks_handler: LTI13JWKSHandler):
+def test_get_method_calls_write_method_with_jwks(mock_write_method, jwks_handler: LTI13JWKSHandler):
     '''
-    Does the write method is called with a dict?
+    Does the write method is called with the serialized JWKS?
     '''
 
     jwks_handler.get()
@@ -50,10 +51,10 @@ def test_get_method_calls_write_method_with_a_dict(mock_write_method, jwks_handl
 
     write_args = mock_write_method.call_args[0]
 
-    # make sure we're passing a dict to let tornado
-    # convert it as json with the specific content-type
-    assert write_args[0]
-    assert type(write_args[0]) == dict
+    # the JWKS is serialized once and written as bytes,
+    # so the content-type is set explicitly
+    assert type(write_args[0]) == bytes
+    assert json.loads(write_args[0])['keys']
 
 
 def test_get_method_set_content_type_as_json(jwks_handler: LTI13JWKSHandler):
@@ -2,9 +2,16 @@ echo "Starting synchronization ..."
 
 # source sync.sh
 # source sync.sh --path-out something.json
+# source sync.sh --hub_api
 
 docker exec -it jhub python3 lti_synchronization/cli.py --path_in lti_synchronization/data/courses.json $*
 
+# cli.py exits with 3 if the hub has to be restarted to apply the configuration
+if [ $? -ne 3 ]; then
+    echo "No restart required."
+    return 0 2>/dev/null || exit 0
+fi
+
 echo "Restarting container ..."
 
 docker restart jhub